@@ -14,9 +14,46 @@ class Config(object):
     data_directory = 'data'
     summary_directory = 'board'
     checkpoint_directory = 'trained'
+    code_cache_directory = 'cache'
+    feature_store_directory = 'features'
+    shard_directory = 'shards'
 
+    # 'auto' picks cuda when available, cpu otherwise
+    device = 'auto'
     gpu_cnt = 1
 
+    # 0 keeps the torch default
+    num_threads = 0
+    num_interop_threads = 0
+
+    channels_last = True
+    # pool scoring runs traced, bn-folded and frozen copies of the scoring models
+    export_inference = True
+
+    # int8 scoring on cpu: calibration samples from the labeled set, test samples and minimal spearman for the check
+    quantize_inference = False
+    quantize_backend = 'fbgemm'
+    quantize_calibration = 1000
+    quantize_check_size = 2000
+    quantize_min_correlation = 0.95
+
+    # trials of the mains, run trial_workers at a time in separate processes (1: one after another)
+    trials = 10
+    trial_workers = 1
+    trial_results = 'results.txt'
+
+    # seed of the current trial, set by the mains and part of every artifact key
+    seed = None
+    # load a strategy trained by an earlier run with the same key (config, code, seed) instead of training it
+    reuse_artifacts = False
+
+    # DistributedDataParallel training: local processes (1: off, ignored under torchrun), backend and rendezvous
+    world_size = 1
+    dist_backend = 'gloo'
+    dist_master_addr = '127.0.0.1'
+    dist_master_port = 29500
+    dist_find_unused_parameters = True
+
     epoch = 200
     epochl = 120
     milestones = [160]
@@ -28,6 +65,26 @@ class Config(object):
 
     pin_memory = True
     async_loading = True
+    tensor_dataset = True
+    # loader workers survive epoch boundaries, batches prefetched per worker
+    persistent_workers = True
+    prefetch_factor = 4
+    batch_augment = True
+
+    code_cache_mmap = False
+
+    # batches buffered between pool scoring stages, print per-stage busy / idle time
+    pipeline_depth = 4
+    pipeline_stats = False
+
+    # pool scoring split across the torch.distributed ranks: local top-k merged, per-sample outputs gathered
+    shard_scoring = True
+
+    # npz data_list datasets (task.dataset.classification_dataset) read from packed shards
+    packed_dataset = False
+    # samples per packed shard file, and samples announced ahead of a sequential reader
+    shard_size = 10000
+    shard_read_ahead = 256
 
     #############################################
     vae_batch_size = 1024
@@ -47,3 +104,15 @@ class Config(object):
     vae_distance = 2.
 
     vae_learning_rate = 1e-3
+
+    # augmented views per labeled sample cached for transformer strategy training
+    transformer_cache_views = 4
+
+    # augmented views per sample in the strategy_v2 feature-map store
+    feature_store_views = 2
+
+    # seed the augmentation of every (sample, view) pair so ae teacher targets can be computed once per view
+    # off by default: the task would then only ever see teacher_views fixed augmentations of each sample instead of
+    # a fresh random crop / flip per epoch, which changes what it learns
+    deterministic_views = False
+    teacher_views = 4
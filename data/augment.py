@@ -0,0 +1,101 @@
+import math
+
+import numpy as np
+
+import torch
+import torch.nn.functional as F
+
+
+class BatchAugment(object):
+    """
+    flip / pad-crop / normalize / erasing on a whole uint8 [B, C, H, W] batch with per-sample random parameters
+    same semantics as RandomHorizontalFlip, RandomCrop(padding), ToTensor + Normalize and RandomErasing(value=0)
+    applied one sample at a time, in that order
+    seed: private generator for reproducible draws, None draws from the global torch rng (seeded by the mains)
+    """
+    def __init__(self, mean, std, flip=True, padding=4, erasing=None, seed=None):
+        self.mean = torch.tensor(mean).view(1, -1, 1, 1)
+        self.std = torch.tensor(std).view(1, -1, 1, 1)
+
+        self.flip = flip
+        self.padding = padding
+        # (p, scale, ratio) of RandomErasing
+        self.erasing = erasing
+
+        self.generator = None
+        if seed is not None:
+            self.generator = torch.Generator()
+            self.generator.manual_seed(seed)
+
+    def _rand(self, *size):
+        return torch.rand(size, generator=self.generator)
+
+    def __call__(self, images):
+        batch_size, _, height, width = images.shape
+        device = images.device
+
+        if self.flip:
+            flip = (self._rand(batch_size) < 0.5).to(device).view(-1, 1, 1, 1)
+            images = torch.where(flip, images.flip(3), images)
+
+        if self.padding:
+            images = self.crop(images, height, width)
+
+        images = images.float().div_(255.).sub_(self.mean.to(device)).div_(self.std.to(device))
+
+        if self.erasing is not None:
+            images = images.masked_fill(self.erase_mask(batch_size, height, width).to(device).unsqueeze(1), 0.)
+
+        return images
+
+    def collate(self, batch):
+        """
+        collate_fn for datasets without transform: (PIL / HWC uint8 image, target) pairs -> augmented batch
+        """
+        images = torch.stack([torch.from_numpy(np.array(image, dtype=np.uint8)).permute(2, 0, 1) for image, _ in batch])
+        targets = torch.as_tensor([target for _, target in batch], dtype=torch.long)
+
+        return self(images), targets
+
+    def crop(self, images, height, width):
+        batch_size = images.size(0)
+        padded = F.pad(images, [self.padding] * 4)
+
+        offset = (self._rand(batch_size, 2) * (2 * self.padding + 1)).long().to(images.device)
+        rows = offset[:, 0:1] + torch.arange(height, device=images.device)
+        cols = offset[:, 1:2] + torch.arange(width, device=images.device)
+
+        index = torch.arange(batch_size, device=images.device).view(-1, 1, 1, 1)
+        channel = torch.arange(images.size(1), device=images.device).view(1, -1, 1, 1)
+
+        return padded[index, channel, rows.view(batch_size, 1, -1, 1), cols.view(batch_size, 1, 1, -1)]
+
+    def erase_mask(self, batch_size, height, width, attempts=10):
+        """
+        [B, H, W] mask of the erased rectangles, the first of `attempts` draws that fits wins as in RandomErasing
+        """
+        p, scale, ratio = self.erasing
+        area = height * width
+
+        target_area = area * (scale[0] + self._rand(batch_size, attempts) * (scale[1] - scale[0]))
+        log_ratio = math.log(ratio[0]) + self._rand(batch_size, attempts) * (math.log(ratio[1]) - math.log(ratio[0]))
+        aspect_ratio = torch.exp(log_ratio)
+
+        h = torch.round(torch.sqrt(target_area * aspect_ratio)).long()
+        w = torch.round(torch.sqrt(target_area / aspect_ratio)).long()
+
+        fits = (h < height) & (w < width)
+        first = torch.argmax(fits.int(), dim=1)
+        h, w = h.gather(1, first.view(-1, 1)).view(-1), w.gather(1, first.view(-1, 1)).view(-1)
+
+        erase = (self._rand(batch_size) < p) & fits.any(dim=1)
+
+        top = (self._rand(batch_size) * (height - h + 1).float()).long()
+        left = (self._rand(batch_size) * (width - w + 1).float()).long()
+
+        rows = torch.arange(height).view(1, -1)
+        cols = torch.arange(width).view(1, -1)
+        row_mask = (rows >= top.view(-1, 1)) & (rows < (top + h).view(-1, 1))
+        col_mask = (cols >= left.view(-1, 1)) & (cols < (left + w).view(-1, 1))
+
+        return erase.view(-1, 1, 1) & row_mask.unsqueeze(2) & col_mask.unsqueeze(1)
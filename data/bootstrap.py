@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from torchvision.datasets.vision import VisionDataset
+
+
+def cache_directory(dataset_class, root):
+    return os.path.join(root, dataset_class.base_folder + '-cache')
+
+
+def split_name(train):
+    return 'train' if train else 'test'
+
+
+def source_files(dataset_class, root, train):
+    """
+    (path, md5) of the torchvision files the split is built from
+    """
+    files = dataset_class.train_list if train else dataset_class.test_list
+    files = list(files) + [[dataset_class.meta['filename'], dataset_class.meta['md5']]]
+
+    return [(os.path.join(root, dataset_class.base_folder, name), md5) for name, md5 in files]
+
+
+def fingerprint(path, md5=None):
+    """
+    size / mtime of a file, md5 computed only when not already known to be verified
+    """
+    stat = os.stat(path)
+    if md5 is None:
+        with open(path, 'rb') as f:
+            md5 = hashlib.md5(f.read()).hexdigest()
+
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'md5': md5}
+
+
+def cache_files(directory, split):
+    return [os.path.join(directory, f'{split}_data.npy'), os.path.join(directory, f'{split}_targets.npy')]
+
+
+def manifest_valid(manifest, files, directory, split):
+    """
+    a cheap stat per file, the recorded hash stays valid as long as size and mtime do
+    the cached arrays themselves must still be there
+    """
+    if not all(os.path.exists(path) for path in cache_files(directory, split)):
+        return False
+
+    for path, _ in files:
+        record = manifest['files'].get(path)
+        if record is None or not os.path.exists(path):
+            return False
+
+        stat = os.stat(path)
+        if (stat.st_size, stat.st_mtime_ns) != (record['size'], record['mtime']):
+            return False
+
+    return True
+
+
+def atomic_save(file_name, array):
+    """
+    write next to the target and rename: another process (parallel trials, other ranks) may already have the
+    previous file memory-mapped, truncating it in place would pull the pages from under it
+    """
+    tmp_name = f'{file_name}.{os.getpid()}.tmp'
+    with open(tmp_name, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_name, file_name)
+
+
+def write_cache(dataset, directory, split, files):
+    os.makedirs(directory, exist_ok=True)
+
+    data_file, targets_file = cache_files(directory, split)
+    atomic_save(data_file, np.ascontiguousarray(dataset.data))
+    atomic_save(targets_file, np.asarray(dataset.targets, dtype=np.int64))
+
+    # torchvision just verified the md5 of every source file, only size / mtime are new
+    manifest = {'files': {path: fingerprint(path, md5) for path, md5 in files}, 'classes': list(dataset.classes)}
+
+    # the manifest goes last and atomically, a reader never sees it before the arrays are complete
+    file_name = os.path.join(directory, f'{split}.json')
+    with open(f'{file_name}.{os.getpid()}.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(f'{file_name}.{os.getpid()}.tmp', file_name)
+
+
+def ensure_cache(dataset_class, root, train=True, download=True):
+    """
+    torchvision CIFAR construction re-hashes every batch file each time, here that happens once:
+    the first call goes through torchvision (download + md5 check) and caches the arrays with a manifest,
+    later calls only stat the source files
+    return: (cache directory, split name, manifest, the torchvision dataset when it had to be built else None)
+    """
+    directory = cache_directory(dataset_class, root)
+    split = split_name(train)
+    files = source_files(dataset_class, root, train)
+
+    manifest = None
+    if os.path.exists(os.path.join(directory, f'{split}.json')):
+        with open(os.path.join(directory, f'{split}.json')) as f:
+            manifest = json.load(f)
+
+    dataset = None
+    if manifest is None or not manifest_valid(manifest, files, directory, split):
+        dataset = dataset_class(root, train=train, download=download)
+        write_cache(dataset, directory, split, files)
+
+        with open(os.path.join(directory, f'{split}.json')) as f:
+            manifest = json.load(f)
+
+    return directory, split, manifest, dataset
+
+
+def load_split(dataset_class, root, train=True, download=True):
+    """
+    dataset_class instance of the split, built from the memory-mapped cache once it has been verified
+    """
+    directory, split, manifest, dataset = ensure_cache(dataset_class, root, train, download)
+    if dataset is not None:
+        return dataset
+
+    dataset = dataset_class.__new__(dataset_class)
+    VisionDataset.__init__(dataset, root)
+
+    dataset.train = train
+    data_file, targets_file = cache_files(directory, split)
+    dataset.data = np.load(data_file, mmap_mode='r')
+    dataset.targets = np.load(targets_file).tolist()
+
+    dataset.classes = manifest['classes']
+    dataset.class_to_idx = {name: i for i, name in enumerate(dataset.classes)}
+
+    # subclasses with state of their own derived from the arrays (Dataset_CIFAR*)
+    if hasattr(dataset, 'prepare'):
+        dataset.prepare()
+
+    return dataset
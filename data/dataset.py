@@ -1,8 +1,30 @@
+import random
 from PIL import Image
 
-from torchvision import transforms
+import numpy as np
+
+import torch
+from torch.utils.data import DataLoader, Dataset
 from torchvision.datasets import CIFAR100, CIFAR10
 
+from data.registry import channels_first
+from data.sampler import Sampler, shuffle_seed
+from utils.distributed import shard_indices
+from utils.runtime import get_device
+
+CIFAR_MEAN = [0.4914, 0.4822, 0.4465]
+CIFAR_STD = [0.2023, 0.1994, 0.2010]
+
+
+def normalize_split(data, mean=CIFAR_MEAN, std=CIFAR_STD):
+    """
+    uint8 [N, H, W, C] images -> normalized float [N, C, H, W] tensor in shared memory, ToTensor + Normalize at once
+    """
+    origin = torch.from_numpy(np.ascontiguousarray(data)).permute(0, 3, 1, 2).float().div_(255.)
+    origin = origin.sub_(torch.tensor(mean).view(1, -1, 1, 1)).div_(torch.tensor(std).view(1, -1, 1, 1))
+
+    return origin.contiguous().share_memory_()
+
 
 class Dataset_CIFAR10(CIFAR10):
     def __init__(self, root, train=True, transform=None, target_transform=None, download=False):
@@ -10,20 +32,32 @@ class Dataset_CIFAR10(CIFAR10):
         super(Dataset_CIFAR10, self).__init__(root, download=download, train=train, transform=transform,
                                               target_transform=target_transform)
 
+        self.prepare()
+
+    def prepare(self):
+        # one holder for the registry's copies of the dataset, filled on first access
+        self._origin = [None]
+
+    @property
+    def origin(self):
+        """
+        the deterministic origin view of the whole split, in shared memory for the loader workers
+        built lazily, tensor-resident callers (Tensor_CIFAR) never read it
+        """
+        if self._origin[0] is None:
+            self._origin[0] = normalize_split(self.data)
+
+        return self._origin[0]
+
     def __getitem__(self, index):
         img, target = self.data[index], self.targets[index]
 
-        origin = Image.fromarray(img)
-
         if self.transform is not None:
-            trans = self.transform(origin)
+            trans = self.transform(Image.fromarray(img))
         else:
-            trans = origin
-
-        origin = transforms.ToTensor()(origin)
-        origin = transforms.Normalize([0.4914, 0.4822, 0.4465], [0.2023, 0.1994, 0.2010])(origin)
+            trans = Image.fromarray(img)
 
-        return {'origin': origin, 'trans': trans, 'target': target}
+        return {'origin': self.origin[index], 'trans': trans, 'target': target}
 
 
 class Dataset_CIFAR100(CIFAR100):
@@ -32,17 +66,179 @@ class Dataset_CIFAR100(CIFAR100):
         super(Dataset_CIFAR100, self).__init__(root, download=download, train=train, transform=transform,
                                                target_transform=target_transform)
 
+        self.prepare()
+
+    def prepare(self):
+        # one holder for the registry's copies of the dataset, filled on first access
+        self._origin = [None]
+
+    @property
+    def origin(self):
+        """
+        the deterministic origin view of the whole split, in shared memory for the loader workers
+        built lazily, tensor-resident callers (Tensor_CIFAR) never read it
+        """
+        if self._origin[0] is None:
+            self._origin[0] = normalize_split(self.data)
+
+        return self._origin[0]
+
     def __getitem__(self, index):
         img, target = self.data[index], self.targets[index]
 
-        origin = Image.fromarray(img)
-
         if self.transform is not None:
-            trans = self.transform(origin)
+            trans = self.transform(Image.fromarray(img))
         else:
-            trans = origin
+            trans = Image.fromarray(img)
+
+        return {'origin': self.origin[index], 'trans': trans, 'target': target}
+
+
+class ViewDataset(Dataset):
+    """
+    deterministic augmentation: item `key` is sample key % N under view key // N, with the random transform seeded
+    by the key, so a (sample, view) pair always gives the same image and whatever is computed from it can be cached
+    """
+    def __init__(self, dataset, seed=0):
+        self.dataset = dataset
+        self.seed = seed
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def key(self, index, view):
+        return view * len(self.dataset) + index
 
-        origin = transforms.ToTensor()(origin)
-        origin = transforms.Normalize([0.4914, 0.4822, 0.4465], [0.2023, 0.1994, 0.2010])(origin)
+    def __getitem__(self, key):
+        torch_state, random_state = torch.get_rng_state(), random.getstate()
+        torch.manual_seed(self.seed + key)
+        random.seed(self.seed + key)
+        try:
+            inputs, target = self.dataset[key % len(self.dataset)]
+        finally:
+            torch.set_rng_state(torch_state)
+            random.setstate(random_state)
 
-        return {'origin': origin, 'trans': trans, 'target': target}
+        return inputs, target, key
+
+
+class Tensor_CIFAR(object):
+    """
+    cifar split kept as one contiguous uint8 [N, 3, H, W] tensor, for passes without random augmentation
+    a batch is an index gather, one copy to the device and a single vectorized float conversion + normalization there
+    """
+    def __init__(self, dataset, mean=CIFAR_MEAN, std=CIFAR_STD, pin_memory=False):
+        self.data = channels_first(dataset.data)
+        self.targets = torch.as_tensor(dataset.targets, dtype=torch.long)
+
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+
+        self.mean = torch.tensor(mean).view(1, -1, 1, 1)
+        self.std = torch.tensor(std).view(1, -1, 1, 1)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        return self.normalize(self.data[index:index + 1])[0], int(self.targets[index])
+
+    def normalize(self, inputs):
+        mean, std = self.mean.to(inputs.device), self.std.to(inputs.device)
+
+        return inputs.float().div_(255.).sub_(mean).div_(std)
+
+    def batch(self, indices, device='cpu', non_blocking=False, augment=None, paired=False):
+        """
+        augment: BatchAugment run on the device instead of the plain normalization
+        paired: Dataset_CIFAR style {'origin', 'trans', 'target'} batch, trans being the augmented view
+        """
+        indices = torch.as_tensor(np.asarray(indices, dtype=np.int64))
+
+        inputs, targets = self.data.index_select(0, indices), self.targets.index_select(0, indices)
+        if self.pin_memory and torch.device(device).type == 'cuda':
+            inputs, targets = inputs.pin_memory(), targets.pin_memory()
+
+        inputs = inputs.to(device, non_blocking=non_blocking)
+        targets = targets.to(device, non_blocking=non_blocking)
+
+        if paired:
+            trans = augment(inputs) if augment is not None else self.normalize(inputs)
+            return {'origin': self.normalize(inputs), 'trans': trans, 'target': targets}
+
+        if augment is not None:
+            return [augment(inputs), targets]
+
+        return [self.normalize(inputs), targets]
+
+    def loader(self, indices, batch_size, device='cpu', non_blocking=False, augment=None, shuffle=False,
+               paired=False, shard=False):
+        return TensorLoader(self, indices, batch_size, device, non_blocking, augment, shuffle, paired, shard)
+
+
+class TensorLoader(object):
+    """
+    DataLoader stand-in over a Tensor_CIFAR, yields [inputs, targets] batches in the order of `indices`
+    (reshuffled on every pass with shuffle, this rank's share only with shard)
+    """
+    def __init__(self, dataset, indices, batch_size, device='cpu', non_blocking=False, augment=None, shuffle=False,
+                 paired=False, shard=False):
+        self.dataset = dataset
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.batch_size = batch_size
+        self.device = device
+        self.non_blocking = non_blocking
+        self.augment = augment
+        self.shuffle = shuffle
+        self.paired = paired
+        self.shard = shard
+
+        # drawn on the first shuffled pass, loaders that never shuffle draw nothing
+        self.seed = None
+        self.epoch = 0
+
+    def __len__(self):
+        size = len(shard_indices(self.indices)) if self.shard else len(self.indices)
+
+        return (size + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        indices = self.indices
+        if self.shuffle:
+            # same permutation on every rank, so the shards stay disjoint
+            if self.seed is None:
+                self.seed = shuffle_seed(self.shard)
+            indices = indices[np.random.RandomState((self.seed + self.epoch) % (2 ** 32)).permutation(len(indices))]
+            self.epoch += 1
+
+        if self.shard:
+            indices = shard_indices(indices)
+
+        for start in range(0, len(indices), self.batch_size):
+            yield self.dataset.batch(indices[start:start + self.batch_size], self.device, self.non_blocking,
+                                     self.augment, self.paired)
+
+
+def make_loader(dataset, indices, batch_size, config, num_workers=0, augment=None, shuffle=False, paired=False,
+                shard=False):
+    """
+    loader over `indices`, tensor-resident datasets skip the per-sample PIL / ToTensor path
+    augment / paired only apply to tensor-resident datasets, other datasets carry their own transform
+    build it once per trainer: with workers they stay alive across epochs (config.persistent_workers) and the
+    sampler reshuffles in place, so an epoch boundary forks nothing
+    shard: under torch.distributed every rank sees its own share of `indices` (sharded training and pool scoring)
+    """
+    device = get_device(config)
+    if isinstance(dataset, Tensor_CIFAR):
+        return dataset.loader(indices, batch_size, device, config.async_loading, augment, shuffle, paired, shard)
+
+    kwargs = {}
+    if num_workers > 0:
+        kwargs = {'persistent_workers': config.persistent_workers, 'prefetch_factor': config.prefetch_factor}
+
+        # build the lazy origin view before the workers start, so they share one copy instead of each building theirs
+        if isinstance(dataset, (Dataset_CIFAR10, Dataset_CIFAR100)):
+            dataset.origin
+
+    return DataLoader(dataset, batch_size=batch_size, num_workers=num_workers,
+                      pin_memory=config.pin_memory and device.type == 'cuda',
+                      sampler=Sampler(indices, shuffle, shard=shard), **kwargs)
@@ -0,0 +1,88 @@
+import os
+
+import numpy as np
+
+import torch
+
+
+class FeatureStore(object):
+    """
+    on-disk fp16 feature maps, one memory-mapped .npy per layer shaped [n_views, n_samples, C, H, W]
+    view 0 holds the un-augmented image, views 1.. independent augmented draws
+    only the pages a batch touches are read, so pools whose feature maps do not fit in ram are fine
+    `name` must be unique per run: concurrent trials sharing the directory would otherwise rewrite each other's maps
+    """
+    def __init__(self, directory, name, n_samples, n_views=1):
+        self.directory = directory
+        self.name = name
+        self.n_samples = n_samples
+        self.n_views = n_views
+
+        self.layers = []
+
+    def file_name(self, layer):
+        return os.path.join(self.directory, f'{self.name}_layer{layer}.npy')
+
+    def create(self, shapes):
+        """
+        shapes: per-layer feature map shape of one sample, (C, H, W)
+        """
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.layers = [np.lib.format.open_memmap(self.file_name(i), mode='w+', dtype=np.float16,
+                                                 shape=(self.n_views, self.n_samples) + tuple(shape))
+                       for i, shape in enumerate(shapes)]
+
+    def write(self, view, start, features):
+        if not self.layers:
+            self.create([f.shape[1:] for f in features])
+
+        for layer, f in zip(self.layers, features):
+            layer[view, start:start + f.size(0)] = f.detach().half().cpu().numpy()
+
+    def flush(self):
+        for layer in self.layers:
+            layer.flush()
+
+    def seal(self):
+        """
+        end of extraction: flush and reopen the maps read-only
+        """
+        self.flush()
+        self.open()
+
+    def open(self):
+        """
+        read-only maps of every layer file of the store
+        """
+        self.layers = []
+        while os.path.exists(self.file_name(len(self.layers))):
+            self.layers.append(np.lib.format.open_memmap(self.file_name(len(self.layers)), mode='r'))
+
+    def remove(self):
+        """
+        drop the maps and delete the layer files
+        """
+        self.layers = []
+
+        layer = 0
+        while os.path.exists(self.file_name(layer)):
+            os.remove(self.file_name(layer))
+            layer += 1
+
+    def read(self, view, indices, device='cpu', non_blocking=False):
+        """
+        a contiguous run of indices is a zero-copy slice of the map, anything else one sorted gather
+        view: one view for the whole batch, or one per index (row i is sample indices[i] under view[i])
+        return: per-layer float tensors on `device`
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if np.ndim(view):
+            view, index = np.asarray(view, dtype=np.int64), indices
+        elif len(indices) and indices[-1] - indices[0] + 1 == len(indices) and np.all(np.diff(indices) == 1):
+            index = slice(int(indices[0]), int(indices[-1]) + 1)
+        else:
+            index = indices
+
+        return [torch.from_numpy(np.asarray(layer[view, index])).to(device, non_blocking=non_blocking).float()
+                for layer in self.layers]
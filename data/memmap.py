@@ -0,0 +1,66 @@
+from PIL import Image
+
+import numpy as np
+
+from torchvision.datasets import CIFAR100, CIFAR10
+from torchvision.datasets.vision import VisionDataset
+
+from data.bootstrap import cache_files, ensure_cache
+
+
+class Memmap_CIFAR(VisionDataset):
+    """
+    drop-in for the torchvision CIFAR classes over the verified array cache of data.bootstrap:
+    <split>_data.npy (uint8 [N, H, W, C]) and <split>_targets.npy, opened with np.memmap
+    forked workers and separately launched trials share the page-cache pages of the file, and the dataset
+    pickles as its path, so spawned workers re-open the map instead of receiving a copy
+    """
+    base = None
+
+    def __init__(self, root, train=True, transform=None, target_transform=None, download=True):
+        super(Memmap_CIFAR, self).__init__(root, transform=transform, target_transform=target_transform)
+        self.train = train
+
+        directory, split, manifest, _ = ensure_cache(self.base, root, train, download)
+        self.data_file, targets_file = cache_files(directory, split)
+        self.targets = np.load(targets_file).tolist()
+
+        self.classes = manifest['classes']
+        self.class_to_idx = {name: i for i, name in enumerate(self.classes)}
+
+        self.open()
+
+    def open(self):
+        self.data = np.load(self.data_file, mmap_mode='r')
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['data']
+
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.open()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        img, target = Image.fromarray(self.data[index]), self.targets[index]
+
+        if self.transform is not None:
+            img = self.transform(img)
+
+        if self.target_transform is not None:
+            target = self.target_transform(target)
+
+        return img, target
+
+
+class Memmap_CIFAR10(Memmap_CIFAR):
+    base = CIFAR10
+
+
+class Memmap_CIFAR100(Memmap_CIFAR):
+    base = CIFAR100
@@ -0,0 +1,102 @@
+import random
+import numpy as np
+
+from utils.distributed import is_main_process
+
+
+class PoolState(object):
+    """
+    labeled / unlabeled bookkeeping of a pool of `data_size` samples
+    order[:n_labeled] is the labeled set in acquisition order, order[n_labeled:] the unlabeled set
+    position is the inverse permutation of order, so moving k samples costs O(k)
+    random draws come from python's `random`, so the usual per-trial seeding keeps them reproducible
+    """
+    def __init__(self, data_size):
+        self.data_size = data_size
+
+        self.order = np.arange(data_size, dtype=np.int32)
+        self.position = np.arange(data_size, dtype=np.int32)
+        self.mask = np.zeros(data_size, dtype=bool)
+        self.n_labeled = 0
+
+    def __len__(self):
+        return self.data_size
+
+    @property
+    def labeled(self):
+        view = self.order[:self.n_labeled]
+        view.flags.writeable = False
+
+        return view
+
+    @property
+    def unlabeled(self):
+        view = self.order[self.n_labeled:]
+        view.flags.writeable = False
+
+        return view
+
+    @staticmethod
+    def _rng():
+        return np.random.RandomState(random.getrandbits(32))
+
+    def initialize(self, initial_size):
+        self.order[:] = self._rng().permutation(self.data_size)
+        self.position[self.order] = np.arange(self.data_size, dtype=np.int32)
+
+        self.mask[:] = False
+        self.mask[self.order[:initial_size]] = True
+        self.n_labeled = initial_size
+
+    def sample_unlabeled(self, size, exclude=None):
+        candidate = self.unlabeled
+        if exclude is not None and len(exclude):
+            candidate = candidate[~np.isin(candidate, exclude)]
+
+        return candidate[self._rng().permutation(len(candidate))[:size]]
+
+    def update(self, sample_set):
+        """
+        move sample_set from the unlabeled to the labeled part (duplicates and labeled samples are dropped)
+        """
+        sample_set = np.asarray(sample_set, dtype=np.int64).reshape(-1)
+        _, first = np.unique(sample_set, return_index=True)
+        sample_set = sample_set[np.sort(first)]
+        sample_set = sample_set[~self.mask[sample_set]]
+
+        start, end = self.n_labeled, self.n_labeled + len(sample_set)
+        self.mask[sample_set] = True
+
+        # unlabeled samples in the slots taken over by the new labels move to the slots the new labels leave
+        region = self.order[start:end]
+        displaced = region[~self.mask[region]]
+        freed = self.position[sample_set]
+        freed = np.sort(freed[freed >= end])
+
+        self.order[freed] = displaced
+        self.position[displaced] = freed
+
+        self.order[start:end] = sample_set
+        self.position[sample_set] = np.arange(start, end, dtype=np.int32)
+        self.n_labeled = end
+
+    def state_dict(self):
+        return {'order': self.order.copy(), 'n_labeled': self.n_labeled}
+
+    def load_state_dict(self, state):
+        self.order[:] = state['order']
+        self.position[self.order] = np.arange(self.data_size, dtype=np.int32)
+        self.n_labeled = int(state['n_labeled'])
+
+        self.mask[:] = False
+        self.mask[self.order[:self.n_labeled]] = True
+
+    def save(self, file_name):
+        if not is_main_process():
+            return
+
+        np.savez(file_name, **self.state_dict())
+
+    def load(self, file_name):
+        with np.load(file_name) as state:
+            self.load_state_dict(state)
@@ -0,0 +1,210 @@
+import atexit
+import contextlib
+import copy
+import fcntl
+import hashlib
+import os
+import tempfile
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+import torch
+from torchvision.datasets import CIFAR100, CIFAR10
+
+from data.bootstrap import load_split
+from data.memmap import Memmap_CIFAR10, Memmap_CIFAR100
+
+# the block starts with an int64 header (state, creator pid, generation), the array follows
+HEADER = 24
+FILLING, READY = 0, 1
+
+# seconds a process waits for another one to publish a block before giving up
+ATTACH_TIMEOUT = 300.
+
+# (dataset class, root, train) -> the one loaded instance of the split
+_datasets = {}
+# block name -> SharedMemory kept open for the life of the process
+_blocks = {}
+# block name / memmap file -> channels-first uint8 tensor of the split (Tensor_CIFAR layout)
+_tensors = {}
+
+# plain torchvision classes served straight from the memory-mapped array cache
+MEMMAP = {CIFAR10: Memmap_CIFAR10, CIFAR100: Memmap_CIFAR100}
+
+
+class SharedArray(np.ndarray):
+    """
+    ndarray backed by a named shared memory block, pickles as the block name so spawned workers and
+    other trial processes attach to the same pages instead of receiving a copy
+    views taken from it are plain arrays again and pickle by value
+    """
+    def __array_finalize__(self, obj):
+        self.name = None
+        self.generation = None
+
+    def __reduce__(self):
+        if self.name is None:
+            return np.asarray(self).__reduce__()
+
+        return attach, (self.name, self.shape, self.dtype.str, self.generation)
+
+
+def block_name(root, folder, train):
+    key = hashlib.md5(f'{os.path.abspath(root)}|{folder}|{train}'.encode()).hexdigest()[:16]
+
+    return f'al_{key}'
+
+
+def _open(name, size=0):
+    """
+    attach to an existing block, or create it when size > 0
+    only the creator unlinks the block, the other processes just drop their mapping at exit
+    """
+    if size:
+        block = shared_memory.SharedMemory(name=name, create=True, size=size)
+        atexit.register(block.unlink)
+        return block
+
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # python < 3.13 always tracks, which would unlink the block under its creator
+        block = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(block._name, 'shared_memory')
+        return block
+
+
+def _unlink(block):
+    # attachers opened the block untracked, so bypass the resource tracker that SharedMemory.unlink notifies
+    shared_memory._posixshmem.shm_unlink(block._name)
+    block.close()
+
+
+def _header(block):
+    return np.ndarray(3, dtype=np.int64, buffer=block.buf)
+
+
+def _alive(pid):
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+@contextlib.contextmanager
+def _locked(name, timeout=ATTACH_TIMEOUT):
+    """
+    exclusive file lock of a block name, held while the block is checked, created and filled
+    the lock of a crashed holder goes away with its file descriptors, the wait is bounded by `timeout`
+    """
+    with open(os.path.join(tempfile.gettempdir(), f'{name}.lock'), 'w') as f:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f'shared block {name} not published within {timeout:.0f}s')
+                time.sleep(0.05)
+
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _wrap(block, name, shape, dtype):
+    array = np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=HEADER).view(SharedArray)
+    array.name = name
+    array.generation = int(_header(block)[2])
+
+    return array
+
+
+def attach(name, shape, dtype, generation=None):
+    if name not in _blocks:
+        _blocks[name] = _open(name)
+
+    array = _wrap(_blocks[name], name, shape, np.dtype(dtype))
+    if generation is not None and array.generation != generation:
+        raise RuntimeError(f'shared block {name} was recreated since it was pickled')
+
+    return array
+
+
+def share_array(array, name):
+    """
+    the array in the named block, attaching when another process already published it
+    a block whose creator died (mid-copy, or killed before it could unlink) is unlinked and published again
+    """
+    if name in _blocks:
+        return attach(name, array.shape, array.dtype)
+
+    with _locked(name):
+        try:
+            block = _open(name)
+        except FileNotFoundError:
+            block = None
+
+        if block is not None:
+            state, pid, _ = _header(block)
+            if state != READY or not _alive(pid) or block.size < HEADER + array.nbytes:
+                _unlink(block)
+                block = None
+
+        if block is None:
+            block = _open(name, HEADER + array.nbytes)
+
+            header = _header(block)
+            header[:] = [FILLING, os.getpid(), time.time_ns()]
+            _wrap(block, name, array.shape, array.dtype)[...] = array
+            header[0] = READY
+    _blocks[name] = block
+
+    return _wrap(block, name, array.shape, array.dtype)
+
+
+def get_dataset(dataset_class, root, train=True, transform=None, target_transform=None, download=True, memmap=True):
+    """
+    drop-in for dataset_class(root, train=train, transform=transform, download=download)
+    the split is loaded once per process (from the verified array cache, see data.bootstrap), every call returns
+    a shallow view that only differs in transform
+    memmap: CIFAR10 / CIFAR100 become Memmap_CIFAR* over the cached array file, whose page-cache pages every
+    process shares, the other classes (and memmap=False) keep the raw uint8 images in a named shared memory block
+    """
+    key = (dataset_class, os.path.abspath(root), train, memmap)
+    if key not in _datasets:
+        if memmap and dataset_class in MEMMAP:
+            dataset = MEMMAP[dataset_class](root, train=train, download=download)
+        else:
+            dataset = load_split(dataset_class, root, train, download)
+            dataset.data = share_array(dataset.data, block_name(root, dataset.base_folder, train))
+        _datasets[key] = dataset
+
+    dataset = copy.copy(_datasets[key])
+    dataset.transform = transform
+    dataset.target_transform = target_transform
+
+    return dataset
+
+
+def channels_first(data):
+    """
+    uint8 [N, C, H, W] tensor of a [N, H, W, C] split, built once per shared split
+    """
+    name = getattr(data, 'name', None) or getattr(data, 'filename', None)
+    if name is not None and name in _tensors:
+        return _tensors[name]
+
+    tensor = torch.from_numpy(np.ascontiguousarray(np.asarray(data).transpose(0, 3, 1, 2)))
+    if name is not None:
+        _tensors[name] = tensor.share_memory_()
+
+    return tensor
@@ -1,12 +1,61 @@
+import numpy as np
+
+import torch
 from torch.utils import data
 
+from utils.distributed import broadcast, shard_indices
+
+# shuffle seeds come from a generator of their own, re-seeded whenever the trial seed (torch.initial_seed) changes,
+# so building or iterating loaders never shifts the global torch rng that model init and dropout draw from
+_generator = torch.Generator()
+_generator_seed = None
+
+
+def shuffle_seed(shard=False):
+    """
+    seed of a shuffling loader, rank 0's for sharded loaders (a collective, every rank must ask)
+    """
+    global _generator_seed
+    if _generator_seed != torch.initial_seed():
+        _generator_seed = torch.initial_seed()
+        _generator.manual_seed(_generator_seed)
+
+    seed = int(torch.randint(2 ** 31, (), generator=_generator))
+
+    return broadcast(seed) if shard else seed
+
 
 class Sampler(data.Sampler):
-    def __init__(self, indices):
+    """
+    yields `indices` in order, or with shuffle a fresh permutation on every pass
+    the permutation of a pass only depends on (seed, epoch), the epoch advances by itself at the end of each pass
+    indices may be replaced between passes, the sampler is iterated in the main process even with persistent workers
+    shard: under torch.distributed every rank iterates its own equal-sized share of the (same) permutation
+    """
+    def __init__(self, indices, shuffle=False, seed=None, shard=False):
         self.indices = indices
+        self.shuffle = shuffle
+        self.shard = shard
+
+        # drawn on the first shuffled pass unless given
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
 
     def __iter__(self):
-        return (int(self.indices[i]) for i in range(len(self.indices)))
+        order = np.arange(len(self.indices))
+        if self.shuffle:
+            if self.seed is None:
+                self.seed = shuffle_seed(self.shard)
+            order = np.random.RandomState((self.seed + self.epoch) % (2 ** 32)).permutation(len(self.indices))
+            self.epoch += 1
+
+        if self.shard:
+            order = shard_indices(order)
+
+        return (int(self.indices[i]) for i in order)
 
     def __len__(self):
-        return len(self.indices)
+        return len(shard_indices(np.arange(len(self.indices)))) if self.shard else len(self.indices)
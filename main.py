@@ -8,6 +8,9 @@ from config import Config
 from query.query_v1 import Query
 from query.strategy.strategy_v3 import Strategy
 from task.classification_loss import ClassificationWithLoss as Task
+from utils.distributed import launch, main_process_file
+from utils.runtime import setup_runtime
+from utils.trials import run_trials
 
 torch.backends.cudnn.deterministic = True
 torch.backends.cudnn.benchmark = False
@@ -18,9 +21,12 @@ def train_strategy(cycle_cnt):
     torch.cuda.manual_seed_all(cycle_cnt * 1000)
 
     config = Config()
+    config.seed = cycle_cnt * 1000
     strategy = Strategy(config)
 
-    strategy.run()
+    # opt-in: an artifact of the same (config, code, seed) replaces training
+    if not (config.reuse_artifacts and strategy.load_checkpoint()):
+        strategy.run()
 
     return strategy
 
@@ -33,7 +39,7 @@ def main(cycle_cnt, config, query, strategy):
 
     task = Task(config)
 
-    fp = open(f'record_{cycle_cnt}.txt', 'w')
+    fp = main_process_file(f'record_{cycle_cnt}.txt', 'w')
     for step_cnt in range(config.max_cycle):
         # take a new sample
         query.sampling(step_cnt, strategy, task)
@@ -41,18 +47,30 @@ def main(cycle_cnt, config, query, strategy):
         # train a task model
         task.run(query.labeled)
 
-        print(f'trial-{cycle_cnt} / step {step_cnt + 1}: train data count - {len(set(query.labeled))}')
+        print(f'trial-{cycle_cnt} / step {step_cnt + 1}: train data count - {len(query.labeled)}')
         print(f'test accuracy - {task.best_acc}')
 
         fp.write(f'{task.best_acc}\n')
+        query.pool.save(f'pool_{cycle_cnt}.npz')
 
     fp.close()
 
 
-if __name__ == '__main__':
-    for i in range(10):
-        strategy = train_strategy(i + 1)
-        config = Config()
-        query = Query(config)
+def trial(cycle_cnt):
+    strategy = train_strategy(cycle_cnt)
+    config = Config()
+    config.seed = cycle_cnt * 1000
+    query = Query(config)
+
+    main(cycle_cnt, config, query, strategy)
+
 
-        main(i + 1, config, query, strategy)
+def run(config):
+    setup_runtime(config)
+
+    run_trials(trial, range(1, config.trials + 1), config)
+
+
+if __name__ == '__main__':
+    # config.world_size > 1: one DistributedDataParallel replica per process
+    launch(run, Config())
@@ -6,6 +6,9 @@ from config import Config
 from query.query_v2 import Query
 from query.strategy.strategy_v2 import Strategy
 from task.classification_loss import ClassificationWithLoss as Task
+from utils.distributed import launch, main_process_file
+from utils.runtime import setup_runtime
+from utils.trials import run_trials
 
 cudnn.deterministic = True
 
@@ -16,11 +19,12 @@ torch.cuda.manual_seed_all(9410)
 
 def main(cycle_cnt):
     config = Config()
+    config.seed = cycle_cnt * 1000
     query = Query(config)
     strategy = Strategy(config)
     task = Task(config)
 
-    fp = open(f'record_{cycle_cnt}.txt', 'w')
+    fp = main_process_file(f'record_{cycle_cnt}.txt', 'w')
     for step_cnt in range(config.max_cycle):
         # take a new sample
         query.sampling(step_cnt, strategy, task)
@@ -28,7 +32,7 @@ def main(cycle_cnt):
         # train a task model
         task.run(query.labeled)
 
-        print(f'trial-{cycle_cnt} / step {step_cnt + 1}: train data count - {len(set(query.labeled))}')
+        print(f'trial-{cycle_cnt} / step {step_cnt + 1}: train data count - {len(query.labeled)}')
         print(f'test accuracy - {task.best_acc}')
 
         fp.write(f'{task.best_acc}\n')
@@ -39,6 +43,12 @@ def main(cycle_cnt):
     fp.close()
 
 
+def run(config):
+    setup_runtime(config)
+
+    run_trials(main, range(1, config.trials + 1), config)
+
+
 if __name__ == '__main__':
-    for i in range(10):
-        main(i + 1)
+    # config.world_size > 1: one DistributedDataParallel replica per process
+    launch(run, Config())
@@ -0,0 +1,58 @@
+import os
+
+import numpy as np
+
+from query.pool_inference import PoolInference
+from utils.distributed import is_main_process
+from utils.train_utils import state_fingerprint
+
+
+class CodeCache(object):
+    """
+    per-sample strategy outputs for the whole pool, computed once per strategy checkpoint
+    rows are indexed by sample index, the cache is rebuilt only when the strategy weights change
+    with config.code_cache_mmap the rows live in a memory-mapped .npy file keyed by the weight fingerprint
+    (written by rank 0 under torch.distributed, the other ranks keep the gathered rows in memory)
+    """
+    def __init__(self, config, dataset, name):
+        self.config = config
+        self.dataset = dataset
+        self.name = name
+
+        self.batch_size = self.config.vae_batch_size
+
+        self.fingerprint = None
+        self.codes = None
+
+    def get(self, strategy, fn):
+        """
+        fn(strategy, inputs) -> numpy array with one row per input
+        return: [data_size, ...] array of rows for the whole pool
+        """
+        fingerprint = state_fingerprint(strategy)
+        if fingerprint == self.fingerprint:
+            return self.codes
+
+        file_name = None
+        if self.config.code_cache_mmap:
+            directory = os.path.join(self.config.root_path, self.config.code_cache_directory)
+            os.makedirs(directory, exist_ok=True)
+            file_name = os.path.join(directory, f'{self.name}_{fingerprint}.npy')
+
+        if file_name is not None and os.path.exists(file_name):
+            self.codes = np.load(file_name, mmap_mode='r')
+        else:
+            self.codes = self.compute(strategy, fn)
+            if file_name is not None and is_main_process():
+                np.save(file_name + '.tmp.npy', self.codes)
+                os.replace(file_name + '.tmp.npy', file_name)
+                self.codes = np.load(file_name, mmap_mode='r')
+
+        self.fingerprint = fingerprint
+
+        return self.codes
+
+    def compute(self, strategy, fn):
+        inference = PoolInference(self.config, self.dataset, self.batch_size)
+
+        return inference.run(lambda inputs, targets: {'code': fn(strategy, inputs)})['code']
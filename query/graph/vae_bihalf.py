@@ -117,8 +117,8 @@ class hash(Function):
     def forward(ctx, U):
         _, index = U.sort(0, descending=True)
         N, D = U.shape
-        B_creat = torch.cat((torch.ones([int(N / 2), D]), -torch.ones([N - int(N / 2), D]))).cuda()
-        B = torch.zeros(U.shape).cuda().scatter_(0, index, B_creat)
+        B_creat = torch.cat((torch.ones([int(N / 2), D]), -torch.ones([N - int(N / 2), D]))).to(U.device)
+        B = torch.zeros(U.shape, device=U.device).scatter_(0, index, B_creat)
 
         ctx.save_for_backward(U, B)
 
@@ -166,6 +166,19 @@ class VAE(nn.Module):
 
         self.relu = nn.ReLU(inplace=True)
 
+    def encode(self, x):
+        """
+        h_code only, the scoring path of forward without the decoder
+        """
+        encoder_out = self.relu(self._encoder(x))
+        encoder_out = self.encoder_conv(encoder_out)
+
+        feature = self.relu(self.hash_conv(encoder_out))
+        feature = torch.flatten(feature, start_dim=1)
+        feature = self.relu(self.hash_fc1(feature))
+
+        return self.hash_fc2(feature)
+
     def forward(self, x):
         # encoder
         encoder_out = self.relu(self._encoder(x))
@@ -0,0 +1,134 @@
+import queue
+import threading
+import time
+
+from tqdm import tqdm
+
+
+# end of stream marker passed down the queues
+_END = object()
+
+
+class StageStats(object):
+    """
+    wall time a stage spent working (busy) and blocked on its queues (idle)
+    """
+    def __init__(self, name):
+        self.name = name
+        self.busy = 0.
+        self.idle = 0.
+        self.items = 0
+
+    def __str__(self):
+        total = self.busy + self.idle
+        ratio = self.busy / total if total else 0.
+
+        return f'{self.name}: {self.items} batches / busy {self.busy:.2f}s / idle {self.idle:.2f}s ({ratio:.0%} busy)'
+
+
+class Pipeline(object):
+    """
+    pool scoring as three overlapping stages connected by bounded queues (config.pipeline_depth batches each):
+    loader thread -> inference (calling thread, owns the models) -> post-processing thread
+    post(result) sees the results in loader order, so it can append, fill rows or feed a TopK
+    with config.pipeline_stats the busy / idle time of every stage is printed after each run
+    """
+    def __init__(self, config):
+        self.config = config
+        self.depth = config.pipeline_depth
+
+        self.stats = []
+
+    def run(self, loader, infer, post, leave=False):
+        loaded, inferred = queue.Queue(self.depth), queue.Queue(self.depth)
+        errors = []
+
+        load_stats, infer_stats, post_stats = StageStats('loader'), StageStats('inference'), StageStats('post')
+        self.stats = [load_stats, infer_stats, post_stats]
+
+        def put(q, item, stats):
+            start = time.perf_counter()
+            while not errors:
+                try:
+                    q.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            stats.idle += time.perf_counter() - start
+
+        def get(q, stats):
+            start = time.perf_counter()
+            while True:
+                try:
+                    item = q.get(timeout=0.1)
+                    break
+                except queue.Empty:
+                    if errors:
+                        item = _END
+                        break
+            stats.idle += time.perf_counter() - start
+
+            return item
+
+        def load():
+            try:
+                iterator = iter(loader)
+                while not errors:
+                    start = time.perf_counter()
+                    data = next(iterator, _END)
+                    load_stats.busy += time.perf_counter() - start
+
+                    put(loaded, data, load_stats)
+                    if data is _END:
+                        break
+                    load_stats.items += 1
+            except Exception as e:
+                errors.append(e)
+
+        def process():
+            try:
+                while True:
+                    result = get(inferred, post_stats)
+                    if result is _END:
+                        break
+
+                    start = time.perf_counter()
+                    post(result)
+                    post_stats.busy += time.perf_counter() - start
+                    post_stats.items += 1
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=load, daemon=True), threading.Thread(target=process, daemon=True)]
+        for thread in threads:
+            thread.start()
+
+        tqdm_batch = tqdm(total=len(loader), leave=leave)
+        try:
+            while True:
+                data = get(loaded, infer_stats)
+                if data is _END:
+                    break
+
+                start = time.perf_counter()
+                result = infer(data)
+                infer_stats.busy += time.perf_counter() - start
+                infer_stats.items += 1
+
+                put(inferred, result, infer_stats)
+                tqdm_batch.update(1)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            put(inferred, _END, infer_stats)
+            for thread in threads:
+                thread.join()
+            tqdm_batch.close()
+
+        if errors:
+            raise errors[0]
+
+        if self.config.pipeline_stats:
+            print(' | '.join(str(stats) for stats in self.stats))
+
+        return self.stats
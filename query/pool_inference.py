@@ -0,0 +1,62 @@
+import numpy as np
+
+from data.dataset import make_loader
+from query.pipeline import Pipeline
+from utils.distributed import gather_shards, shard_indices
+from utils.runtime import get_device
+
+
+class PoolInference(object):
+    """
+    one ordered sweep over the whole pool, every model head runs once per batch, loading / inference / copy-out
+    overlapped by a Pipeline
+    fn(inputs, targets) -> dict of per-sample outputs (tensors or arrays), written into preallocated [data_size, ...]
+    arrays so that row i always belongs to sample i, whatever part of the pool it is in
+    with config.shard_scoring every torch.distributed rank runs its share of the pool, the rows are gathered after
+    """
+    def __init__(self, config, dataset, batch_size=None):
+        self.config = config
+        self.device = get_device(self.config)
+        self.dataset = dataset
+
+        self.batch_size = batch_size or self.config.vae_batch_size
+        self.pipeline = Pipeline(self.config)
+
+    def run(self, fn, mask=None):
+        """
+        mask: labeled mask of the pool, copied into the result as 'labeled'
+        return: dict of [data_size, ...] arrays
+        """
+        shard = self.config.shard_scoring
+        indices = np.arange(self.config.data_size)
+        rows = len(shard_indices(indices)) if shard else len(indices)
+
+        dataloader = make_loader(self.dataset, indices, self.batch_size, self.config, shard=shard)
+
+        def infer(data):
+            inputs = data[0].to(self.device, non_blocking=self.config.async_loading)
+            targets = data[1].to(self.device, non_blocking=self.config.async_loading)
+
+            return fn(inputs, targets)
+
+        outputs, offset = {}, 0
+
+        def post(result):
+            nonlocal offset
+            for key, value in result.items():
+                value = value.cpu().numpy() if hasattr(value, 'cpu') else np.asarray(value)
+                if key not in outputs:
+                    outputs[key] = np.empty((rows,) + value.shape[1:], dtype=value.dtype)
+                outputs[key][offset:offset + len(value)] = value
+
+            offset += len(value)
+
+        self.pipeline.run(dataloader, infer, post)
+
+        if shard:
+            outputs = {key: gather_shards(value, self.config.data_size) for key, value in outputs.items()}
+
+        if mask is not None:
+            outputs['labeled'] = np.array(mask, dtype=bool)
+
+        return outputs
@@ -1,16 +1,15 @@
 import os
-import random
-from tqdm import tqdm
 
-import numpy as np
-
-import torch
 from torch.backends import cudnn
-from torch.utils.data import DataLoader
 from torchvision import transforms
 from torchvision.datasets import CIFAR100, CIFAR10
 
-from data.sampler import Sampler
+from data.dataset import Tensor_CIFAR, make_loader
+from data.pool import PoolState
+from data.registry import get_dataset
+from query.pipeline import Pipeline
+from query.topk import ShardedTopK
+from utils.runtime import get_device
 
 cudnn.benchmark = False
 
@@ -18,11 +17,11 @@ cudnn.benchmark = False
 class Query(object):
     def __init__(self, config):
         self.config = config
+        self.device = get_device(self.config)
 
         self.initial_size = self.config.initial_size
         self.budget = self.config.budge_size
-        self.labeled = []
-        self.unlabeled = [i for i in range(self.config.data_size)]
+        self.pool = PoolState(self.config.data_size)
 
         self.train_transform = transforms.Compose([
             transforms.ToTensor(),
@@ -30,42 +29,48 @@ class Query(object):
         ])
 
         self.batch_size = self.config.batch_size
+        self.pipeline = Pipeline(self.config)
 
         # define dataloader
         if self.config.data_name == 'cifar10':
-            self.dataset = CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                   train=True, download=True, transform=self.train_transform)
+            self.dataset = get_dataset(CIFAR10, os.path.join(self.config.root_path, self.config.data_directory),
+                                       train=True, transform=self.train_transform)
         elif self.config.data_name == 'cifar100':
-            self.dataset = CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                    train=True, download=True, transform=self.train_transform)
+            self.dataset = get_dataset(CIFAR100, os.path.join(self.config.root_path, self.config.data_directory),
+                                       train=True, transform=self.train_transform)
+
+        if self.config.tensor_dataset:
+            self.dataset = Tensor_CIFAR(self.dataset, pin_memory=self.config.pin_memory)
+
+    @property
+    def labeled(self):
+        return self.pool.labeled
+
+    @property
+    def unlabeled(self):
+        return self.pool.unlabeled
 
     def sampling(self, step_cnt, task):
         sample_size = self.budget if step_cnt else self.initial_size
-        random.shuffle(self.unlabeled)
 
         if step_cnt:
-            subset = self.unlabeled[:sample_size * 10]
-
-            dataloader = DataLoader(self.dataset, batch_size=self.batch_size,
-                                    pin_memory=self.config.pin_memory, sampler=Sampler(subset))
+            subset = self.pool.sample_unlabeled(sample_size * 10)
 
-            uncertainty = torch.tensor([]).cuda()
-            tqdm_batch = tqdm(dataloader, total=len(dataloader))
-            for curr_it, data in enumerate(tqdm_batch):
-                data = data[0].cuda(async=self.config.async_loading)
+            dataloader = make_loader(self.dataset, subset, self.batch_size, self.config,
+                                     shard=self.config.shard_scoring)
 
-                _, _, pred_loss = task.get_result(data)
+            def infer(data):
+                _, _, pred_loss = task.get_result(data[0].to(self.device, non_blocking=self.config.async_loading))
 
-                uncertainty = torch.cat([uncertainty, pred_loss], 0)
-            tqdm_batch.close()
+                return pred_loss
 
-            uncertainty = uncertainty.cpu()
-            arg = np.argsort(uncertainty)
+            selector = ShardedTopK(sample_size, len(subset), shard=self.config.shard_scoring)
+            self.pipeline.run(dataloader, infer, lambda pred_loss: selector.update(pred_loss.cpu().numpy()),
+                              leave=True)
 
-            sample_set = list(torch.tensor(subset)[arg][-sample_size:].numpy())
+            sample_set = list(subset[selector.result()])
 
         else:
-            sample_set = self.unlabeled[:sample_size]
+            sample_set = self.pool.sample_unlabeled(sample_size)
 
-        self.labeled += sample_set
-        self.unlabeled = list(set(self.unlabeled) - set(sample_set))
+        self.pool.update(sample_set)
@@ -1,5 +1,4 @@
 import os
-import random
 from tqdm import tqdm
 
 import numpy as np
@@ -10,7 +9,9 @@ from torch.utils.data import DataLoader
 from torchvision import transforms
 from torchvision.datasets import CIFAR100, CIFAR10
 
+from data.pool import PoolState
 from data.sampler import Sampler
+from data.registry import get_dataset
 
 cudnn.benchmark = False
 
@@ -21,8 +22,7 @@ class Query(object):
 
         self.initial_size = self.config.initial_size
         self.budget = self.config.budge_size
-        self.labeled = []
-        self.unlabeled = [i for i in range(self.config.data_size)]
+        self.pool = PoolState(self.config.data_size)
 
         self.train_transform = transforms.Compose([
             transforms.ToTensor(),
@@ -33,17 +33,22 @@ class Query(object):
 
         # define dataloader
         if self.config.data_name == 'cifar10':
-            self.dataset = CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                   train=True, download=True, transform=self.train_transform)
+            self.dataset = get_dataset(CIFAR10, os.path.join(self.config.root_path, self.config.data_directory),
+                                       train=True, transform=self.train_transform)
         elif self.config.data_name == 'cifar100':
-            self.dataset = CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                    train=True, download=True, transform=self.train_transform)
+            self.dataset = get_dataset(CIFAR100, os.path.join(self.config.root_path, self.config.data_directory),
+                                       train=True, transform=self.train_transform)
+
+    @property
+    def labeled(self):
+        return self.pool.labeled
+
+    @property
+    def unlabeled(self):
+        return self.pool.unlabeled
 
     def sampling(self, step_cnt):
         sample_size = self.budget if step_cnt else self.initial_size
-        random.shuffle(self.unlabeled)
-
-        sample_set = self.unlabeled[:sample_size]
+        sample_set = self.pool.sample_unlabeled(sample_size)
 
-        self.labeled += sample_set
-        self.unlabeled = list(set(self.unlabeled) - set(sample_set))
+        self.pool.update(sample_set)
@@ -1,27 +1,28 @@
 import os
 import torch
-import random
-from tqdm import tqdm
 
-import numpy as np
-
-from torch.utils.data import DataLoader
 from torchvision import transforms
 from torchvision.datasets import CIFAR100, CIFAR10
 
-from data.sampler import Sampler
+from data.dataset import Tensor_CIFAR, make_loader
+from data.pool import PoolState
+from data.registry import get_dataset
+from query.pipeline import Pipeline
+from query.topk import ShardedTopK
+from utils.runtime import get_device
 
 
 class Query(object):
     def __init__(self, config):
         self.config = config
+        self.device = get_device(self.config)
 
         self.initial_size = self.config.initial_size
         self.budget = self.config.budge_size
-        self.labeled = []
-        self.unlabeled = [i for i in range(self.config.data_size)]
+        self.pool = PoolState(self.config.data_size)
 
         self.batch_size = self.config.vae_batch_size
+        self.pipeline = Pipeline(self.config)
 
         # define dataloader
         if 'cifar' in self.config.data_name:
@@ -31,30 +32,37 @@ class Query(object):
             ])
 
             if self.config.data_name == 'cifar10':
-                self.dataset = CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                       train=True, download=True, transform=self.train_transform)
+                self.dataset = get_dataset(CIFAR10, os.path.join(self.config.root_path, self.config.data_directory),
+                                           train=True, transform=self.train_transform)
             elif self.config.data_name == 'cifar100':
-                self.dataset = CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                        train=True, download=True, transform=self.train_transform)
+                self.dataset = get_dataset(CIFAR100, os.path.join(self.config.root_path, self.config.data_directory),
+                                           train=True, transform=self.train_transform)
+
+            if self.config.tensor_dataset:
+                self.dataset = Tensor_CIFAR(self.dataset, pin_memory=self.config.pin_memory)
+
+    @property
+    def labeled(self):
+        return self.pool.labeled
+
+    @property
+    def unlabeled(self):
+        return self.pool.unlabeled
 
     def sampling(self, step_cnt, task, transformer, ae):
         if not step_cnt:
-            random.shuffle(self.unlabeled)
-            self.labeled = self.unlabeled[:self.initial_size]
-            self.unlabeled = self.unlabeled[self.initial_size:]
+            self.pool.initialize(self.initial_size)
 
             return
 
         sample_size = self.budget
 
         # unlabeled
-        dataloader = DataLoader(self.dataset, batch_size=self.batch_size,
-                                pin_memory=self.config.pin_memory, sampler=Sampler(self.unlabeled))
-        tqdm_batch = tqdm(dataloader, leave=False, total=len(dataloader))
-        index = 0
-        sample_set = []
-        for curr_it, data in enumerate(tqdm_batch):
-            data = data[0].cuda(async=self.config.async_loading)
+        dataloader = make_loader(self.dataset, self.unlabeled, self.batch_size, self.config,
+                                 shard=self.config.shard_scoring)
+
+        def infer(data):
+            data = data[0].to(self.device, non_blocking=self.config.async_loading)
 
             task_features = task.get_feature(data)
             pre_features = transformer.get_feature(task_features)
@@ -62,20 +70,13 @@ class Query(object):
             ae_features = ae.get_feature(data)
             ae_features = ae_features.view([-1, self.config.vae_embedding_dim])
 
-            loss = torch.sum((ae_features - pre_features) ** 2, dim=1)
-            loss = loss.cpu().tolist()
-
-            for idx in range(len(loss)):
-                sample_set.append([self.unlabeled[index], loss[idx]])
-                index += 1
+            return torch.sum((ae_features - pre_features) ** 2, dim=1)
 
-            sample_set.sort(key=lambda x: x[1], reverse=True)
-            sample_set = sample_set[:sample_size]
-        tqdm_batch.close()
+        selector = ShardedTopK(sample_size, len(self.unlabeled), shard=self.config.shard_scoring)
+        self.pipeline.run(dataloader, infer, lambda loss: selector.update(loss.cpu().numpy()))
 
-        sample_set = list(np.array(sample_set)[:, 0])
+        sample_set = list(self.unlabeled[selector.result()])
         if len(set(sample_set)) < sample_size:
             print('!!!!!!!!!!!!!!!! error !!!!!!!!!!!!!!!!', len(set(sample_set)))
 
-        self.labeled += sample_set
-        self.unlabeled = list(set(self.unlabeled) - set(sample_set))
+        self.pool.update(sample_set)
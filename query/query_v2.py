@@ -1,14 +1,17 @@
 import os
 import random
-from tqdm import tqdm
 
 import numpy as np
 
-from torch.utils.data import DataLoader
 from torchvision import transforms
 from torchvision.datasets import CIFAR100, CIFAR10
 
-from data.sampler import Sampler
+from data.dataset import Tensor_CIFAR
+from data.pool import PoolState
+from data.registry import get_dataset
+from query.pool_inference import PoolInference
+from query.topk import top_k
+from utils.hash_utils import pack_code, code_keys, group_by_code
 
 
 class Query(object):
@@ -17,8 +20,7 @@ class Query(object):
 
         self.initial_size = self.config.initial_size
         self.budget = self.config.budge_size
-        self.labeled = []
-        self.unlabeled = [i for i in range(self.config.data_size)]
+        self.pool = PoolState(self.config.data_size)
 
         self.batch_size = self.config.vae_batch_size
 
@@ -30,68 +32,58 @@ class Query(object):
             ])
 
             if self.config.data_name == 'cifar10':
-                self.dataset = CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                       train=True, download=True, transform=self.train_transform)
+                self.dataset = get_dataset(CIFAR10, os.path.join(self.config.root_path, self.config.data_directory),
+                                           train=True, transform=self.train_transform)
             elif self.config.data_name == 'cifar100':
-                self.dataset = CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                        train=True, download=True, transform=self.train_transform)
+                self.dataset = get_dataset(CIFAR100, os.path.join(self.config.root_path, self.config.data_directory),
+                                           train=True, transform=self.train_transform)
+
+            if self.config.tensor_dataset:
+                self.dataset = Tensor_CIFAR(self.dataset, pin_memory=self.config.pin_memory)
+
+        self.inference = PoolInference(self.config, self.dataset, self.batch_size)
+
+    @property
+    def labeled(self):
+        return self.pool.labeled
+
+    @property
+    def unlabeled(self):
+        return self.pool.unlabeled
 
     def sampling(self, step_cnt, strategy, task):
         if not step_cnt:
-            random.shuffle(self.unlabeled)
-            self.labeled = self.unlabeled[:self.initial_size]
-            self.unlabeled = self.unlabeled[self.initial_size:]
+            self.pool.initialize(self.initial_size)
 
             return
 
         sample_size = self.budget
 
-        # unlabeled
-        dataloader = DataLoader(self.dataset, batch_size=self.batch_size,
-                                pin_memory=self.config.pin_memory, sampler=Sampler(self.unlabeled))
-        tqdm_batch = tqdm(dataloader, leave=False, total=len(dataloader))
-        index = 0
-        data_dict = {}
-        for curr_it, data in enumerate(tqdm_batch):
-            data = data[0].cuda(async=self.config.async_loading)
-
-            _, features, _ = task.get_result(data)
+        # one sweep over the pool: task features, loss and strategy code of every sample
+        def heads(inputs, targets):
+            _, features, pred_loss = task.get_result(inputs)
             code = strategy.get_code(features)
 
-            code = tuple(map(tuple, code.view([-1, self.config.vae_embedding_dim]).cpu().tolist()))
+            return {'code': pack_code(code, self.config.vae_embedding_dim), 'loss': pred_loss}
 
-            for idx in range(len(code)):
-                if code[idx] in data_dict:
-                    data_dict[code[idx]].append(self.unlabeled[index])
-                else:
-                    data_dict[code[idx]] = [self.unlabeled[index]]
-                index += 1
-        tqdm_batch.close()
-
-        for code in data_dict:
-            random.shuffle(data_dict[code])
-
-        # labeled
-        dataloader = DataLoader(self.dataset, batch_size=self.batch_size,
-                                pin_memory=self.config.pin_memory, sampler=Sampler(self.labeled))
-        tqdm_batch = tqdm(dataloader, leave=False, total=len(dataloader))
-        loss_list = []
-        for curr_it, data in enumerate(tqdm_batch):
-            data = data[0].cuda(async=self.config.async_loading)
-
-            _, features, pred_loss = task.get_result(data)
-            code = strategy.get_code(features)
+        outputs = self.inference.run(heads, self.pool.mask)
+        code_lst = code_keys(outputs['code'])
 
-            code = tuple(map(tuple, code.view([-1, self.config.vae_embedding_dim]).cpu().tolist()))
-            pred_loss = pred_loss.cpu().numpy()
+        # unlabeled: one shuffle of the pool + a stable grouping sort gives every code a randomly ordered bucket
+        shuffled = self.unlabeled
+        perm = np.random.RandomState(random.getrandbits(32)).permutation(len(shuffled))
+        shuffled = shuffled[perm]
 
-            loss_list.extend([[code[idx], pred_loss[idx]] for idx in range(len(code))])
-        tqdm_batch.close()
+        unique_code, inverse, counts = group_by_code(code_lst[shuffled])
+        order = np.argsort(inverse, kind='stable')
+        data_dict = dict(zip(unique_code.tolist(),
+                             [list(bucket) for bucket in np.split(shuffled[order], np.cumsum(counts)[:-1])]))
 
-        loss_list.sort(key=lambda x: x[1], reverse=True)
-        loss_list = np.array(loss_list[:2000])
+        # labeled
+        labeled = np.flatnonzero(outputs['labeled'])
+        code_lst, loss_lst = code_lst[labeled], outputs['loss'][labeled]
 
-        code_list = list(loss_list[:, 0])
+        code_list = code_lst[top_k(loss_lst, 2000)].tolist()
         code_list.sort(key=lambda x: len(data_dict[x]) if x in data_dict else 0)
 
         print(len(code_list), len(data_dict.keys()), len(set(code_list) & set(data_dict.keys())))
@@ -110,12 +102,9 @@ class Query(object):
                 code_list.pop(index)
         else:
             if len(sample_set) < sample_size:
-                self.unlabeled = list(set(self.unlabeled) - set(sample_set))
-                random.shuffle(self.unlabeled)
-                sample_set += self.unlabeled[:sample_size - len(sample_set)]
+                sample_set += list(self.pool.sample_unlabeled(sample_size - len(sample_set), exclude=sample_set))
 
         if len(set(sample_set)) < sample_size:
             print('!!!!!!!!!!!!!!!! error !!!!!!!!!!!!!!!!', len(set(sample_set)))
 
-        self.labeled += sample_set
-        self.unlabeled = list(set(self.unlabeled) - set(sample_set))
+        self.pool.update(sample_set)
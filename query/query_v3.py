@@ -1,26 +1,28 @@
 import os
 import random
-from tqdm import tqdm
 
-import numpy as np
-
-from torch.utils.data import DataLoader
 from torchvision import transforms
 from torchvision.datasets import CIFAR100, CIFAR10
 
-from data.sampler import Sampler
+from data.dataset import Tensor_CIFAR, make_loader
+from data.pool import PoolState
+from data.registry import get_dataset
+from query.pipeline import Pipeline
+from query.topk import ShardedTopK
+from utils.runtime import get_device
 
 
 class Query(object):
     def __init__(self, config):
         self.config = config
+        self.device = get_device(self.config)
 
         self.initial_size = self.config.initial_size
         self.budget = self.config.budge_size
-        self.labeled = []
-        self.unlabeled = [i for i in range(self.config.data_size)]
+        self.pool = PoolState(self.config.data_size)
 
         self.batch_size = self.config.vae_batch_size
+        self.pipeline = Pipeline(self.config)
 
         # define dataloader
         if 'cifar' in self.config.data_name:
@@ -30,44 +32,44 @@ class Query(object):
             ])
 
             if self.config.data_name == 'cifar10':
-                self.dataset = CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                       train=True, download=True, transform=self.train_transform)
+                self.dataset = get_dataset(CIFAR10, os.path.join(self.config.root_path, self.config.data_directory),
+                                           train=True, transform=self.train_transform)
             elif self.config.data_name == 'cifar100':
-                self.dataset = CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                        train=True, download=True, transform=self.train_transform)
+                self.dataset = get_dataset(CIFAR100, os.path.join(self.config.root_path, self.config.data_directory),
+                                           train=True, transform=self.train_transform)
+
+            if self.config.tensor_dataset:
+                self.dataset = Tensor_CIFAR(self.dataset, pin_memory=self.config.pin_memory)
         self.test = open(f'{random.randint(100000, 999999)}.txt', 'w')
 
+    @property
+    def labeled(self):
+        return self.pool.labeled
+
+    @property
+    def unlabeled(self):
+        return self.pool.unlabeled
+
     def sampling(self, step_cnt, strategy, task):
         if not step_cnt:
-            random.shuffle(self.unlabeled)
-            self.labeled = self.unlabeled[:self.initial_size]
-            self.unlabeled = self.unlabeled[self.initial_size:]
+            self.pool.initialize(self.initial_size)
 
             return
 
         sample_size = self.budget
 
-        dataloader = DataLoader(self.dataset, batch_size=self.batch_size,
-                                pin_memory=self.config.pin_memory, sampler=Sampler(self.unlabeled))
-        tqdm_batch = tqdm(dataloader, leave=False, total=len(dataloader))
-
-        index = 0
-        data_lst = []
-        for curr_it, data in enumerate(tqdm_batch):
-            data = data[0].cuda(async=self.config.async_loading)
+        dataloader = make_loader(self.dataset, self.unlabeled, self.batch_size, self.config,
+                                 shard=self.config.shard_scoring)
 
-            distance = task.get_distance(data)
-            distance = distance.cpu().numpy()
+        def infer(data):
+            return task.get_distance(data[0].to(self.device, non_blocking=self.config.async_loading))
 
-            for idx in range(len(distance)):
-                data_lst.append([distance[idx], self.unlabeled[index]])
-                index += 1
-        tqdm_batch.close()
+        selector = ShardedTopK(sample_size, len(self.unlabeled), largest=False, shard=self.config.shard_scoring)
+        self.pipeline.run(dataloader, infer, lambda distance: selector.update(distance.cpu().numpy()))
 
-        sample_set = list(np.array(sorted(data_lst, key=lambda x: x[0]))[:sample_size, 1])
+        sample_set = list(self.unlabeled[selector.result()])
 
         if len(set(sample_set)) < sample_size:
             print('!!!!!!!!!!!!!!!! error !!!!!!!!!!!!!!!!', len(set(sample_set)))
 
-        self.labeled += sample_set
-        self.unlabeled = list(set(self.unlabeled) - set(sample_set))
+        self.pool.update(sample_set)
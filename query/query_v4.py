@@ -1,26 +1,32 @@
 import os
-import random
-from tqdm import tqdm
 
 import numpy as np
 
-from torch.utils.data import DataLoader
 from torchvision import transforms
 from torchvision.datasets import CIFAR100, CIFAR10
 
-from data.sampler import Sampler
+from data.dataset import Tensor_CIFAR, make_loader
+from data.pool import PoolState
+from data.registry import get_dataset
+from query.code_cache import CodeCache
+from query.pipeline import Pipeline
+from query.topk import top_k
+from utils.hash_utils import pack_code, code_keys, group_by_code, rank_in_bucket
+from utils.distributed import gather_shards
+from utils.runtime import get_device
 
 
 class Query(object):
     def __init__(self, config, cycle):
         self.config = config
+        self.device = get_device(self.config)
 
         self.initial_size = self.config.initial_size
         self.budget = self.config.budge_size
-        self.labeled = []
-        self.unlabeled = [i for i in range(self.config.data_size)]
+        self.pool = PoolState(self.config.data_size)
 
         self.batch_size = self.config.vae_batch_size
+        self.pipeline = Pipeline(self.config)
 
         # define dataloader
         if 'cifar' in self.config.data_name:
@@ -30,77 +36,85 @@ class Query(object):
             ])
 
             if self.config.data_name == 'cifar10':
-                self.dataset = CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                       train=True, download=True, transform=self.train_transform)
+                self.dataset = get_dataset(CIFAR10, os.path.join(self.config.root_path, self.config.data_directory),
+                                           train=True, transform=self.train_transform)
             elif self.config.data_name == 'cifar100':
-                self.dataset = CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                        train=True, download=True, transform=self.train_transform)
+                self.dataset = get_dataset(CIFAR100, os.path.join(self.config.root_path, self.config.data_directory),
+                                           train=True, transform=self.train_transform)
+
+            if self.config.tensor_dataset:
+                self.dataset = Tensor_CIFAR(self.dataset, pin_memory=self.config.pin_memory)
+
+        self.code_cache = CodeCache(self.config, self.dataset, 'query_v4')
         self.test = open(f'{cycle}.txt', 'w')
 
+    @property
+    def labeled(self):
+        return self.pool.labeled
+
+    @property
+    def unlabeled(self):
+        return self.pool.unlabeled
+
+    def encode(self, strategy, inputs):
+        code = strategy.get_code(inputs)
+
+        return pack_code(code, self.config.vae_embedding_dim).cpu().numpy()
+
     def sampling(self, step_cnt, strategy, task):
         if not step_cnt:
-            random.shuffle(self.unlabeled)
-            self.labeled = self.unlabeled[:self.initial_size]
-            self.unlabeled = self.unlabeled[self.initial_size:]
+            self.pool.initialize(self.initial_size)
 
             return
 
         sample_size = self.budget
 
-        dataloader = DataLoader(self.dataset, batch_size=self.batch_size,
-                                pin_memory=self.config.pin_memory, sampler=Sampler(self.unlabeled))
-        tqdm_batch = tqdm(dataloader, leave=False, total=len(dataloader))
+        dataloader = make_loader(self.dataset, self.unlabeled, self.batch_size, self.config,
+                                 shard=self.config.shard_scoring)
 
-        index = 0
-        data_dict = {}
-        for curr_it, data in enumerate(tqdm_batch):
-            data = data[0].cuda(async=self.config.async_loading)
+        def infer(data):
+            _, features, pred_loss = task.get_result(data[0].to(self.device, non_blocking=self.config.async_loading))
 
-            _, features, pred_loss = task.get_result(data)
-            code = strategy.get_code(data)
+            return pred_loss
 
-            code = tuple(map(tuple, code.view([-1, self.config.vae_embedding_dim]).cpu().tolist()))
-            pred_loss = pred_loss.cpu().numpy()
+        loss_lst = []
+        self.pipeline.run(dataloader, infer, lambda pred_loss: loss_lst.append(pred_loss.cpu().numpy()))
 
-            for idx in range(len(code)):
-                if code[idx] in data_dict:
-                    data_dict[code[idx]].append([pred_loss[idx], self.unlabeled[index]])
-                else:
-                    data_dict[code[idx]] = [[pred_loss[idx], self.unlabeled[index]]]
-                index += 1
-        tqdm_batch.close()
+        code = self.code_cache.get(strategy, self.encode)
 
-        key_lst = data_dict.keys()
-        key_lst = sorted(key_lst, key=lambda x: np.array(data_dict[x])[:, 0].mean(), reverse=True)
+        unlabeled = self.unlabeled
+        pred_loss = np.concatenate(loss_lst)
+        if self.config.shard_scoring:
+            pred_loss = gather_shards(pred_loss, len(unlabeled))
+        _, inverse, counts = group_by_code(code_keys(code[self.unlabeled]))
+        order, rank = rank_in_bucket(inverse, pred_loss, counts)
 
-        temp_lst = []
-        self.test.write(f'step: {step_cnt} -> code count: {len(data_dict.keys())}\n')
+        starts = np.cumsum(counts) - counts
+        ordered_loss = pred_loss[order]
+        code_mean = np.add.reduceat(ordered_loss, starts) / counts
+        code_std = np.sqrt(np.add.reduceat((ordered_loss - code_mean[inverse[order]]) ** 2, starts) / counts)
+        code_min, code_max = np.minimum.reduceat(ordered_loss, starts), np.maximum.reduceat(ordered_loss, starts)
+
+        key_lst = np.argsort(-code_mean, kind='stable')
+
+        self.test.write(f'step: {step_cnt} -> code count: {len(counts)}\n')
         for i in key_lst:
-            temp_data = np.array(data_dict[i])[:, 0]
-            self.test.write(f'{len(temp_data)} - {temp_data.min()}/{temp_data.max()}/{temp_data.mean()}/{temp_data.std()}\n')
-            temp_lst.append(temp_data.mean())
-        temp_lst = np.array(temp_lst)
-        self.test.write(f'{temp_lst.min()}/{temp_lst.max()}/{temp_lst.mean()}/{temp_lst.std()}\n\n')
-
-        sample_set = []
-        total_remain = []
-        quota = sample_size // 100
-        for i in key_lst[:100]:
-            tmp_list = sorted(data_dict[i], key=lambda x: x[0], reverse=True)
+            self.test.write(f'{counts[i]} - {code_min[i]}/{code_max[i]}/{code_mean[i]}/{code_std[i]}\n')
+        self.test.write(f'{code_mean.min()}/{code_mean.max()}/{code_mean.mean()}/{code_mean.std()}\n\n')
 
-            if len(tmp_list) > quota:
-                sample_set += list(np.array(tmp_list)[:quota, 1])
-                total_remain += tmp_list[quota:]
-            else:
-                sample_set += list(np.array(tmp_list)[:, 1])
-        for i in key_lst[100:]:
-            total_remain += data_dict[i]
+        # top `quota` of the 100 codes with the highest mean loss first, then the best of what is left
+        top_code = np.zeros(len(counts), dtype=bool)
+        top_code[key_lst[:100]] = True
+
+        quota = sample_size // 100
+        selected = (rank < quota) & top_code[inverse[order]]
+        sample_set = list(unlabeled[order[selected]])
 
-        tmp_list = sorted(total_remain, key=lambda x: x[0], reverse=True)
-        sample_set += list(np.array(tmp_list)[:(sample_size - len(sample_set)), 1])
+        total_remain = order[~selected]
+        total_remain = total_remain[top_k(pred_loss[total_remain], sample_size - len(sample_set))]
+        sample_set += list(unlabeled[total_remain])
 
         if len(set(sample_set)) < sample_size:
             print('!!!!!!!!!!!!!!!! error !!!!!!!!!!!!!!!!', len(set(sample_set)))
 
-        self.labeled += sample_set
-        self.unlabeled = list(set(self.unlabeled) - set(sample_set))
+        self.pool.update(sample_set)
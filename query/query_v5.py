@@ -1,29 +1,34 @@
 import os
-import math
-import random
-from tqdm import tqdm
 
 import numpy as np
-from collections import Counter
 
-from torch.utils.data import DataLoader
 from torchvision import transforms
 from torchvision.datasets import CIFAR100, CIFAR10
 
-from data.sampler import Sampler
+from data.dataset import Tensor_CIFAR, make_loader
+from data.pool import PoolState
+from data.registry import get_dataset
+from query.code_cache import CodeCache
+from query.pipeline import Pipeline
+from query.topk import top_k
+from query.tfidf import CodeTFIDF
+from utils.hash_utils import pack_code, code_keys
+from utils.distributed import gather_shards
+from utils.runtime import get_device
 
 
 class Query(object):
     def __init__(self, config):
         self.config = config
+        self.device = get_device(self.config)
 
         self.initial_size = self.config.initial_size
         self.budget = self.config.budge_size
-        self.labeled = []
-        self.unlabeled = [i for i in range(self.config.data_size)]
-        self.code_idf = {}
+        self.pool = PoolState(self.config.data_size)
+        self.tfidf = CodeTFIDF(self.config.data_size)
 
         self.batch_size = self.config.vae_batch_size
+        self.pipeline = Pipeline(self.config)
 
         # define dataloader
         if 'cifar' in self.config.data_name:
@@ -33,119 +38,95 @@ class Query(object):
             ])
 
             if self.config.data_name == 'cifar10':
-                self.dataset = CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                       train=True, download=True, transform=self.train_transform)
+                self.dataset = get_dataset(CIFAR10, os.path.join(self.config.root_path, self.config.data_directory),
+                                           train=True, transform=self.train_transform)
             elif self.config.data_name == 'cifar100':
-                self.dataset = CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                        train=True, download=True, transform=self.train_transform)
+                self.dataset = get_dataset(CIFAR100, os.path.join(self.config.root_path, self.config.data_directory),
+                                           train=True, transform=self.train_transform)
 
-    def set_idf(self, strategy):
-        dataloader = DataLoader(self.dataset, batch_size=self.batch_size,
-                                pin_memory=self.config.pin_memory, sampler=Sampler(self.unlabeled))
-        tqdm_batch = tqdm(dataloader, leave=False, total=len(dataloader))
+            if self.config.tensor_dataset:
+                self.dataset = Tensor_CIFAR(self.dataset, pin_memory=self.config.pin_memory)
+
+        self.code_cache = CodeCache(self.config, self.dataset, 'query_v5')
 
-        code_lst = []
-        for curr_it, data in enumerate(tqdm_batch):
-            inputs = data[0].cuda(async=self.config.async_loading)
+    @property
+    def labeled(self):
+        return self.pool.labeled
 
-            code = strategy.get_code(inputs)
-            code = code.view([-1, self.config.vae_embedding_dim, code.size(2) * code.size(3)]).transpose(1, 2)
-            code = tuple(map(tuple, code.cpu().tolist()))
+    @property
+    def unlabeled(self):
+        return self.pool.unlabeled
 
-            for idx in range(len(code)):
-                code_lst += list(set(map(tuple, code[idx])))
+    def encode(self, strategy, inputs):
+        code = strategy.get_code(inputs)
+        code = code.view([-1, self.config.vae_embedding_dim, code.size(2) * code.size(3)]).transpose(1, 2)
+        code = code_keys(pack_code(code, self.config.vae_embedding_dim).cpu().numpy())
 
-        code_cnt = Counter(code_lst)
+        return code.reshape([inputs.size(0), -1])
 
-        for key in code_cnt:
-            self.code_idf[key] = math.log(self.config.data_size / (1 + code_cnt[key]))
+    def set_idf(self, strategy):
+        code = self.code_cache.get(strategy, self.encode)
+
+        self.tfidf.fit(code[self.unlabeled])
 
     def sampling(self, step_cnt, strategy, task):
         if not step_cnt:
-            random.shuffle(self.unlabeled)
-            self.labeled = self.unlabeled[:self.initial_size]
-            self.unlabeled = self.unlabeled[self.initial_size:]
+            self.pool.initialize(self.initial_size)
 
             return
 
         sample_size = self.budget
 
-        dataloader = DataLoader(self.dataset, batch_size=self.batch_size,
-                                pin_memory=self.config.pin_memory, sampler=Sampler(self.labeled))
-        tqdm_batch = tqdm(dataloader, leave=False, total=len(dataloader))
+        dataloader = make_loader(self.dataset, self.labeled, self.batch_size, self.config,
+                                 shard=self.config.shard_scoring)
 
-        data_lst = []
-        for curr_it, data in enumerate(tqdm_batch):
-            inputs = data[0].cuda(async=self.config.async_loading)
-            targets = data[1].cuda(async=self.config.async_loading)
+        def infer(data):
+            inputs = data[0].to(self.device, non_blocking=self.config.async_loading)
+            targets = data[1].to(self.device, non_blocking=self.config.async_loading)
 
             _, features, loss = task.get_result(inputs, targets)
-            loss = loss.cpu().numpy()
+            return loss
+
+        loss_lst = []
+        self.pipeline.run(dataloader, infer, lambda loss: loss_lst.append(loss.cpu().numpy()))
 
-            code = strategy.get_code(inputs)
-            code = code.view([-1, self.config.vae_embedding_dim, code.size(2) * code.size(3)]).transpose(1, 2)
-            code = tuple(map(tuple, code.cpu().tolist()))
+        loss = np.concatenate(loss_lst)
+        if self.config.shard_scoring:
+            loss = gather_shards(loss, len(self.labeled))
 
-            for idx in range(len(code)):
-                data_lst.append([loss[idx], code[idx]])
-        tqdm_batch.close()
+        code = self.code_cache.get(strategy, self.encode)
 
-        data_lst = sorted(data_lst, key=lambda x: x[0], reverse=True)
+        labeled_code = self.tfidf.encode(code[self.labeled])
+        labeled_code = labeled_code[np.argsort(-loss, kind='stable')]
 
         ############################# diversity
-        diversity_feature_set = []
-        for data in data_lst:
-            diversity_feature_set.extend(list(data[1]))
-        diversity_feature_set = set(map(tuple, diversity_feature_set))
+        diversity_weight = self.tfidf.doc_freq(labeled_code) > 0
+        diversity_weight = np.divide(1., self.tfidf.idf, out=np.zeros(len(self.tfidf)), where=diversity_weight)
 
         ############################# uncertainty
-        uncertainty_feature_set = []
-        for data in data_lst[:int(self.initial_size * 0.6)]:
-            uncertainty_feature_set.extend(list(data[1]))
-        uncertainty_feature_set = list(map(tuple, uncertainty_feature_set))
+        feature_cnt = np.bincount(labeled_code[:int(self.initial_size * 0.6)].ravel(), minlength=len(self.tfidf) + 1)
+        feature_cnt = feature_cnt[:len(self.tfidf)]
 
-        feature_cnt = Counter(uncertainty_feature_set)
-        for key in feature_cnt:
-            feature_cnt[key] *= self.code_idf[key]
-        feature_cnt = sorted(list(zip(feature_cnt.keys(), feature_cnt.values())), key=lambda x: x[1], reverse=True)
+        candidate = np.flatnonzero(feature_cnt)
+        candidate = candidate[np.argsort(-(feature_cnt * self.tfidf.idf)[candidate], kind='stable')]
 
-        uncertainty_feature_set, _ = zip(*feature_cnt[:len(feature_cnt) // 4])
-        uncertainty_feature_set = set(uncertainty_feature_set)
+        uncertainty_weight = np.zeros(len(self.tfidf))
+        uncertainty_weight[candidate[:len(candidate) // 4]] = 1.
 
         #############################
-        dataloader = DataLoader(self.dataset, batch_size=self.batch_size,
-                                pin_memory=self.config.pin_memory, sampler=Sampler(self.unlabeled))
-        tqdm_batch = tqdm(dataloader, leave=False, total=len(dataloader))
-
-        index = 0
-        unlabeled_set1, unlabeled_set2 = [], []
-        for curr_it, data in enumerate(tqdm_batch):
-            inputs = data[0].cuda(async=self.config.async_loading)
-
-            code = strategy.get_code(inputs)
-            code = code.view([-1, self.config.vae_embedding_dim, code.size(2) * code.size(3)]).transpose(1, 2)
-            code = tuple(map(tuple, code.cpu().tolist()))
-
-            for idx in range(len(code)):
-                tmp_code = tuple(map(tuple, code[idx]))
-                unlabeled_set1.append([self.unlabeled[index], len(set(tmp_code) & uncertainty_feature_set)])
-                unlabeled_set2.append([self.unlabeled[index],
-                                       sum([1 / self.code_idf[key] for key in set(tmp_code) & diversity_feature_set])])
-                index += 1
-        tqdm_batch.close()
+        unlabeled_code = self.tfidf.encode(code[self.unlabeled])
+        uncertainty_score = self.tfidf.score(unlabeled_code, uncertainty_weight)
+        diversity_score = self.tfidf.score(unlabeled_code, diversity_weight)
 
+        # half of the budget by uncertainty, the rest by diversity among what is left
         uncertainty_cnt = sample_size // 2
-        sample_set = list(np.array(sorted(unlabeled_set1, key=lambda x: x[1], reverse=True))[:uncertainty_cnt, 0])
+        selected = top_k(uncertainty_score, uncertainty_cnt)
 
-        idx = 0
-        ordered_diversity_index = list(np.array(sorted(unlabeled_set2, key=lambda x: x[1]))[:, 0])
-        while len(sample_set) < sample_size:
-            if ordered_diversity_index[idx] not in sample_set:
-                sample_set.append(ordered_diversity_index[idx])
-            idx += 1
+        diversity_score[selected] = np.inf
+        selected = np.concatenate([selected, top_k(diversity_score, sample_size - len(selected), largest=False)])
+        sample_set = list(self.unlabeled[selected])
 
         if len(set(sample_set)) < sample_size:
             print('!!!!!!!!!!!!!!!! error !!!!!!!!!!!!!!!!', len(set(sample_set)))
 
-        self.labeled += sample_set
-        self.unlabeled = list(set(self.unlabeled) - set(sample_set))
+        self.pool.update(sample_set)
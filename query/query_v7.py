@@ -1,29 +1,33 @@
 import os
-import math
-import random
-from tqdm import tqdm
 
 import numpy as np
-from collections import Counter
 
-from torch.utils.data import DataLoader
 from torchvision import transforms
 from torchvision.datasets import CIFAR100, CIFAR10
 
-from data.sampler import Sampler
+from data.dataset import Tensor_CIFAR, make_loader
+from data.pool import PoolState
+from data.registry import get_dataset
+from query.code_cache import CodeCache
+from query.pipeline import Pipeline
+from query.tfidf import CodeTFIDF, select
+from utils.hash_utils import pack_code, code_keys
+from utils.distributed import gather_shards
+from utils.runtime import get_device
 
 
 class Query(object):
     def __init__(self, config):
         self.config = config
+        self.device = get_device(self.config)
 
         self.initial_size = self.config.initial_size
         self.budget = self.config.budge_size
-        self.labeled = []
-        self.unlabeled = [i for i in range(self.config.data_size)]
-        self.code_idf = {}
+        self.pool = PoolState(self.config.data_size)
+        self.tfidf = CodeTFIDF(self.config.data_size)
 
         self.batch_size = self.config.vae_batch_size
+        self.pipeline = Pipeline(self.config)
 
         # define dataloader
         if 'cifar' in self.config.data_name:
@@ -33,96 +37,73 @@ class Query(object):
             ])
 
             if self.config.data_name == 'cifar10':
-                self.dataset = CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                       train=True, download=True, transform=self.train_transform)
+                self.dataset = get_dataset(CIFAR10, os.path.join(self.config.root_path, self.config.data_directory),
+                                           train=True, transform=self.train_transform)
             elif self.config.data_name == 'cifar100':
-                self.dataset = CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                        train=True, download=True, transform=self.train_transform)
+                self.dataset = get_dataset(CIFAR100, os.path.join(self.config.root_path, self.config.data_directory),
+                                           train=True, transform=self.train_transform)
 
-    def set_idf(self, strategy):
-        dataloader = DataLoader(self.dataset, batch_size=self.batch_size,
-                                pin_memory=self.config.pin_memory, sampler=Sampler(self.unlabeled))
-        tqdm_batch = tqdm(dataloader, leave=False, total=len(dataloader))
+            if self.config.tensor_dataset:
+                self.dataset = Tensor_CIFAR(self.dataset, pin_memory=self.config.pin_memory)
+
+        self.code_cache = CodeCache(self.config, self.dataset, 'query_v7')
+
+    @property
+    def labeled(self):
+        return self.pool.labeled
 
-        code_lst = []
-        for curr_it, data in enumerate(tqdm_batch):
-            inputs = data[0].cuda(async=self.config.async_loading)
+    @property
+    def unlabeled(self):
+        return self.pool.unlabeled
 
-            code = strategy.get_code(inputs)
-            code = code.view([-1, self.config.vae_embedding_dim, code.size(2) * code.size(3)]).transpose(1, 2)
-            code = tuple(map(tuple, code.cpu().tolist()))
+    def encode(self, strategy, inputs):
+        code = strategy.get_code(inputs)
+        code = code.view([-1, self.config.vae_embedding_dim, code.size(2) * code.size(3)]).transpose(1, 2)
+        code = code_keys(pack_code(code, self.config.vae_embedding_dim).cpu().numpy())
 
-            for idx in range(len(code)):
-                code_lst += list(set(map(tuple, code[idx])))
+        return code.reshape([inputs.size(0), -1])
 
-        code_cnt = Counter(code_lst)
+    def set_idf(self, strategy):
+        code = self.code_cache.get(strategy, self.encode)
 
-        for key in code_cnt:
-            self.code_idf[key] = math.log(self.config.data_size / (1 + code_cnt[key]))
+        self.tfidf.fit(code[self.unlabeled])
 
     def sampling(self, step_cnt, strategy, task, loss_first=False):
         if not step_cnt:
-            random.shuffle(self.unlabeled)
-            self.labeled = self.unlabeled[:self.initial_size]
-            self.unlabeled = self.unlabeled[self.initial_size:]
+            self.pool.initialize(self.initial_size)
 
             return
 
         sample_size = self.budget
 
-        dataloader = DataLoader(self.dataset, batch_size=self.batch_size,
-                                pin_memory=self.config.pin_memory, sampler=Sampler(self.labeled))
-        tqdm_batch = tqdm(dataloader, leave=False, total=len(dataloader))
+        code = self.code_cache.get(strategy, self.encode)
 
-        labeled_code_lst = []
-        for curr_it, data in enumerate(tqdm_batch):
-            inputs = data[0].cuda(async=self.config.async_loading)
+        #############################
+        labeled_code = self.tfidf.encode(code[self.labeled])
+        weight = self.tfidf.labeled_weight(labeled_code)
 
-            code = strategy.get_code(inputs)
-            code = code.view([-1, self.config.vae_embedding_dim, code.size(2) * code.size(3)]).transpose(1, 2)
-            code = tuple(map(tuple, code.cpu().tolist()))
+        #############################
+        dataloader = make_loader(self.dataset, self.unlabeled, self.batch_size, self.config,
+                                 shard=self.config.shard_scoring)
 
-            for idx in range(len(code)):
-                labeled_code_lst += list(set(map(tuple, code[idx])))
-        tqdm_batch.close()
+        def infer(data):
+            _, _, loss = task.get_result(data[0].to(self.device, non_blocking=self.config.async_loading))
 
-        #############################
-        labeled_code_cnt = Counter(labeled_code_lst)
-        labeled_code_set = set(labeled_code_cnt.keys())
+            return loss
 
-        #############################
-        dataloader = DataLoader(self.dataset, batch_size=self.batch_size,
-                                pin_memory=self.config.pin_memory, sampler=Sampler(self.unlabeled))
-        tqdm_batch = tqdm(dataloader, leave=False, total=len(dataloader))
-
-        index = 0
-        unlabeled_set = []
-        for curr_it, data in enumerate(tqdm_batch):
-            inputs = data[0].cuda(async=self.config.async_loading)
-
-            _, _, loss = task.get_result(inputs)
-            loss = loss.cpu().numpy()
-
-            code = strategy.get_code(inputs)
-            code = code.view([-1, self.config.vae_embedding_dim, code.size(2) * code.size(3)]).transpose(1, 2)
-            code = tuple(map(tuple, code.cpu().tolist()))
-
-            for idx in range(len(code)):
-                tmp_code = tuple(map(tuple, code[idx]))
-                unlabeled_set.append([self.unlabeled[index], loss[idx],
-                                      sum([self.code_idf[key] for key in set(tmp_code) & labeled_code_set])])
-                index += 1
-        tqdm_batch.close()
-
-        if loss_first:
-            tmp_set = np.array(sorted(unlabeled_set, key=lambda x: x[1], reverse=True))[:sample_size * 10, :]
-            sample_set = list(np.array(sorted(tmp_set, key=lambda x: x[2]))[:sample_size, 0])
-        else:
-            tmp_set = np.array(sorted(unlabeled_set, key=lambda x: x[2]))[:sample_size * 10, :]
-            sample_set = list(np.array(sorted(tmp_set, key=lambda x: x[1], reverse=True))[:sample_size, 0])
+        loss_lst = []
+        self.pipeline.run(dataloader, infer, lambda loss: loss_lst.append(loss.cpu().numpy()))
+
+        loss = np.concatenate(loss_lst)
+        if self.config.shard_scoring:
+            loss = gather_shards(loss, len(self.unlabeled))
+
+        unlabeled_code = self.tfidf.encode(code[self.unlabeled])
+        score = self.tfidf.score(unlabeled_code, weight)
+
+        sample_set = list(self.unlabeled[select(score, sample_size, loss, loss_first)])
 
         if len(set(sample_set)) < sample_size:
             print('!!!!!!!!!!!!!!!! error !!!!!!!!!!!!!!!!', len(set(sample_set)))
 
-        self.labeled += sample_set
-        self.unlabeled = list(set(self.unlabeled) - set(sample_set))
+        self.pool.update(sample_set)
@@ -1,29 +1,32 @@
 import os
-import math
-import random
-from tqdm import tqdm
 
 import numpy as np
-from collections import Counter
 
-from torch.utils.data import DataLoader
 from torchvision import transforms
 from torchvision.datasets import CIFAR100, CIFAR10
 
-from data.sampler import Sampler
+from data.dataset import Tensor_CIFAR, make_loader
+from data.pool import PoolState
+from data.registry import get_dataset
+from query.code_cache import CodeCache
+from query.pipeline import Pipeline
+from query.tfidf import CodeTFIDF, select
+from utils.distributed import gather_shards
+from utils.runtime import get_device
 
 
 class Query(object):
     def __init__(self, config):
         self.config = config
+        self.device = get_device(self.config)
 
         self.initial_size = self.config.initial_size
         self.budget = self.config.budge_size
-        self.labeled = []
-        self.unlabeled = [i for i in range(self.config.data_size)]
-        self.index_idf = {}
+        self.pool = PoolState(self.config.data_size)
+        self.tfidf = CodeTFIDF(self.config.data_size, binary=False)
 
         self.batch_size = self.config.vae_batch_size
+        self.pipeline = Pipeline(self.config)
 
         # define dataloader
         if 'cifar' in self.config.data_name:
@@ -33,93 +36,71 @@ class Query(object):
             ])
 
             if self.config.data_name == 'cifar10':
-                self.dataset = CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                       train=True, download=True, transform=self.train_transform)
+                self.dataset = get_dataset(CIFAR10, os.path.join(self.config.root_path, self.config.data_directory),
+                                           train=True, transform=self.train_transform)
             elif self.config.data_name == 'cifar100':
-                self.dataset = CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                        train=True, download=True, transform=self.train_transform)
+                self.dataset = get_dataset(CIFAR100, os.path.join(self.config.root_path, self.config.data_directory),
+                                           train=True, transform=self.train_transform)
 
-    def set_idf(self, strategy):
-        dataloader = DataLoader(self.dataset, batch_size=self.batch_size,
-                                pin_memory=self.config.pin_memory, sampler=Sampler(self.unlabeled))
-        tqdm_batch = tqdm(dataloader, leave=False, total=len(dataloader))
+            if self.config.tensor_dataset:
+                self.dataset = Tensor_CIFAR(self.dataset, pin_memory=self.config.pin_memory)
+
+        self.code_cache = CodeCache(self.config, self.dataset, 'query_v9')
+
+    @property
+    def labeled(self):
+        return self.pool.labeled
 
-        index_lst = []
-        for curr_it, data in enumerate(tqdm_batch):
-            inputs = data[0].cuda(async=self.config.async_loading)
+    @property
+    def unlabeled(self):
+        return self.pool.unlabeled
 
-            indices = strategy.get_index(inputs)
-            indices = indices.cpu().tolist()
+    def encode(self, strategy, inputs):
+        indices = strategy.get_index(inputs)
 
-            for idx in range(len(indices)):
-                index_lst += indices[idx]
+        return indices.cpu().numpy()
 
-        index_cnt = Counter(index_lst)
+    def set_idf(self, strategy):
+        indices = self.code_cache.get(strategy, self.encode)
 
-        for key in index_cnt:
-            self.index_idf[key] = math.log(self.config.data_size / (1 + index_cnt[key]))
+        self.tfidf.fit(indices[self.unlabeled])
 
     def sampling(self, step_cnt, strategy, task, loss_first=False):
         if not step_cnt:
-            random.shuffle(self.unlabeled)
-            self.labeled = self.unlabeled[:self.initial_size]
-            self.unlabeled = self.unlabeled[self.initial_size:]
+            self.pool.initialize(self.initial_size)
 
             return
 
         sample_size = self.budget
 
-        dataloader = DataLoader(self.dataset, batch_size=self.batch_size,
-                                pin_memory=self.config.pin_memory, sampler=Sampler(self.labeled))
-        tqdm_batch = tqdm(dataloader, leave=False, total=len(dataloader))
+        indices = self.code_cache.get(strategy, self.encode)
 
-        labeled_indices = []
-        for curr_it, data in enumerate(tqdm_batch):
-            inputs = data[0].cuda(async=self.config.async_loading)
+        #############################
+        labeled_indices = self.tfidf.encode(indices[self.labeled])
+        weight = self.tfidf.labeled_weight(labeled_indices)
 
-            indices = strategy.get_index(inputs)
-            indices = indices.cpu().tolist()
+        #############################
+        dataloader = make_loader(self.dataset, self.unlabeled, self.batch_size, self.config,
+                                 shard=self.config.shard_scoring)
 
-            for idx in range(len(indices)):
-                labeled_indices += indices[idx]
-        tqdm_batch.close()
+        def infer(data):
+            _, _, loss = task.get_result(data[0].to(self.device, non_blocking=self.config.async_loading))
 
-        #############################
-        labeled_index_cnt = Counter(labeled_indices)
-        labeled_index_set = set(labeled_index_cnt.keys())
+            return loss
 
-        #############################
-        dataloader = DataLoader(self.dataset, batch_size=self.batch_size,
-                                pin_memory=self.config.pin_memory, sampler=Sampler(self.unlabeled))
-        tqdm_batch = tqdm(dataloader, leave=False, total=len(dataloader))
-
-        index = 0
-        unlabeled_set = []
-        for curr_it, data in enumerate(tqdm_batch):
-            inputs = data[0].cuda(async=self.config.async_loading)
-
-            _, _, loss = task.get_result(inputs)
-            loss = loss.cpu().numpy()
-
-            indices = strategy.get_index(inputs)
-            indices = indices.cpu().tolist()
-
-            for idx in range(len(indices)):
-                tmp_code = set(indices[idx])
-                unlabeled_set.append([self.unlabeled[index], loss[idx],
-                                      sum([self.index_idf[key] for key in set(tmp_code) & labeled_index_set])])
-                index += 1
-        tqdm_batch.close()
-
-        if loss_first:
-            tmp_set = np.array(sorted(unlabeled_set, key=lambda x: x[1], reverse=True))[:sample_size * 10, :]
-            sample_set = list(np.array(sorted(tmp_set, key=lambda x: x[2]))[:sample_size, 0])
-        else:
-            tmp_set = np.array(sorted(unlabeled_set, key=lambda x: x[2]))[:sample_size * 10, :]
-            sample_set = list(np.array(sorted(tmp_set, key=lambda x: x[1], reverse=True))[:sample_size, 0])
+        loss_lst = []
+        self.pipeline.run(dataloader, infer, lambda loss: loss_lst.append(loss.cpu().numpy()))
+
+        loss = np.concatenate(loss_lst)
+        if self.config.shard_scoring:
+            loss = gather_shards(loss, len(self.unlabeled))
+
+        unlabeled_indices = self.tfidf.encode(indices[self.unlabeled])
+        score = self.tfidf.score(unlabeled_indices, weight)
+
+        sample_set = list(self.unlabeled[select(score, sample_size, loss, loss_first)])
 
         if len(set(sample_set)) < sample_size:
             print('!!!!!!!!!!!!!!!! error !!!!!!!!!!!!!!!!', len(set(sample_set)))
 
-        self.labeled += sample_set
-        self.unlabeled = list(set(self.unlabeled) - set(sample_set))
+        self.pool.update(sample_set)
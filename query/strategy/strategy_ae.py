@@ -2,18 +2,25 @@ import os
 import random
 from tqdm import tqdm
 
+import numpy as np
+
 import torch
-from torch import nn
 from torch.backends import cudnn
-from torch.utils.data import DataLoader
 from torchvision import transforms
 from torchvision.datasets import CIFAR100, CIFAR10
 
 from query.graph.ae import AE as ae
 from query.graph.loss import MSE as loss
+from data.augment import BatchAugment
+from data.dataset import Tensor_CIFAR, make_loader, CIFAR_MEAN, CIFAR_STD
+from data.registry import get_dataset
 
 from utils.metrics import AverageMeter
 from utils.train_utils import set_logger, count_model_prameters
+from utils.artifacts import atomic_save, checkpoint_path, load_artifact
+from utils.export import unwrap
+from utils.distributed import is_main_process, summary_writer
+from utils.runtime import get_device, place, parallel
 from tensorboardX import SummaryWriter
 
 cudnn.benchmark = True
@@ -22,6 +29,7 @@ cudnn.benchmark = True
 class Strategy(object):
     def __init__(self, config):
         self.config = config
+        self.device = get_device(self.config)
         self.best = 999999.0
 
         self.batch_size = self.config.batch_size * 8
@@ -29,6 +37,7 @@ class Strategy(object):
         self.logger = set_logger('train_epoch.log')
 
         # define dataloader
+        self.train_augment = None
         if 'cifar' in self.config.data_name:
             self.train_transform = transforms.Compose([
                 transforms.RandomHorizontalFlip(),
@@ -38,21 +47,28 @@ class Strategy(object):
                 transforms.RandomErasing(p=0.6, scale=(0.03, 0.08), ratio=(0.3, 3.3)),
             ])
             if self.config.data_name == 'cifar10':
-                self.train_dataset = CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                             train=True, download=True, transform=self.train_transform)
+                self.train_dataset = get_dataset(CIFAR10,
+                                                 os.path.join(self.config.root_path, self.config.data_directory),
+                                                 train=True, transform=self.train_transform)
             elif self.config.data_name == 'cifar100':
-                self.train_dataset = CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                              train=True, download=True, transform=self.train_transform)
+                self.train_dataset = get_dataset(CIFAR100,
+                                                 os.path.join(self.config.root_path, self.config.data_directory),
+                                                 train=True, transform=self.train_transform)
+
+            if self.config.batch_augment:
+                self.train_dataset = Tensor_CIFAR(self.train_dataset, pin_memory=self.config.pin_memory)
+                self.train_augment = BatchAugment(CIFAR_MEAN, CIFAR_STD, erasing=(0.6, (0.03, 0.08), (0.3, 3.3)))
 
-        self.train_loader = DataLoader(self.train_dataset, batch_size=self.batch_size, shuffle=True, num_workers=2,
-                                       pin_memory=self.config.pin_memory)
+        self.train_loader = make_loader(self.train_dataset, np.arange(len(self.train_dataset)), self.batch_size,
+                                        self.config, num_workers=2, augment=self.train_augment, shuffle=True,
+                                        shard=True)
 
         # define models
-        self.ae = ae(self.config.vae_num_residual_layers, self.config.vae_num_residual_hiddens,
-                     self.config.vae_embedding_dim).cuda()
+        self.ae = place(ae(self.config.vae_num_residual_layers, self.config.vae_num_residual_hiddens,
+                           self.config.vae_embedding_dim), self.config)
 
         # define loss
-        self.loss = loss().cuda()
+        self.loss = loss().to(self.device)
 
         # define optimizer
         self.ae_opt = torch.optim.Adam(self.ae.parameters(), lr=self.config.vae_learning_rate)
@@ -65,26 +81,34 @@ class Strategy(object):
         self.epoch = 0
 
         # parallel setting
-        gpu_list = list(range(self.config.gpu_cnt))
-        self.ae = nn.DataParallel(self.ae, device_ids=gpu_list)
+        self.ae = parallel(self.ae, self.config)
 
         # Model Loading from the latest checkpoint if not found start from scratch.
 
         self.print_train_info()
-        self.summary_writer = SummaryWriter(log_dir=os.path.join(self.config.root_path, self.config.summary_directory),
-                                            comment='AE')
+        self.summary_writer = summary_writer(SummaryWriter,
+                                             log_dir=os.path.join(self.config.root_path, self.config.summary_directory),
+                                             comment='AE')
 
     def print_train_info(self):
         print('Number of generator parameters: {}'.format(count_model_prameters(self.ae)))
 
     def save_checkpoint(self):
-        tmp_name = os.path.join(self.config.root_path, self.config.checkpoint_directory, 'ae.pth.tar')
+        if not is_main_process():
+            return
+
+        tmp_name = checkpoint_path(self, 'ae')
 
         state = {
-            'ae_state_dict': self.ae.state_dict(),
+            'ae_state_dict': unwrap(self.ae).state_dict(),
         }
 
-        torch.save(state, tmp_name)
+        atomic_save(state, tmp_name)
+
+    def load_checkpoint(self):
+        tmp_name = checkpoint_path(self, 'ae')
+
+        return load_artifact(tmp_name, {'ae_state_dict': self.ae}, self.device)
 
     def run(self):
         try:
@@ -108,7 +132,7 @@ class Strategy(object):
         for curr_it, data in enumerate(tqdm_batch):
             self.ae_opt.zero_grad()
 
-            data = data[0].cuda(async=self.config.async_loading)
+            data = data[0].to(self.device, non_blocking=self.config.async_loading)
 
             recon, _ = self.ae(data)
 
@@ -1,20 +1,26 @@
 import os
 import random
+import numpy as np
 from tqdm import tqdm
 
 import torch
-from torch import nn
+import torch.nn.functional as F
 from torch.backends import cudnn
-from torch.utils.data import DataLoader
 from torchvision import transforms
 from torchvision.datasets import CIFAR100, CIFAR10
 
 from query.graph.transformer import Transformer as transformer
 from query.graph.loss import MSE as loss
-from data.sampler import Sampler
+from data.augment import BatchAugment
+from data.dataset import Tensor_CIFAR, make_loader, CIFAR_MEAN, CIFAR_STD
+from data.registry import get_dataset
 
 from utils.metrics import AverageMeter
 from utils.train_utils import set_logger, count_model_prameters
+from utils.artifacts import atomic_save, checkpoint_path
+from utils.export import unwrap
+from utils.distributed import is_main_process, shard_indices, summary_writer
+from utils.runtime import get_device, place, parallel
 from tensorboardX import SummaryWriter
 
 cudnn.benchmark = True
@@ -23,6 +29,7 @@ cudnn.benchmark = True
 class Strategy(object):
     def __init__(self, config):
         self.config = config
+        self.device = get_device(self.config)
         self.best = 999999.0
 
         self.batch_size = self.config.batch_size * 8
@@ -30,6 +37,7 @@ class Strategy(object):
         self.logger = set_logger('train_epoch.log')
 
         # define dataloader
+        self.train_augment = None
         if 'cifar' in self.config.data_name:
             self.train_transform = transforms.Compose([
                 transforms.RandomHorizontalFlip(),
@@ -39,40 +47,49 @@ class Strategy(object):
                 transforms.RandomErasing(p=0.6, scale=(0.03, 0.08), ratio=(0.3, 3.3)),
             ])
             if self.config.data_name == 'cifar10':
-                self.train_dataset = CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                             train=True, download=True, transform=self.train_transform)
+                self.train_dataset = get_dataset(CIFAR10,
+                                                 os.path.join(self.config.root_path, self.config.data_directory),
+                                                 train=True, transform=self.train_transform)
             elif self.config.data_name == 'cifar100':
-                self.train_dataset = CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                              train=True, download=True, transform=self.train_transform)
+                self.train_dataset = get_dataset(CIFAR100,
+                                                 os.path.join(self.config.root_path, self.config.data_directory),
+                                                 train=True, transform=self.train_transform)
+
+            if self.config.batch_augment:
+                self.train_dataset = Tensor_CIFAR(self.train_dataset, pin_memory=self.config.pin_memory)
+                self.train_augment = BatchAugment(CIFAR_MEAN, CIFAR_STD, erasing=(0.6, (0.03, 0.08), (0.3, 3.3)))
 
         # define models
-        self.transformer = transformer(self.config.vae_embedding_dim).cuda()
+        self.transformer = place(transformer(self.config.vae_embedding_dim), self.config)
 
         # parallel setting
-        gpu_list = list(range(self.config.gpu_cnt))
-        self.transformer = nn.DataParallel(self.transformer, device_ids=gpu_list)
+        self.transformer = parallel(self.transformer, self.config)
 
         # Model Loading from the latest checkpoint if not found start from scratch.
 
         self.print_train_info()
-        self.summary_writer = SummaryWriter(log_dir=os.path.join(self.config.root_path, self.config.summary_directory),
-                                            comment='Transformer')
+        self.summary_writer = summary_writer(SummaryWriter,
+                                             log_dir=os.path.join(self.config.root_path, self.config.summary_directory),
+                                             comment='Transformer')
 
     def print_train_info(self):
         print('Number of generator parameters: {}'.format(count_model_prameters(self.transformer)))
 
     def save_checkpoint(self):
-        tmp_name = os.path.join(self.config.root_path, self.config.checkpoint_directory, 'transformer.pth.tar')
+        if not is_main_process():
+            return
+
+        tmp_name = checkpoint_path(self, 'transformer')
 
         state = {
-            'transformer_state_dict': self.transformer.state_dict(),
+            'transformer_state_dict': unwrap(self.transformer).state_dict(),
         }
 
-        torch.save(state, tmp_name)
+        atomic_save(state, tmp_name)
 
     def set_train(self):
         # define loss
-        self.loss = loss().cuda()
+        self.loss = loss().to(self.device)
 
         # define optimizer
         self.transformer_opt = torch.optim.Adam(self.transformer.parameters(), lr=self.config.vae_learning_rate)
@@ -85,39 +102,75 @@ class Strategy(object):
         self.epoch = 0
 
     def run(self, task, ae, sample_list):
-        data_loader = DataLoader(self.train_dataset, batch_size=self.batch_size, num_workers=2,
-                                 pin_memory=self.config.pin_memory, sampler=Sampler(sample_list))
+        data_loader = make_loader(self.train_dataset, sample_list, self.batch_size, self.config, num_workers=2,
+                                  augment=self.train_augment)
         try:
             self.set_train()
-            self.train(task, ae, data_loader)
+            self.precompute(task, ae, data_loader)
+            self.train()
 
         except KeyboardInterrupt:
             print("You have entered CTRL+C.. Wait to finalize")
 
-    def train(self, task, ae, data_loader):
+    def precompute(self, task, ae, data_loader):
+        """
+        task and ae are frozen, so their outputs are computed once for `transformer_cache_views` augmented views
+        of every sample: pooled backbone features [views, N, 64+128+256+512] and ae targets [views, N, ...] in fp16
+        """
+        feature_lst, target_lst = [], []
+        self.channels = []
+        for _ in range(self.config.transformer_cache_views):
+            tqdm_batch = tqdm(data_loader, leave=False, total=len(data_loader))
+
+            view_features, view_targets = [], []
+            for curr_it, data in enumerate(tqdm_batch):
+                data = data[0].to(self.device, non_blocking=self.config.async_loading)
+
+                task_features = task.get_feature(data)
+                pooled = [F.adaptive_avg_pool2d(features, 1).flatten(1) for features in task_features]
+                if not self.channels:
+                    self.channels = [features.size(1) for features in pooled]
+                view_features.append(torch.cat(pooled, dim=1).half().cpu())
+
+                ae_features = ae.get_feature(data)
+                view_targets.append(ae_features.reshape([data.size(0), -1]).half().cpu())
+            tqdm_batch.close()
+
+            feature_lst.append(torch.cat(view_features))
+            target_lst.append(torch.cat(view_targets))
+
+        assert self.channels, 'no labeled sample / cached view to precompute the transformer inputs from'
+        self.feature_cache = torch.stack(feature_lst)
+        self.target_cache = torch.stack(target_lst)
+
+    def train(self):
         for _ in range(self.config.vae_epoch):
             self.epoch += 1
-            self.train_by_epoch(task, ae, data_loader)
+            self.train_by_epoch()
         self.save_checkpoint()
 
-    def train_by_epoch(self, task, ae, data_loader):
-        tqdm_batch = tqdm(data_loader, leave=False, total=len(data_loader))
+    def train_by_epoch(self):
+        n_views, n_samples = self.feature_cache.size(0), self.feature_cache.size(1)
+
+        # same batch order as the sampler, every sample sees one of its cached views per epoch
+        views = torch.randint(n_views, (n_samples,))
+        batches = torch.as_tensor(shard_indices(np.arange(n_samples))).split(self.batch_size)
+        tqdm_batch = tqdm(batches, leave=False, total=len(batches))
 
         avg_loss = AverageMeter()
 
         self.transformer.train()
-        for curr_it, data in enumerate(tqdm_batch):
+        for curr_it, index in enumerate(tqdm_batch):
             self.transformer_opt.zero_grad()
 
-            data = data[0].cuda(async=self.config.async_loading)
+            features = self.feature_cache[views[index], index].to(self.device, non_blocking=self.config.async_loading)
+            ae_features = self.target_cache[views[index], index].to(self.device, non_blocking=self.config.async_loading)
 
-            task_features = task.get_feature(data)
-            for idx in range(len(task_features)):
-                task_features[idx] = task_features[idx].detach()
+            # pooled features go in as [B, C, 1, 1], the transformer's average pool leaves them unchanged
+            task_features = [f.float().view([f.size(0), -1, 1, 1]) for f in features.split(self.channels, dim=1)]
             pre_features = self.transformer(task_features)
 
-            ae_features = ae.get_feature(data)
-            ae_features = ae_features.detach()
+            ae_features = ae_features.float()
 
             # reconstruction loss
             loss = self.loss(pre_features, ae_features.view([-1, self.config.vae_embedding_dim]))
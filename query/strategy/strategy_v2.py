@@ -2,20 +2,27 @@ import os
 import random
 from tqdm import tqdm
 
+import numpy as np
+
 import torch
-from torch import nn
 from torch.backends import cudnn
-from torch.utils.data import DataLoader
 from torchvision import transforms
 
 from query.graph.hash import Hash as hashnet
 from query.graph.loss import HashLoss as hloss
 from query.graph.loss import CodeLoss as closs
-from data.dataset import Dataset_CIFAR10, Dataset_CIFAR100
-from data.sampler import Sampler
+from data.augment import BatchAugment
+from data.dataset import Dataset_CIFAR10, Dataset_CIFAR100, Tensor_CIFAR, make_loader, CIFAR_MEAN, CIFAR_STD
+from data.feature_store import FeatureStore
+from data.registry import get_dataset
 
 from utils.metrics import AverageMeter, mAP
+from utils.hash_utils import pack_code, code_keys
 from utils.train_utils import set_logger, count_model_prameters
+from utils.artifacts import atomic_save, checkpoint_path
+from utils.export import unwrap
+from utils.distributed import is_main_process, barrier, broadcast, shard_indices, summary_writer
+from utils.runtime import get_device, place, parallel, inference_mode
 from tensorboardX import SummaryWriter
 
 cudnn.benchmark = False
@@ -24,6 +31,7 @@ cudnn.benchmark = False
 class Strategy(object):
     def __init__(self, config):
         self.config = config
+        self.device = get_device(self.config)
         self.best = 999999.0
 
         self.batch_size = self.config.batch_size * 8
@@ -31,6 +39,7 @@ class Strategy(object):
         self.logger = set_logger('train_epoch.log')
 
         # define dataloader
+        self.train_augment = None
         if 'cifar' in self.config.data_name:
             self.train_transform = transforms.Compose([
                 transforms.RandomHorizontalFlip(),
@@ -41,45 +50,57 @@ class Strategy(object):
             ])
 
             if self.config.data_name == 'cifar10':
-                self.train_dataset = Dataset_CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                                     train=True, download=True, transform=self.train_transform)
-                self.test_dataset = Dataset_CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                                    train=False, download=True, transform=self.train_transform)
+                self.train_dataset = get_dataset(Dataset_CIFAR10,
+                                                 os.path.join(self.config.root_path, self.config.data_directory),
+                                                 train=True, transform=self.train_transform)
+                self.test_dataset = get_dataset(Dataset_CIFAR10,
+                                                os.path.join(self.config.root_path, self.config.data_directory),
+                                                train=False, transform=self.train_transform)
             elif self.config.data_name == 'cifar100':
-                self.train_dataset = Dataset_CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                                      train=True, download=True, transform=self.train_transform)
-                self.test_dataset = Dataset_CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                                     train=False, download=True, transform=self.train_transform)
+                self.train_dataset = get_dataset(Dataset_CIFAR100,
+                                                 os.path.join(self.config.root_path, self.config.data_directory),
+                                                 train=True, transform=self.train_transform)
+                self.test_dataset = get_dataset(Dataset_CIFAR100,
+                                                os.path.join(self.config.root_path, self.config.data_directory),
+                                                train=False, transform=self.train_transform)
+
+            if self.config.batch_augment:
+                self.train_dataset = Tensor_CIFAR(self.train_dataset, pin_memory=self.config.pin_memory)
+                self.test_dataset = Tensor_CIFAR(self.test_dataset, pin_memory=self.config.pin_memory)
+                self.train_augment = BatchAugment(CIFAR_MEAN, CIFAR_STD, erasing=(0.6, (0.03, 0.08), (0.3, 3.3)))
 
         # define models
-        self.hashnet = hashnet(self.config.vae_embedding_dim).cuda()
+        self.hashnet = place(hashnet(self.config.vae_embedding_dim), self.config)
 
         # parallel setting
-        gpu_list = list(range(self.config.gpu_cnt))
-        self.hashnet = nn.DataParallel(self.hashnet, device_ids=gpu_list)
+        self.hashnet = parallel(self.hashnet, self.config)
 
         # Model Loading from the latest checkpoint if not found start from scratch.
 
         self.print_train_info()
-        self.summary_writer = SummaryWriter(log_dir=os.path.join(self.config.root_path, self.config.summary_directory),
-                                            comment='AE-HASH')
+        self.summary_writer = summary_writer(SummaryWriter,
+                                             log_dir=os.path.join(self.config.root_path, self.config.summary_directory),
+                                             comment='AE-HASH')
 
     def print_train_info(self):
         print('Number of generator parameters: {}'.format(count_model_prameters(self.hashnet)))
 
     def save_checkpoint(self):
-        tmp_name = os.path.join(self.config.root_path, self.config.checkpoint_directory, 'hashnet.pth.tar')
+        if not is_main_process():
+            return
+
+        tmp_name = checkpoint_path(self, 'hashnet')
 
         state = {
-            'hashnet_state_dict': self.hashnet.state_dict(),
+            'hashnet_state_dict': unwrap(self.hashnet).state_dict(),
         }
 
-        torch.save(state, tmp_name)
+        atomic_save(state, tmp_name)
 
     def set_train(self):
         # define loss
-        self.hloss = hloss().cuda()
-        self.closs = closs().cuda()
+        self.hloss = hloss().to(self.device)
+        self.closs = closs().to(self.device)
 
         # define optimizer
         self.hashnet_opt = torch.optim.Adam(self.hashnet.parameters(), lr=self.config.vae_learning_rate)
@@ -94,29 +115,100 @@ class Strategy(object):
     def run(self, task, sample_list):
         try:
             self.set_train()
+            self.extract(task)
             self.train(task, sample_list)
 
         except KeyboardInterrupt:
             print("You have entered CTRL+C.. Wait to finalize")
 
+        finally:
+            self.release()
+
     def train(self, task, sample_list):
         for _ in range(self.config.vae_epoch):
             self.epoch += 1
-            self.train_by_epoch(task, sample_list[:])
+            self.train_by_epoch(task, list(sample_list))
 
         self.test(task)
         self.save_checkpoint()
 
+    def extract(self, task):
+        """
+        the task is frozen while the hashnet trains, so its feature maps are written once per cycle:
+        view 0 of the origin images and `feature_store_views` augmented views for the train set, view 0 for the test set
+        under torch.distributed rank 0 extracts and the other ranks map its files read-only
+        """
+        directory = os.path.join(self.config.root_path, self.config.feature_store_directory)
+
+        # keyed by (rank 0's) process, parallel trials share the directory
+        key = broadcast(os.getpid())
+        self.train_store = FeatureStore(directory, f'strategy_v2_{key}_train', len(self.train_dataset),
+                                        self.config.feature_store_views + 1)
+        self.test_store = FeatureStore(directory, f'strategy_v2_{key}_test', len(self.test_dataset))
+
+        self.train_targets = torch.as_tensor(self.train_dataset.targets, dtype=torch.long)
+        self.test_targets = torch.as_tensor(self.test_dataset.targets, dtype=torch.long)
+
+        if is_main_process():
+            for view in range(self.config.feature_store_views):
+                self.extract_store(task, self.train_dataset, self.train_store, view)
+            self.extract_store(task, self.test_dataset, self.test_store, None)
+
+            self.train_store.seal()
+            self.test_store.seal()
+
+        barrier()
+        if not is_main_process():
+            self.train_store.open()
+            self.test_store.open()
+
+    def release(self):
+        """
+        the stores only live for one cycle, the next one extracts from a retrained task
+        """
+        barrier()
+        for store in [getattr(self, 'train_store', None), getattr(self, 'test_store', None)]:
+            if store is not None and is_main_process():
+                store.remove()
+
+        self.train_store = self.test_store = None
+
+    def extract_store(self, task, dataset, store, view):
+        # view None: only the origin images, otherwise origin (first pass only) plus the augmented view + 1
+        data_loader = make_loader(dataset, np.arange(len(dataset)), self.batch_size, self.config, num_workers=2,
+                                  augment=self.train_augment, paired=True)
+        tqdm_batch = tqdm(data_loader, leave=False, total=len(data_loader))
+
+        start = 0
+        for curr_it, data in enumerate(tqdm_batch):
+            if not view:
+                origin_data = data['origin'].to(self.device, non_blocking=self.config.async_loading)
+
+                _, origin_features, _ = task.get_result(origin_data)
+                store.write(0, start, origin_features)
+
+            if view is not None:
+                trans_data = data['trans'].to(self.device, non_blocking=self.config.async_loading)
+
+                _, trans_features, _ = task.get_result(trans_data)
+                store.write(view + 1, start, trans_features)
+
+            start += data['target'].size(0)
+        tqdm_batch.close()
+
+        store.flush()
+
     def train_by_epoch(self, task, sample_list):
+        rng = np.random.RandomState(broadcast(random.getrandbits(32)))
         if self.epoch % 2:
-            random.shuffle(sample_list)
-            train_loader = DataLoader(self.train_dataset, batch_size=self.batch_size, num_workers=2,
-                                      pin_memory=self.config.pin_memory, sampler=Sampler(sample_list))
+            sample_list = rng.permutation(sample_list)
         else:
-            train_loader = DataLoader(self.train_dataset, batch_size=self.batch_size, num_workers=2, shuffle=True,
-                                      pin_memory=self.config.pin_memory)
+            sample_list = rng.permutation(len(self.train_dataset))
+        sample_list = shard_indices(sample_list)
 
-        tqdm_batch = tqdm(train_loader, leave=False, total=len(train_loader))
+        # sorted batches keep the memory-mapped reads sequential
+        batches = [np.sort(sample_list[i:i + self.batch_size]) for i in range(0, len(sample_list), self.batch_size)]
+        tqdm_batch = tqdm(batches, leave=False, total=len(batches))
 
         centroid_set = set()
         avg_loss = AverageMeter()
@@ -124,17 +216,17 @@ class Strategy(object):
         avg_balance_loss = AverageMeter()
 
         self.hashnet.train()
-        for curr_it, data in enumerate(tqdm_batch):
+        for curr_it, index in enumerate(tqdm_batch):
             self.hashnet_opt.zero_grad()
 
-            origin_data = data['origin'].cuda(async=self.config.async_loading)
-            trans_data = data['trans'].cuda(async=self.config.async_loading)
-            target = data['target'].cuda(async=self.config.async_loading)
+            # an independent augmented view per sample
+            view = rng.randint(1, self.train_store.n_views, size=len(index))
+            target = self.train_targets[index].to(self.device, non_blocking=self.config.async_loading)
 
-            _, origin_features, _ = task.get_result(origin_data)
+            origin_features = self.train_store.read(0, index, self.device, self.config.async_loading)
             origin_logit = self.hashnet(origin_features)
 
-            _, trans_features, _ = task.get_result(trans_data)
+            trans_features = self.train_store.read(view, index, self.device, self.config.async_loading)
             trans_logit = self.hashnet(trans_features)
 
             code_balance_loss, code_loss = self.closs(origin_logit, trans_logit)
@@ -153,7 +245,7 @@ class Strategy(object):
                 avg_balance_loss.update(code_balance_loss)
 
                 origin_code = torch.sign(origin_logit)
-                centroid_set |= set(tuple(map(tuple, origin_code.view([-1, self.config.vae_embedding_dim]).cpu().tolist())))
+                centroid_set |= set(code_keys(pack_code(origin_code, self.config.vae_embedding_dim).cpu().numpy()).tolist())
 
         tqdm_batch.close()
         self.hashnet_scheduler.step(avg_loss.val)
@@ -167,20 +259,15 @@ class Strategy(object):
             print(f'{self.epoch} - loss: {avg_loss.val} / best: {self.best} / centroid cnt: {len(centroid_set)}')
 
     def test(self, task):
-        train_loader = DataLoader(self.train_dataset, batch_size=self.batch_size, num_workers=2,
-                                  pin_memory=self.config.pin_memory)
-        test_loader = DataLoader(self.test_dataset, batch_size=self.batch_size, num_workers=2,
-                                 pin_memory=self.config.pin_memory)
-
         train_code, test_code, train_label, test_label = [], [], [], []
         self.hashnet.eval()
-        with torch.no_grad():
-            tqdm_train = tqdm(train_loader, leave=False, total=len(train_loader))
-            for curr_it, data in enumerate(tqdm_train):
-                origin_data = data['origin'].cuda(async=self.config.async_loading)
-                target = data['target'].cuda(async=self.config.async_loading)
+        with inference_mode():
+            tqdm_train = tqdm(range(0, self.train_store.n_samples, self.batch_size), leave=False)
+            for start in tqdm_train:
+                index = np.arange(start, min(start + self.batch_size, self.train_store.n_samples))
+                target = self.train_targets[index].to(self.device, non_blocking=self.config.async_loading)
 
-                _, origin_features, _ = task.get_result(origin_data)
+                origin_features = self.train_store.read(0, index, self.device, self.config.async_loading)
                 origin_logit = self.hashnet(origin_features)
 
                 train_code.append(torch.sign(origin_logit))
@@ -189,12 +276,12 @@ class Strategy(object):
             tqdm_train.close()
             train_code, train_label = torch.cat(train_code), torch.cat(train_label)
 
-            tqdm_test = tqdm(test_loader, leave=False, total=len(test_loader))
-            for curr_it, data in enumerate(tqdm_test):
-                origin_data = data['origin'].cuda(async=self.config.async_loading)
-                target = data['target'].cuda(async=self.config.async_loading)
+            tqdm_test = tqdm(range(0, self.test_store.n_samples, self.batch_size), leave=False)
+            for start in tqdm_test:
+                index = np.arange(start, min(start + self.batch_size, self.test_store.n_samples))
+                target = self.test_targets[index].to(self.device, non_blocking=self.config.async_loading)
 
-                _, origin_features, _ = task.get_result(origin_data)
+                origin_features = self.test_store.read(0, index, self.device, self.config.async_loading)
                 origin_logit = self.hashnet(origin_features)
 
                 test_code.append(torch.sign(origin_logit))
@@ -208,7 +295,7 @@ class Strategy(object):
 
     def get_code(self, inputs):
         self.hashnet.eval()
-        with torch.no_grad():
+        with inference_mode():
             logit = self.hashnet(inputs)
 
         return torch.sign(logit)
@@ -1,10 +1,10 @@
 import os
 from tqdm import tqdm
 
+import numpy as np
+
 import torch
-from torch import nn
 from torch.backends import cudnn
-from torch.utils.data import DataLoader
 from torchvision import transforms
 
 from query.graph.vae_bihalf import VAE as vae
@@ -12,10 +12,17 @@ from query.graph.loss import MSE as loss
 from query.graph.loss import CodeLoss as closs
 from query.graph.loss import BHLoss as bhloss
 
-from data.dataset import Dataset_CIFAR10, Dataset_CIFAR100
+from data.augment import BatchAugment
+from data.dataset import Dataset_CIFAR10, Dataset_CIFAR100, Tensor_CIFAR, make_loader, CIFAR_MEAN, CIFAR_STD
+from data.registry import get_dataset
 
 from utils.metrics import AverageMeter, mAP
+from utils.hash_utils import pack_code, code_keys
 from utils.train_utils import set_logger, count_model_prameters
+from utils.artifacts import atomic_save, checkpoint_path, load_artifact
+from utils.export import freeze, CodeEncoder, unwrap
+from utils.distributed import is_main_process, summary_writer
+from utils.runtime import get_device, place, parallel, inference_mode
 
 from tensorboardX import SummaryWriter
 
@@ -25,6 +32,7 @@ cudnn.benchmark = False
 class Strategy(object):
     def __init__(self, config):
         self.config = config
+        self.device = get_device(self.config)
         self.best = 999999.0
 
         self.batch_size = self.config.batch_size * 8
@@ -32,6 +40,7 @@ class Strategy(object):
         self.logger = set_logger('train_epoch.log')
 
         # define dataloader
+        self.train_augment = None
         if 'cifar' in self.config.data_name:
             self.train_transform = transforms.Compose([
                 transforms.RandomHorizontalFlip(),
@@ -42,27 +51,37 @@ class Strategy(object):
             ])
 
             if self.config.data_name == 'cifar10':
-                self.train_dataset = Dataset_CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                                     train=True, download=True, transform=self.train_transform)
-                self.test_dataset = Dataset_CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                                    train=False, download=True, transform=self.train_transform)
+                self.train_dataset = get_dataset(Dataset_CIFAR10,
+                                                 os.path.join(self.config.root_path, self.config.data_directory),
+                                                 train=True, transform=self.train_transform)
+                self.test_dataset = get_dataset(Dataset_CIFAR10,
+                                                os.path.join(self.config.root_path, self.config.data_directory),
+                                                train=False, transform=self.train_transform)
             elif self.config.data_name == 'cifar100':
-                self.train_dataset = Dataset_CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                                      train=True, download=True, transform=self.train_transform)
-                self.test_dataset = Dataset_CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                                     train=False, download=True, transform=self.train_transform)
-
-        self.train_loader = DataLoader(self.train_dataset, batch_size=self.batch_size, shuffle=True, num_workers=2,
-                                       pin_memory=self.config.pin_memory)
+                self.train_dataset = get_dataset(Dataset_CIFAR100,
+                                                 os.path.join(self.config.root_path, self.config.data_directory),
+                                                 train=True, transform=self.train_transform)
+                self.test_dataset = get_dataset(Dataset_CIFAR100,
+                                                os.path.join(self.config.root_path, self.config.data_directory),
+                                                train=False, transform=self.train_transform)
+
+            if self.config.batch_augment:
+                self.train_dataset = Tensor_CIFAR(self.train_dataset, pin_memory=self.config.pin_memory)
+                self.test_dataset = Tensor_CIFAR(self.test_dataset, pin_memory=self.config.pin_memory)
+                self.train_augment = BatchAugment(CIFAR_MEAN, CIFAR_STD, erasing=(0.6, (0.03, 0.08), (0.3, 3.3)))
+
+        self.train_loader = make_loader(self.train_dataset, np.arange(len(self.train_dataset)), self.batch_size,
+                                        self.config, num_workers=2, augment=self.train_augment, shuffle=True,
+                                        paired=True, shard=True)
 
         # define models
-        self.vae = vae(self.config.vae_num_hiddens, self.config.vae_num_residual_layers,
-                       self.config.vae_num_residual_hiddens, self.config.vae_embedding_dim).cuda()
+        self.vae = place(vae(self.config.vae_num_hiddens, self.config.vae_num_residual_layers,
+                             self.config.vae_num_residual_hiddens, self.config.vae_embedding_dim), self.config)
 
         # define loss
-        self.loss = loss().cuda()
-        self.closs = closs().cuda()
-        self.bhloss = bhloss().cuda()
+        self.loss = loss().to(self.device)
+        self.closs = closs().to(self.device)
+        self.bhloss = bhloss().to(self.device)
 
         # define optimizer
         self.vae_opt = torch.optim.Adam(self.vae.parameters(), lr=self.config.vae_learning_rate)
@@ -75,26 +94,55 @@ class Strategy(object):
         self.epoch = 0
 
         # parallel setting
-        gpu_list = list(range(self.config.gpu_cnt))
-        self.vae = nn.DataParallel(self.vae, device_ids=gpu_list)
+        self.vae = parallel(self.vae, self.config)
+
+        # frozen encoder of the current weights, decoder stripped
+        self.encoder = None
 
         # Model Loading from the latest checkpoint if not found start from scratch.
 
         self.print_train_info()
-        self.summary_writer = SummaryWriter(log_dir=os.path.join(self.config.root_path, self.config.summary_directory),
-                                            comment='AE-HASH')
+        self.summary_writer = summary_writer(SummaryWriter,
+                                             log_dir=os.path.join(self.config.root_path, self.config.summary_directory),
+                                             comment='AE-HASH')
 
     def print_train_info(self):
         print('Number of generator parameters: {}'.format(count_model_prameters(self.vae)))
 
     def save_checkpoint(self):
-        tmp_name = os.path.join(self.config.root_path, self.config.checkpoint_directory, 'vae.pth.tar')
+        if not is_main_process():
+            return
+
+        tmp_name = checkpoint_path(self, 'vae')
 
         state = {
-            'vae_state_dict': self.vae.state_dict(),
+            'vae_state_dict': unwrap(self.vae).state_dict(),
         }
 
-        torch.save(state, tmp_name)
+        atomic_save(state, tmp_name)
+
+    def load_checkpoint(self):
+        tmp_name = checkpoint_path(self, 'vae')
+
+        loaded = load_artifact(tmp_name, {'vae_state_dict': self.vae}, self.device)
+        if loaded:
+            self.export()
+
+        return loaded
+
+    def export(self):
+        """
+        encoder + hash head up to the sign traced and frozen for pool scoring
+        """
+        self.encoder = None
+        if self.config.export_inference:
+            example = torch.zeros([2, 3, 32, 32], device=self.device)
+            loader = make_loader(self.test_dataset, np.arange(self.batch_size), self.batch_size, self.config,
+                                 paired=True)
+            check = next(iter(loader))['origin'].to(self.device)
+
+            # a code bit may flip where folding moves a value across zero
+            self.encoder = freeze(CodeEncoder(self.vae), example, check, mismatch=1e-3)
 
     def run(self):
         try:
@@ -104,12 +152,14 @@ class Strategy(object):
             print("You have entered CTRL+C.. Wait to finalize")
 
     def train(self):
+        self.encoder = None
         for _ in range(self.config.vae_epoch):
             self.epoch += 1
             self.train_by_epoch()
             if not self.epoch % 50:
                 self.test()
         self.save_checkpoint()
+        self.export()
 
     def train_by_epoch(self):
         tqdm_batch = tqdm(self.train_loader, leave=False, total=len(self.train_loader))
@@ -122,8 +172,8 @@ class Strategy(object):
         for curr_it, data in enumerate(tqdm_batch):
             self.vae_opt.zero_grad()
 
-            origin_data = data['origin'].cuda(async=self.config.async_loading)
-            trans_data = data['trans'].cuda(async=self.config.async_loading)
+            origin_data = data['origin'].to(self.device, non_blocking=self.config.async_loading)
+            trans_data = data['trans'].to(self.device, non_blocking=self.config.async_loading)
 
             origin_recon, origin_feature, origin_logit, origin_code = self.vae(origin_data)
             trans_recon, trans_feature, trans_logit, trans_code = self.vae(trans_data)
@@ -145,7 +195,7 @@ class Strategy(object):
 
             if self.epoch % 50 == 0:
                 origin_code = torch.sign(origin_logit)
-                centroid_set |= set(tuple(map(tuple, origin_code.view([-1, self.config.vae_embedding_dim]).cpu().tolist())))
+                centroid_set |= set(code_keys(pack_code(origin_code, self.config.vae_embedding_dim).cpu().numpy()).tolist())
 
         tqdm_batch.close()
         self.vae_scheduler.step(avg_loss.val)
@@ -163,13 +213,13 @@ class Strategy(object):
     def test(self):
         train_code, test_code, train_label, test_label = [], [], [], []
         self.vae.eval()
-        with torch.no_grad():
-            train_loader = DataLoader(self.train_dataset, batch_size=self.batch_size, num_workers=2,
-                                      pin_memory=self.config.pin_memory)
+        with inference_mode():
+            train_loader = make_loader(self.train_dataset, np.arange(len(self.train_dataset)), self.batch_size,
+                                       self.config, num_workers=2, paired=True)
             tqdm_train = tqdm(train_loader, leave=False, total=len(train_loader))
             for curr_it, data in enumerate(tqdm_train):
-                origin_data = data['origin'].cuda(async=self.config.async_loading)
-                target = data['target'].cuda(async=self.config.async_loading)
+                origin_data = data['origin'].to(self.device, non_blocking=self.config.async_loading)
+                target = data['target'].to(self.device, non_blocking=self.config.async_loading)
 
                 _, _, origin_logit, _ = self.vae(origin_data)
 
@@ -179,12 +229,12 @@ class Strategy(object):
             tqdm_train.close()
             train_code, train_label = torch.cat(train_code), torch.cat(train_label)
 
-            test_loader = DataLoader(self.test_dataset, batch_size=self.batch_size, num_workers=2,
-                                     pin_memory=self.config.pin_memory)
+            test_loader = make_loader(self.test_dataset, np.arange(len(self.test_dataset)), self.batch_size,
+                                      self.config, num_workers=2, paired=True)
             tqdm_test = tqdm(test_loader, leave=False, total=len(test_loader))
             for curr_it, data in enumerate(tqdm_test):
-                origin_data = data['origin'].cuda(async=self.config.async_loading)
-                target = data['target'].cuda(async=self.config.async_loading)
+                origin_data = data['origin'].to(self.device, non_blocking=self.config.async_loading)
+                target = data['target'].to(self.device, non_blocking=self.config.async_loading)
 
                 _, _, origin_logit, _ = self.vae(origin_data)
 
@@ -198,8 +248,12 @@ class Strategy(object):
         print(f'--- retrieval mAP: {_map} ---')
 
     def get_code(self, inputs):
+        if self.encoder is not None:
+            with inference_mode():
+                return self.encoder(inputs)
+
         self.vae.eval()
-        with torch.no_grad():
+        with inference_mode():
             _, _, code, _ = self.vae(inputs)
 
         return torch.sign(code)
@@ -1,19 +1,26 @@
 import os
 from tqdm import tqdm
 
+import numpy as np
+
 import torch
-from torch import nn
 from torch.backends import cudnn
-from torch.utils.data import DataLoader
 from torchvision import transforms
 
 from query.graph.ae_sign import AE as ae
 from query.graph.loss import MSE as loss
+from data.dataset import Tensor_CIFAR, make_loader
 
 from torchvision.datasets import CIFAR10, CIFAR100
+from data.registry import get_dataset
 
 from utils.metrics import AverageMeter, mAP
+from utils.hash_utils import pack_code, code_keys
 from utils.train_utils import set_logger, count_model_prameters
+from utils.artifacts import atomic_save, checkpoint_path, load_artifact
+from utils.export import unwrap
+from utils.distributed import is_main_process, summary_writer
+from utils.runtime import get_device, place, parallel, inference_mode
 
 from tensorboardX import SummaryWriter
 
@@ -23,6 +30,7 @@ cudnn.benchmark = False
 class Strategy(object):
     def __init__(self, config):
         self.config = config
+        self.device = get_device(self.config)
         self.best = 999999.0
 
         self.batch_size = self.config.batch_size * 8
@@ -37,25 +45,33 @@ class Strategy(object):
             ])
 
             if self.config.data_name == 'cifar10':
-                self.train_dataset = CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                             train=True, download=True, transform=self.train_transform)
-                self.test_dataset = CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                            train=False, download=True, transform=self.train_transform)
+                self.train_dataset = get_dataset(CIFAR10,
+                                                 os.path.join(self.config.root_path, self.config.data_directory),
+                                                 train=True, transform=self.train_transform)
+                self.test_dataset = get_dataset(CIFAR10,
+                                                os.path.join(self.config.root_path, self.config.data_directory),
+                                                train=False, transform=self.train_transform)
             elif self.config.data_name == 'cifar100':
-                self.train_dataset = CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                              train=True, download=True, transform=self.train_transform)
-                self.test_dataset = CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                             train=False, download=True, transform=self.train_transform)
+                self.train_dataset = get_dataset(CIFAR100,
+                                                 os.path.join(self.config.root_path, self.config.data_directory),
+                                                 train=True, transform=self.train_transform)
+                self.test_dataset = get_dataset(CIFAR100,
+                                                os.path.join(self.config.root_path, self.config.data_directory),
+                                                train=False, transform=self.train_transform)
+
+            if self.config.batch_augment:
+                self.train_dataset = Tensor_CIFAR(self.train_dataset, pin_memory=self.config.pin_memory)
+                self.test_dataset = Tensor_CIFAR(self.test_dataset, pin_memory=self.config.pin_memory)
 
-        self.train_loader = DataLoader(self.train_dataset, batch_size=self.batch_size, shuffle=True, num_workers=2,
-                                       pin_memory=self.config.pin_memory)
+        self.train_loader = make_loader(self.train_dataset, np.arange(len(self.train_dataset)), self.batch_size,
+                                        self.config, num_workers=2, shuffle=True, shard=True)
 
         # define models
-        self.ae = ae(self.config.vae_num_hiddens, self.config.vae_num_residual_layers,
-                       self.config.vae_num_residual_hiddens, self.config.vae_embedding_dim).cuda()
+        self.ae = place(ae(self.config.vae_num_hiddens, self.config.vae_num_residual_layers,
+                             self.config.vae_num_residual_hiddens, self.config.vae_embedding_dim), self.config)
 
         # define loss
-        self.loss = loss().cuda()
+        self.loss = loss().to(self.device)
 
         # define optimizer
         self.ae_opt = torch.optim.Adam(self.ae.parameters(), lr=self.config.vae_learning_rate)
@@ -68,26 +84,34 @@ class Strategy(object):
         self.epoch = 0
 
         # parallel setting
-        gpu_list = list(range(self.config.gpu_cnt))
-        self.ae = nn.DataParallel(self.ae, device_ids=gpu_list)
+        self.ae = parallel(self.ae, self.config)
 
         # Model Loading from the latest checkpoint if not found start from scratch.
 
         self.print_train_info()
-        self.summary_writer = SummaryWriter(log_dir=os.path.join(self.config.root_path, self.config.summary_directory),
-                                            comment='AE-CODE')
+        self.summary_writer = summary_writer(SummaryWriter,
+                                             log_dir=os.path.join(self.config.root_path, self.config.summary_directory),
+                                             comment='AE-CODE')
 
     def print_train_info(self):
         print('Number of generator parameters: {}'.format(count_model_prameters(self.ae)))
 
     def save_checkpoint(self):
-        tmp_name = os.path.join(self.config.root_path, self.config.checkpoint_directory, 'ae.pth.tar')
+        if not is_main_process():
+            return
+
+        tmp_name = checkpoint_path(self, 'ae')
 
         state = {
-            'ae_state_dict': self.ae.state_dict(),
+            'ae_state_dict': unwrap(self.ae).state_dict(),
         }
 
-        torch.save(state, tmp_name)
+        atomic_save(state, tmp_name)
+
+    def load_checkpoint(self):
+        tmp_name = checkpoint_path(self, 'ae')
+
+        return load_artifact(tmp_name, {'ae_state_dict': self.ae}, self.device)
 
     def run(self):
         try:
@@ -112,7 +136,7 @@ class Strategy(object):
         for curr_it, data in enumerate(tqdm_batch):
             self.ae_opt.zero_grad()
 
-            inputs = data[0].cuda(async=self.config.async_loading)
+            inputs = data[0].to(self.device, non_blocking=self.config.async_loading)
 
             recon, code = self.ae(inputs)
 
@@ -124,7 +148,7 @@ class Strategy(object):
             avg_loss.update(loss)
 
             if self.epoch % 50 == 0:
-                centroid_set |= set(tuple(map(tuple, code.view([-1, self.config.vae_embedding_dim]).cpu().tolist())))
+                centroid_set |= set(code_keys(pack_code(code, self.config.vae_embedding_dim).cpu().numpy()).tolist())
 
         tqdm_batch.close()
         self.ae_scheduler.step(avg_loss.val)
@@ -139,7 +163,7 @@ class Strategy(object):
 
     def get_code(self, inputs):
         self.ae.eval()
-        with torch.no_grad():
+        with inference_mode():
             _, code = self.ae(inputs)
 
         return code
@@ -2,19 +2,25 @@ import os
 import random
 from tqdm import tqdm
 
+import numpy as np
+
 import torch
-from torch import nn
 from torch.backends import cudnn
-from torch.utils.data import DataLoader
 from torchvision import transforms
 from torchvision.datasets import CIFAR100, CIFAR10
 
 from query.graph.vq_vae import VAE as vae
 from query.graph.loss import MSE as loss
 from task.graph.resnet import ResNet18 as resnet
+from data.dataset import Tensor_CIFAR, make_loader
+from data.registry import get_dataset
 
 from utils.metrics import AverageMeter
 from utils.train_utils import set_logger, count_model_prameters
+from utils.artifacts import atomic_save, checkpoint_path, load_artifact
+from utils.export import unwrap
+from utils.distributed import is_main_process, summary_writer
+from utils.runtime import get_device, place, parallel, inference_mode
 from tensorboardX import SummaryWriter
 
 cudnn.benchmark = True
@@ -23,6 +29,7 @@ cudnn.benchmark = True
 class Strategy(object):
     def __init__(self, config):
         self.config = config
+        self.device = get_device(self.config)
         self.best = 999999.0
 
         self.batch_size = self.config.batch_size * 8
@@ -36,22 +43,28 @@ class Strategy(object):
                 transforms.Normalize([0.4914, 0.4822, 0.4465], [0.2023, 0.1994, 0.2010]),
             ])
             if self.config.data_name == 'cifar10':
-                self.train_dataset = CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                             train=True, download=True, transform=self.train_transform)
+                self.train_dataset = get_dataset(CIFAR10,
+                                                 os.path.join(self.config.root_path, self.config.data_directory),
+                                                 train=True, transform=self.train_transform)
             elif self.config.data_name == 'cifar100':
-                self.train_dataset = CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                              train=True, download=True, transform=self.train_transform)
+                self.train_dataset = get_dataset(CIFAR100,
+                                                 os.path.join(self.config.root_path, self.config.data_directory),
+                                                 train=True, transform=self.train_transform)
+
+            if self.config.batch_augment:
+                self.train_dataset = Tensor_CIFAR(self.train_dataset, pin_memory=self.config.pin_memory)
 
-        self.train_loader = DataLoader(self.train_dataset, batch_size=self.batch_size, shuffle=True, num_workers=2,
-                                       pin_memory=self.config.pin_memory)
+        self.train_loader = make_loader(self.train_dataset, np.arange(len(self.train_dataset)), self.batch_size,
+                                        self.config, num_workers=2, shuffle=True, shard=True)
 
         # define models
-        self.vae = vae(self.config.vae_num_hiddens, self.config.vae_num_residual_layers,
-                       self.config.vae_num_residual_hiddens, self.config.vae_num_embeddings,
-                       self.config.vae_embedding_dim, self.config.vae_commitment_cost, self.config.vae_decay).cuda()
+        self.vae = place(vae(self.config.vae_num_hiddens, self.config.vae_num_residual_layers,
+                             self.config.vae_num_residual_hiddens, self.config.vae_num_embeddings,
+                             self.config.vae_embedding_dim, self.config.vae_commitment_cost, self.config.vae_decay),
+                         self.config)
 
         # define loss
-        self.loss = loss().cuda()
+        self.loss = loss().to(self.device)
 
         # define optimizer
         self.vae_opt = torch.optim.Adam(self.vae.parameters(), lr=self.config.vae_learning_rate)
@@ -64,26 +77,34 @@ class Strategy(object):
         self.epoch = 0
 
         # parallel setting
-        gpu_list = list(range(self.config.gpu_cnt))
-        self.vae = nn.DataParallel(self.vae, device_ids=gpu_list)
+        self.vae = parallel(self.vae, self.config)
 
         # Model Loading from the latest checkpoint if not found start from scratch.
 
         self.print_train_info()
-        self.summary_writer = SummaryWriter(log_dir=os.path.join(self.config.root_path, self.config.summary_directory),
-                                            comment='VQ-VAE')
+        self.summary_writer = summary_writer(SummaryWriter,
+                                             log_dir=os.path.join(self.config.root_path, self.config.summary_directory),
+                                             comment='VQ-VAE')
 
     def print_train_info(self):
         print('Number of generator parameters: {}'.format(count_model_prameters(self.vae)))
 
     def save_checkpoint(self):
-        tmp_name = os.path.join(self.config.root_path, self.config.checkpoint_directory, 'vae.pth.tar')
+        if not is_main_process():
+            return
+
+        tmp_name = checkpoint_path(self, 'vae')
 
         state = {
-            'vae_state_dict': self.vae.state_dict(),
+            'vae_state_dict': unwrap(self.vae).state_dict(),
         }
 
-        torch.save(state, tmp_name)
+        atomic_save(state, tmp_name)
+
+    def load_checkpoint(self):
+        tmp_name = checkpoint_path(self, 'vae')
+
+        return load_artifact(tmp_name, {'vae_state_dict': self.vae}, self.device)
 
     def run(self):
         try:
@@ -108,7 +129,7 @@ class Strategy(object):
         for curr_it, data in enumerate(tqdm_batch):
             self.vae_opt.zero_grad()
 
-            data = data[0].cuda(async=self.config.async_loading)
+            data = data[0].to(self.device, non_blocking=self.config.async_loading)
 
             vq_loss, data_recon, _, encoding_indices = self.vae(data)
 
@@ -135,7 +156,7 @@ class Strategy(object):
 
     def get_index(self, inputs):
         self.vae.eval()
-        with torch.no_grad():
+        with inference_mode():
             _, _, _, indices = self.vae(inputs)
 
         return indices
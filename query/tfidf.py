@@ -0,0 +1,91 @@
+import numpy as np
+
+from query.topk import top_k
+
+
+class CodeTFIDF(object):
+    """
+    array based tf-idf over per-image code documents
+    a document is one row of a [n_images, n_patches] key array (packed sign codes or vq indices)
+    binary: count a code once per image (set semantics) instead of once per patch
+    """
+    def __init__(self, data_size, binary=True):
+        self.data_size = data_size
+        self.binary = binary
+
+        self.vocab = np.array([], dtype=np.int64)
+        self.idf = np.array([], dtype=np.float64)
+
+    def __len__(self):
+        return len(self.vocab)
+
+    def fit(self, doc_codes):
+        self.vocab, inverse = np.unique(doc_codes, return_inverse=True)
+        doc_ids = inverse.reshape(len(doc_codes), -1)
+
+        self.idf = np.log(self.data_size / (1 + self.doc_freq(doc_ids)))
+
+    def encode(self, doc_codes):
+        """
+        map code keys to vocabulary ids, codes the vocabulary has never seen get id len(self)
+        """
+        doc_codes = np.asarray(doc_codes)
+        ids = np.searchsorted(self.vocab, doc_codes.ravel())
+        ids[ids == len(self.vocab)] = 0
+
+        found = self.vocab[ids] == doc_codes.ravel() if len(self.vocab) else np.zeros(ids.shape, dtype=bool)
+        ids[~found] = len(self.vocab)
+
+        return ids.reshape(len(doc_codes), -1)
+
+    def _pairs(self, doc_ids):
+        # one (image, code) pair per distinct code of an image
+        n_docs = len(doc_ids)
+        pairs = np.unique(np.repeat(np.arange(n_docs, dtype=np.int64), doc_ids.shape[1]) * (len(self) + 1) +
+                          doc_ids.ravel())
+
+        return pairs // (len(self) + 1), pairs % (len(self) + 1)
+
+    def doc_freq(self, doc_ids):
+        """
+        number of documents (or patches when not binary) containing each vocabulary code
+        """
+        terms = self._pairs(doc_ids)[1] if self.binary else doc_ids.ravel()
+
+        return np.bincount(terms, minlength=len(self) + 1)[:len(self)]
+
+    def score(self, doc_ids, weight):
+        """
+        per image sum of weight over its distinct codes, unknown codes weigh nothing
+        weight: [len(self)] array, zero for the codes that should not count
+        """
+        docs, terms = self._pairs(doc_ids)
+
+        return np.bincount(docs, weights=np.append(weight, 0.)[terms], minlength=len(doc_ids))
+
+    def labeled_weight(self, labeled_ids, use_labeled_cnt=False):
+        """
+        idf of every code present in the labeled set, optionally scaled by its labeled count
+        """
+        labeled_cnt = self.doc_freq(labeled_ids)
+
+        if use_labeled_cnt:
+            return labeled_cnt * self.idf
+
+        return (labeled_cnt > 0) * self.idf
+
+
+def select(score, sample_size, loss=None, loss_first=False):
+    """
+    positions to query, lowest idf score first
+    with a loss, the pool is cut to the 10 * sample_size best by one key and then ranked by the other
+    """
+    if loss is None:
+        return top_k(score, sample_size, largest=False)
+
+    if loss_first:
+        tmp_set = top_k(loss, sample_size * 10)
+        return tmp_set[top_k(score[tmp_set], sample_size, largest=False)]
+
+    tmp_set = top_k(score, sample_size * 10, largest=False)
+    return tmp_set[top_k(loss[tmp_set], sample_size)]
@@ -0,0 +1,94 @@
+import numpy as np
+
+from utils.distributed import all_gather, shard_indices
+
+
+class TopK(object):
+    """
+    streaming top-k: keeps only the best `size` scores seen so far together with their indices
+    indices default to the running position of each score in the stream
+    equal scores are ranked by index (lowest first), as a stable sort of the stream would, so a cut-off
+    falling inside a run of ties selects the same samples on every run
+    """
+    def __init__(self, size, largest=True):
+        self.size = size
+        self.largest = largest
+        self.count = 0
+
+        self.scores = np.empty(0, dtype=np.float64)
+        self.indices = np.empty(0, dtype=np.int64)
+
+    def update(self, scores, indices=None):
+        scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+        if indices is None:
+            indices = np.arange(self.count, self.count + len(scores), dtype=np.int64)
+        self.count += len(scores)
+
+        scores = np.concatenate([self.scores, scores])
+        indices = np.concatenate([self.indices, np.asarray(indices, dtype=np.int64).reshape(-1)])
+
+        if len(scores) > self.size:
+            keep = self.cut(scores, indices)
+            scores, indices = scores[keep], indices[keep]
+
+        self.scores, self.indices = scores, indices
+
+    def cut(self, scores, indices):
+        # argpartition finds the k-th best key in linear time, every score not worse than it survives (ties with
+        # the threshold included), so the lexsort over the survivors still breaks ties at the cut-off by index
+        if self.size == 0:
+            return np.empty(0, dtype=np.int64)
+
+        keys = -scores if self.largest else scores
+        threshold = keys[np.argpartition(keys, self.size - 1)[self.size - 1]]
+        survivors = np.flatnonzero(~(keys > threshold))
+
+        return survivors[self.order(scores[survivors], indices[survivors])[:self.size]]
+
+    def order(self, scores, indices):
+        # best score first, ties by index
+        return np.lexsort((indices, -scores if self.largest else scores))
+
+    def result(self):
+        return self.indices[self.order(self.scores, self.indices)]
+
+
+class ShardedTopK(TopK):
+    """
+    TopK of a scoring pass over `count` items whose loader was built with shard=True
+    every rank keeps the top `size` of its own share, result() merges the shares of all ranks into the global
+    top `size`, as positions in the full sequence (the same on every rank)
+    without torch.distributed (or with shard=False) it is a plain TopK
+    """
+    def __init__(self, size, count, largest=True, shard=True):
+        super(ShardedTopK, self).__init__(size, largest)
+        self.shard = shard
+        self.positions = shard_indices(np.arange(count)) if shard else np.arange(count)
+
+    def update(self, scores, indices=None):
+        if indices is None:
+            scores = np.asarray(scores).reshape(-1)
+            indices = self.positions[self.count:self.count + len(scores)]
+
+        super(ShardedTopK, self).update(scores, indices)
+
+    def result(self):
+        shards = all_gather((self.scores, self.indices)) if self.shard else []
+        if len(shards) <= 1:
+            return super(ShardedTopK, self).result()
+
+        # a position of the wrap-around padding may be kept by two ranks
+        indices, first = np.unique(np.concatenate([indices for _, indices in shards]), return_index=True)
+        scores = np.concatenate([scores for scores, _ in shards])[first]
+
+        merged = TopK(self.size, self.largest)
+        merged.update(scores, indices)
+
+        return merged.result()
+
+
+def top_k(scores, size, largest=True):
+    selector = TopK(size, largest)
+    selector.update(scores)
+
+    return selector.result()
@@ -11,6 +11,7 @@ from torchvision import transforms
 from torchvision.datasets import CIFAR100, CIFAR10
 
 from data.sampler import Sampler
+from data.registry import get_dataset
 
 cudnn.benchmark = False
 
@@ -33,11 +34,11 @@ class Query(object):
 
         # define dataloader
         if self.config.data_name == 'cifar10':
-            self.dataset = CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                   train=True, download=True, transform=self.train_transform)
+            self.dataset = get_dataset(CIFAR10, os.path.join(self.config.root_path, self.config.data_directory),
+                                       train=True, transform=self.train_transform)
         elif self.config.data_name == 'cifar100':
-            self.dataset = CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                    train=True, download=True, transform=self.train_transform)
+            self.dataset = get_dataset(CIFAR100, os.path.join(self.config.root_path, self.config.data_directory),
+                                       train=True, transform=self.train_transform)
 
     def sampling(self, step_cnt, task):
         sample_size = self.budget if step_cnt else self.initial_size
@@ -52,7 +53,7 @@ class Query(object):
             uncertainty = torch.tensor([]).cuda()
             tqdm_batch = tqdm(dataloader, total=len(dataloader))
             for curr_it, data in enumerate(tqdm_batch):
-                data = data[0].cuda(async=self.config.async_loading)
+                data = data[0].cuda(non_blocking=self.config.async_loading)
 
                 _, pred_loss = task.get_result(data)
 
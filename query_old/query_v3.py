@@ -18,6 +18,7 @@ from task.graph.resnet import ResNet18 as resnet
 from task.graph.lossnet import LossNet as lossnet
 
 from data.sampler import Sampler
+from data.registry import get_dataset
 
 cudnn.benchmark = True
 
@@ -41,11 +42,11 @@ class Query(object):
             ])
 
             if self.config.data_name == 'cifar10':
-                self.dataset = CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                       train=True, download=True, transform=self.train_transform)
+                self.dataset = get_dataset(CIFAR10, os.path.join(self.config.root_path, self.config.data_directory),
+                                           train=True, transform=self.train_transform)
             elif self.config.data_name == 'cifar100':
-                self.dataset = CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                        train=True, download=True, transform=self.train_transform)
+                self.dataset = get_dataset(CIFAR100, os.path.join(self.config.root_path, self.config.data_directory),
+                                           train=True, transform=self.train_transform)
 
         # define models
         self.vae = vae(self.config.vae_num_hiddens, self.config.vae_num_residual_layers,
@@ -105,7 +106,7 @@ class Query(object):
                 self.task.eval()
                 self.loss_module.eval()
 
-                data = data[0].cuda(async=self.config.async_loading)
+                data = data[0].cuda(non_blocking=self.config.async_loading)
 
                 _, _, encoding_indices = self.vae(data)
                 _, features = self.task(data)
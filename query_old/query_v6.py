@@ -9,6 +9,7 @@ from torchvision import transforms
 from torchvision.datasets import CIFAR100, CIFAR10
 
 from data.sampler import Sampler
+from data.registry import get_dataset
 
 
 class Query(object):
@@ -30,11 +31,11 @@ class Query(object):
             ])
 
             if self.config.data_name == 'cifar10':
-                self.dataset = CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                       train=True, download=True, transform=self.train_transform)
+                self.dataset = get_dataset(CIFAR10, os.path.join(self.config.root_path, self.config.data_directory),
+                                           train=True, transform=self.train_transform)
             elif self.config.data_name == 'cifar100':
-                self.dataset = CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                        train=True, download=True, transform=self.train_transform)
+                self.dataset = get_dataset(CIFAR100, os.path.join(self.config.root_path, self.config.data_directory),
+                                           train=True, transform=self.train_transform)
 
     def sampling(self, step_cnt, strategy, task):
         if not step_cnt:
@@ -53,7 +54,7 @@ class Query(object):
         index = 0
         data_dict = {}
         for curr_it, data in enumerate(tqdm_batch):
-            data = data[0].cuda(async=self.config.async_loading)
+            data = data[0].cuda(non_blocking=self.config.async_loading)
 
             _, features, pred_loss = task.get_result(data)
             code = strategy.get_code(features)
@@ -8,6 +8,7 @@ from torch.backends import cudnn
 from torch.utils.data import DataLoader
 from torchvision import transforms
 from torchvision.datasets import CIFAR100, CIFAR10
+from data.registry import get_dataset
 
 from query.graph.vae import VAE as vae
 from query.graph.loss import MSE as Loss
@@ -43,15 +44,15 @@ class Strategy(object):
 
         # define dataloader
         if self.config.data_name == 'cifar10':
-            self.train_dataset = CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                         train=True, download=True, transform=self.train_transform)
-            self.test_dataset = CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                        train=False, download=True, transform=self.test_transform)
+            self.train_dataset = get_dataset(CIFAR10, os.path.join(self.config.root_path, self.config.data_directory),
+                                             train=True, transform=self.train_transform)
+            self.test_dataset = get_dataset(CIFAR10, os.path.join(self.config.root_path, self.config.data_directory),
+                                            train=False, transform=self.test_transform)
         elif self.config.data_name == 'cifar100':
-            self.train_dataset = CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                          train=True, download=True, transform=self.train_transform)
-            self.test_dataset = CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                         train=False, download=True, transform=self.test_transform)
+            self.train_dataset = get_dataset(CIFAR100, os.path.join(self.config.root_path, self.config.data_directory),
+                                             train=True, transform=self.train_transform)
+            self.test_dataset = get_dataset(CIFAR100, os.path.join(self.config.root_path, self.config.data_directory),
+                                            train=False, transform=self.test_transform)
 
         self.train_loader = DataLoader(self.train_dataset, batch_size=self.batch_size, shuffle=True, num_workers=2,
                                        pin_memory=self.config.pin_memory)
@@ -141,7 +142,7 @@ class Strategy(object):
             self.vae.train()
             self.vae_opt.zero_grad()
 
-            data = data[0].cuda(async=self.config.async_loading)
+            data = data[0].cuda(non_blocking=self.config.async_loading)
 
             task_output = self.task(data)
             u_score = self.uncertainty_score(task_output)
@@ -168,7 +169,7 @@ class Strategy(object):
                 self.task.eval()
                 self.vae.eval()
 
-                data = data[0].cuda(async=self.config.async_loading)
+                data = data[0].cuda(non_blocking=self.config.async_loading)
 
                 task_output = self.task(data)
                 u_score = self.uncertainty_score(task_output)
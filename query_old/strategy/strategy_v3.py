@@ -14,6 +14,7 @@ from query.graph.loss import MSE as loss
 from query.graph.loss import SelfClusteringLoss as scloss
 from task.graph.resnet import ResNet18 as resnet
 from data.dataset import Dataset_CIFAR10, Dataset_CIFAR100
+from data.registry import get_dataset
 
 from utils.metrics import AverageMeter, UncertaintyScore
 from utils.train_utils import set_logger, count_model_prameters
@@ -38,11 +39,13 @@ class Strategy(object):
                 transforms.Normalize([0.4914, 0.4822, 0.4465], [0.2023, 0.1994, 0.2010]),
             ])
             if self.config.data_name == 'cifar10':
-                self.train_dataset = CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                             train=True, download=True, transform=self.train_transform)
+                self.train_dataset = get_dataset(CIFAR10,
+                                                 os.path.join(self.config.root_path, self.config.data_directory),
+                                                 train=True, transform=self.train_transform)
             elif self.config.data_name == 'cifar100':
-                self.train_dataset = CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                              train=True, download=True, transform=self.train_transform)
+                self.train_dataset = get_dataset(CIFAR100,
+                                                 os.path.join(self.config.root_path, self.config.data_directory),
+                                                 train=True, transform=self.train_transform)
 
         self.train_loader = DataLoader(self.train_dataset, batch_size=self.batch_size, shuffle=True, num_workers=2,
                                        pin_memory=self.config.pin_memory)
@@ -119,7 +122,7 @@ class Strategy(object):
             self.vae.train()
             self.vae_opt.zero_grad()
 
-            data = data[0].cuda(async=self.config.async_loading)
+            data = data[0].cuda(non_blocking=self.config.async_loading)
 
             vq_loss, data_recon, _, encoding_indices, inverse_distances = self.vae(data)
 
@@ -14,6 +14,7 @@ from query.graph.loss import MSE as loss
 from query.graph.loss import CodeLoss as closs
 from task.graph.resnet import ResNet18 as resnet
 from data.dataset import Dataset_CIFAR10, Dataset_CIFAR100
+from data.registry import get_dataset
 
 from utils.metrics import AverageMeter, UncertaintyScore
 from utils.train_utils import set_logger, count_model_prameters
@@ -42,11 +43,13 @@ class Strategy(object):
             ])
 
             if self.config.data_name == 'cifar10':
-                self.train_dataset = Dataset_CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                                     train=True, download=True, transform=self.train_transform)
+                self.train_dataset = get_dataset(Dataset_CIFAR10,
+                                                 os.path.join(self.config.root_path, self.config.data_directory),
+                                                 train=True, transform=self.train_transform)
             elif self.config.data_name == 'cifar100':
-                self.train_dataset = Dataset_CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                                      train=True, download=True, transform=self.train_transform)
+                self.train_dataset = get_dataset(Dataset_CIFAR100,
+                                                 os.path.join(self.config.root_path, self.config.data_directory),
+                                                 train=True, transform=self.train_transform)
 
         self.train_loader = DataLoader(self.train_dataset, batch_size=self.batch_size, shuffle=True, num_workers=2,
                                        pin_memory=self.config.pin_memory)
@@ -117,8 +120,8 @@ class Strategy(object):
         for curr_it, data in enumerate(tqdm_batch):
             self.vae_opt.zero_grad()
 
-            origin_data = data['origin'].cuda(async=self.config.async_loading)
-            trans_data = data['trans'].cuda(async=self.config.async_loading)
+            origin_data = data['origin'].cuda(non_blocking=self.config.async_loading)
+            trans_data = data['trans'].cuda(non_blocking=self.config.async_loading)
 
             origin_recon, origin_code = self.vae(origin_data)
             trans_recon, trans_code = self.vae(trans_data)
@@ -155,7 +158,7 @@ class Strategy(object):
     def get_code(self, inputs):
         self.vae.eval()
         with torch.no_grad():
-            inputs = inputs.cuda(async=self.config.async_loading)
+            inputs = inputs.cuda(non_blocking=self.config.async_loading)
 
             _, code = self.vae(inputs)
 
@@ -13,6 +13,7 @@ from query.graph.loss import HashLoss as hloss
 from query.graph.loss import CodeLoss as closs
 from data.dataset import Dataset_CIFAR10, Dataset_CIFAR100
 from data.sampler import Sampler
+from data.registry import get_dataset
 
 from utils.metrics import AverageMeter, mAP
 from utils.train_utils import set_logger, count_model_prameters
@@ -41,15 +42,19 @@ class Strategy(object):
             ])
 
             if self.config.data_name == 'cifar10':
-                self.train_dataset = Dataset_CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                                     train=True, download=True, transform=self.train_transform)
-                self.test_dataset = Dataset_CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                                    train=False, download=True, transform=self.train_transform)
+                self.train_dataset = get_dataset(Dataset_CIFAR10,
+                                                 os.path.join(self.config.root_path, self.config.data_directory),
+                                                 train=True, transform=self.train_transform)
+                self.test_dataset = get_dataset(Dataset_CIFAR10,
+                                                os.path.join(self.config.root_path, self.config.data_directory),
+                                                train=False, transform=self.train_transform)
             elif self.config.data_name == 'cifar100':
-                self.train_dataset = Dataset_CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                                      train=True, download=True, transform=self.train_transform)
-                self.test_dataset = Dataset_CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                                     train=False, download=True, transform=self.train_transform)
+                self.train_dataset = get_dataset(Dataset_CIFAR100,
+                                                 os.path.join(self.config.root_path, self.config.data_directory),
+                                                 train=True, transform=self.train_transform)
+                self.test_dataset = get_dataset(Dataset_CIFAR100,
+                                                os.path.join(self.config.root_path, self.config.data_directory),
+                                                train=False, transform=self.train_transform)
 
         # define models
         self.hashnet = hashnet(self.config.vae_embedding_dim).cuda()
@@ -127,9 +132,9 @@ class Strategy(object):
         for curr_it, data in enumerate(tqdm_batch):
             self.hashnet_opt.zero_grad()
 
-            origin_data = data['origin'].cuda(async=self.config.async_loading)
-            trans_data = data['trans'].cuda(async=self.config.async_loading)
-            target = data['target'].cuda(async=self.config.async_loading)
+            origin_data = data['origin'].cuda(non_blocking=self.config.async_loading)
+            trans_data = data['trans'].cuda(non_blocking=self.config.async_loading)
+            target = data['target'].cuda(non_blocking=self.config.async_loading)
 
             _, origin_features, _ = task.get_result(origin_data)
             origin_logit = self.hashnet(origin_features)
@@ -179,8 +184,8 @@ class Strategy(object):
         self.hashnet.eval()
         with torch.no_grad():
             for curr_it, data in enumerate(tqdm_train):
-                origin_data = data['origin'].cuda(async=self.config.async_loading)
-                target = data['target'].cuda(async=self.config.async_loading)
+                origin_data = data['origin'].cuda(non_blocking=self.config.async_loading)
+                target = data['target'].cuda(non_blocking=self.config.async_loading)
 
                 _, origin_features, _ = task.get_result(origin_data)
                 origin_logit = self.hashnet(origin_features)
@@ -192,8 +197,8 @@ class Strategy(object):
             train_code, train_label = torch.cat(train_code), torch.cat(train_label)
 
             for curr_it, data in enumerate(tqdm_test):
-                origin_data = data['origin'].cuda(async=self.config.async_loading)
-                target = data['target'].cuda(async=self.config.async_loading)
+                origin_data = data['origin'].cuda(non_blocking=self.config.async_loading)
+                target = data['target'].cuda(non_blocking=self.config.async_loading)
 
                 _, origin_features, _ = task.get_result(origin_data)
                 origin_logit = self.hashnet(origin_features)
@@ -3,6 +3,7 @@ import torch
 from torch.backends import cudnn
 
 from config import Config
+from utils.runtime import setup_runtime
 
 cudnn.deterministic = True
 
@@ -33,4 +34,6 @@ def main(version):
 
 
 if __name__ == '__main__':
+    setup_runtime(Config())
+
     main(1)
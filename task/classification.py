@@ -1,19 +1,25 @@
 import os
 from tqdm import tqdm
 
+import numpy as np
+
 import torch
-from torch import nn
 from torch.backends import cudnn
-from torch.utils.data import DataLoader
 from torchvision import transforms
 from torchvision.datasets import CIFAR10, CIFAR100
 
 from .graph.resnet import ResNet18 as resnet
 from .graph.loss import CELoss as loss
-from data.sampler import Sampler
+from data.augment import BatchAugment
+from data.dataset import Tensor_CIFAR, make_loader, CIFAR_MEAN, CIFAR_STD
+from data.registry import get_dataset
 
 from utils.metrics import AverageMeter
 from utils.train_utils import count_model_prameters
+from utils.artifacts import atomic_save, checkpoint_path
+from utils.export import unwrap
+from utils.distributed import is_main_process
+from utils.runtime import get_device, place, parallel, inference_mode
 
 
 cudnn.benchmark = False
@@ -22,11 +28,13 @@ cudnn.benchmark = False
 class Classification(object):
     def __init__(self, config):
         self.config = config
+        self.device = get_device(self.config)
         self.best_acc = 0.0
 
         self.batch_size = self.config.batch_size
 
         # define dataloader
+        self.train_augment = None
         if 'cifar' in self.config.data_name:
             self.train_transform = transforms.Compose([
                 transforms.RandomHorizontalFlip(),
@@ -41,27 +49,37 @@ class Classification(object):
             ])
 
             if self.config.data_name == 'cifar10':
-                self.train_dataset = CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                             train=True, download=True, transform=self.train_transform)
-                self.test_dataset = CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                            train=False, download=True, transform=self.test_transform)
+                self.train_dataset = get_dataset(CIFAR10,
+                                                 os.path.join(self.config.root_path, self.config.data_directory),
+                                                 train=True, transform=self.train_transform)
+                self.test_dataset = get_dataset(CIFAR10,
+                                                os.path.join(self.config.root_path, self.config.data_directory),
+                                                train=False, transform=self.test_transform)
             elif self.config.data_name == 'cifar100':
-                self.train_dataset = CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                             train=True, download=True, transform=self.train_transform)
-                self.test_dataset = CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                            train=False, download=True, transform=self.test_transform)
+                self.train_dataset = get_dataset(CIFAR100,
+                                                 os.path.join(self.config.root_path, self.config.data_directory),
+                                                 train=True, transform=self.train_transform)
+                self.test_dataset = get_dataset(CIFAR100,
+                                                os.path.join(self.config.root_path, self.config.data_directory),
+                                                train=False, transform=self.test_transform)
+
+            if self.config.batch_augment:
+                self.train_dataset = Tensor_CIFAR(self.train_dataset, pin_memory=self.config.pin_memory)
+                self.train_augment = BatchAugment(CIFAR_MEAN, CIFAR_STD)
+
+        if self.config.tensor_dataset:
+            self.test_dataset = Tensor_CIFAR(self.test_dataset, pin_memory=self.config.pin_memory)
 
-        self.test_loader = DataLoader(self.test_dataset, batch_size=self.batch_size, num_workers=1,
-                                      pin_memory=self.config.pin_memory)
+        self.test_loader = make_loader(self.test_dataset, np.arange(len(self.test_dataset)), self.batch_size,
+                                       self.config, num_workers=1)
 
         # define models
-        self.task = resnet(self.config.num_classes).cuda()
+        self.task = place(resnet(self.config.num_classes), self.config)
 
         self.epochl = self.config.epochl
 
         # parallel setting
-        gpu_list = list(range(self.config.gpu_cnt))
-        self.task = nn.DataParallel(self.task, device_ids=gpu_list)
+        self.task = parallel(self.task, self.config)
 
         self.print_train_info()
 
@@ -69,17 +87,20 @@ class Classification(object):
         print('Number of generator parameters: {}'.format(count_model_prameters(self.task)))
 
     def save_checkpoint(self):
-        tmp_name = os.path.join(self.config.root_path, self.config.checkpoint_directory, 'task.pth.tar')
+        if not is_main_process():
+            return
+
+        tmp_name = checkpoint_path(self, 'task')
 
         state = {
-            'task_state_dict': self.task.state_dict(),
+            'task_state_dict': unwrap(self.task).state_dict(),
         }
 
-        torch.save(state, tmp_name)
+        atomic_save(state, tmp_name)
 
     def set_train(self):
         # define loss
-        self.loss = loss().cuda()
+        self.loss = loss().to(self.device)
 
         # define optimizer
         self.task_opt = torch.optim.SGD(self.task.parameters(), lr=self.config.learning_rate,
@@ -92,8 +113,8 @@ class Classification(object):
         self.epoch = 0
 
     def run(self, sample_list):
-        data_loader = DataLoader(self.train_dataset, batch_size=self.batch_size, num_workers=2,
-                                 pin_memory=self.config.pin_memory, sampler=Sampler(sample_list))
+        data_loader = make_loader(self.train_dataset, sample_list, self.batch_size, self.config, num_workers=2,
+                                  augment=self.train_augment, shard=True)
         try:
             self.set_train()
             self.train(data_loader)
@@ -118,8 +139,8 @@ class Classification(object):
         for curr_it, data in enumerate(tqdm_batch):
             self.task_opt.zero_grad()
 
-            inputs = data[0].cuda(async=self.config.async_loading)
-            targets = data[1].cuda(async=self.config.async_loading)
+            inputs = data[0].to(self.device, non_blocking=self.config.async_loading)
+            targets = data[1].to(self.device, non_blocking=self.config.async_loading)
 
             out, features = self.task(inputs)
             loss = torch.mean(self.loss(out, targets, 10))
@@ -132,7 +153,7 @@ class Classification(object):
         tqdm_batch.close()
 
     def test(self):
-        with torch.no_grad():
+        with inference_mode():
             tqdm_batch = tqdm(self.test_loader, leave=False, total=len(self.test_loader))
 
             total = 0
@@ -140,8 +161,8 @@ class Classification(object):
             for curr_it, data in enumerate(tqdm_batch):
                 self.task.eval()
 
-                inputs = data[0].cuda(async=self.config.async_loading)
-                targets = data[1].cuda(async=self.config.async_loading)
+                inputs = data[0].to(self.device, non_blocking=self.config.async_loading)
+                targets = data[1].to(self.device, non_blocking=self.config.async_loading)
                 total += inputs.size(0)
 
                 out, _ = self.task(inputs)
@@ -157,7 +178,7 @@ class Classification(object):
     def get_result(self, inputs, targets):
         self.task.eval()
         with torch.no_grad():
-            inputs = inputs.cuda(async=self.config.async_loading)
+            inputs = inputs.to(self.device, non_blocking=self.config.async_loading)
 
             out, features = self.task(inputs)
 
@@ -169,7 +190,7 @@ class Classification(object):
     def get_feature(self, inputs):
         self.task.eval()
         with torch.no_grad():
-            inputs = inputs.cuda(async=self.config.async_loading)
+            inputs = inputs.to(self.device, non_blocking=self.config.async_loading)
 
             out, features = self.task(inputs)
 
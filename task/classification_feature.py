@@ -2,10 +2,10 @@ import os
 import random
 from tqdm import tqdm
 
+import numpy as np
+
 import torch
-from torch import nn
 from torch.backends import cudnn
-from torch.utils.data import DataLoader
 from torchvision import transforms
 from torchvision.datasets import CIFAR10, CIFAR100
 
@@ -13,10 +13,15 @@ from .graph.resnet import ResNet18 as resnet
 from .graph.featurenet import FeatureNet as fnet
 from .graph.loss import CELoss as loss
 from .graph.loss import MSE as mse_loss
-from data.sampler import Sampler
+from data.dataset import Tensor_CIFAR, ViewDataset, make_loader
+from data.registry import get_dataset
 
 from utils.metrics import AverageMeter
 from utils.train_utils import count_model_prameters, print_scatter
+from utils.artifacts import atomic_save, checkpoint_path
+from utils.export import unwrap
+from utils.distributed import is_main_process
+from utils.runtime import get_device, place, parallel, inference_mode
 
 
 cudnn.benchmark = False
@@ -25,6 +30,7 @@ cudnn.benchmark = False
 class ClassificationWithFeature(object):
     def __init__(self, config):
         self.config = config
+        self.device = get_device(self.config)
         self.best_acc = 0.0
 
         self.batch_size = self.config.batch_size
@@ -50,31 +56,38 @@ class ClassificationWithFeature(object):
             ])
 
             if self.config.data_name == 'cifar10':
-                self.train_dataset = CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                             train=True, download=True, transform=self.train_transform)
-                self.test_dataset = CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                            train=False, download=True, transform=self.test_transform)
-                self.dataset_for_additional = CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                                      train=True, download=True, transform=self.additional_transform)
+                self.train_dataset = get_dataset(CIFAR10,
+                                                 os.path.join(self.config.root_path, self.config.data_directory),
+                                                 train=True, transform=self.train_transform)
+                self.test_dataset = get_dataset(CIFAR10,
+                                                os.path.join(self.config.root_path, self.config.data_directory),
+                                                train=False, transform=self.test_transform)
+                self.dataset_for_additional = get_dataset(CIFAR10,
+                                                          os.path.join(self.config.root_path, self.config.data_directory),
+                                                          train=True, transform=self.additional_transform)
             elif self.config.data_name == 'cifar100':
-                self.train_dataset = CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                             train=True, download=True, transform=self.train_transform)
-                self.test_dataset = CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                            train=False, download=True, transform=self.test_transform)
+                self.train_dataset = get_dataset(CIFAR100,
+                                                 os.path.join(self.config.root_path, self.config.data_directory),
+                                                 train=True, transform=self.train_transform)
+                self.test_dataset = get_dataset(CIFAR100,
+                                                os.path.join(self.config.root_path, self.config.data_directory),
+                                                train=False, transform=self.test_transform)
+
+        if self.config.tensor_dataset:
+            self.test_dataset = Tensor_CIFAR(self.test_dataset, pin_memory=self.config.pin_memory)
 
-        self.test_loader = DataLoader(self.test_dataset, batch_size=self.batch_size, num_workers=1,
-                                      pin_memory=self.config.pin_memory)
+        self.test_loader = make_loader(self.test_dataset, np.arange(len(self.test_dataset)), self.batch_size,
+                                       self.config, num_workers=1)
 
         # define models
-        self.task = resnet(self.config.num_classes).cuda()
-        self.feature_module = fnet(f_dim=self.config.vae_embedding_dim).cuda()
+        self.task = place(resnet(self.config.num_classes), self.config)
+        self.feature_module = place(fnet(f_dim=self.config.vae_embedding_dim), self.config)
 
         self.epochl = self.config.epochl
 
         # parallel setting
-        gpu_list = list(range(self.config.gpu_cnt))
-        self.task = nn.DataParallel(self.task, device_ids=gpu_list)
-        self.feature_module = nn.DataParallel(self.feature_module, device_ids=gpu_list)
+        self.task = parallel(self.task, self.config)
+        self.feature_module = parallel(self.feature_module, self.config)
 
         self.print_train_info()
 
@@ -82,19 +95,22 @@ class ClassificationWithFeature(object):
         print('Number of generator parameters: {}'.format(count_model_prameters(self.task)))
 
     def save_checkpoint(self):
-        tmp_name = os.path.join(self.config.root_path, self.config.checkpoint_directory, 'task.pth.tar')
+        if not is_main_process():
+            return
+
+        tmp_name = checkpoint_path(self, 'task')
 
         state = {
-            'task_state_dict': self.task.state_dict(),
-            'feature_state_dict': self.feature_module.state_dict(),
+            'task_state_dict': unwrap(self.task).state_dict(),
+            'feature_state_dict': unwrap(self.feature_module).state_dict(),
         }
 
-        torch.save(state, tmp_name)
+        atomic_save(state, tmp_name)
 
     def set_train(self):
         # define loss
-        self.loss = loss().cuda()
-        self.mse_loss = mse_loss().cuda()
+        self.loss = loss().to(self.device)
+        self.mse_loss = mse_loss().to(self.device)
 
         # define optimizer
         self.task_opt = torch.optim.SGD(self.task.parameters(), lr=self.config.learning_rate,
@@ -112,36 +128,80 @@ class ClassificationWithFeature(object):
     def run(self, sample_list, ae):
         try:
             self.set_train()
-            self.train(sample_list, ae)
+            self.train(list(sample_list), ae)
 
         except KeyboardInterrupt:
             print("You have entered CTRL+C.. Wait to finalize")
 
     def train(self, sample_list, ae):
+        # loaders are built once and keep their workers, every epoch only swaps the keys of their sampler
+        data_loader, teacher = self.set_teacher(self.train_dataset, sample_list, ae)
         for _ in range(self.config.epoch):
             self.epoch += 1
 
-            random.shuffle(sample_list)
-            data_loader = DataLoader(self.train_dataset, batch_size=self.batch_size, num_workers=2,
-                                     pin_memory=self.config.pin_memory, sampler=Sampler(sample_list))
-            self.train_by_epoch(data_loader, ae)
+            data_loader.sampler.indices = self.epoch_keys(data_loader.dataset, sample_list)
+            self.train_by_epoch(data_loader, ae, teacher)
             
             self.task_scheduler.step()
             self.feature_scheduler.step()
 
+        data_loader, teacher = self.set_teacher(self.dataset_for_additional, sample_list, ae)
         for _ in range(self.config.epoch // 2):
             self.epoch += 1
 
-            random.shuffle(sample_list)
-            data_loader = DataLoader(self.dataset_for_additional, batch_size=self.batch_size, num_workers=2,
-                                     pin_memory=self.config.pin_memory, sampler=Sampler(sample_list))
-            self.additional_train(data_loader, ae)
+            data_loader.sampler.indices = self.epoch_keys(data_loader.dataset, sample_list)
+            self.additional_train(data_loader, ae, teacher)
 
             self.feature_scheduler.step()
             
         self.test()
 
-    def train_by_epoch(self, data_loader, ae):
+    def set_teacher(self, dataset, sample_list, ae):
+        """
+        with config.deterministic_views (opt-in, it restricts training to teacher_views fixed augmentations per
+        sample) the frozen ae runs once per (labeled sample, view) key
+        return: loader over the dataset and the [views * N, ...] ae targets indexed by key (None: ae runs per batch)
+        """
+        if not self.config.deterministic_views:
+            data_loader = make_loader(dataset, sample_list, self.batch_size, self.config, num_workers=2, shuffle=True,
+                                      shard=True)
+            return data_loader, None
+
+        dataset = ViewDataset(dataset)
+        keys = [dataset.key(index, view) for view in range(self.config.teacher_views) for index in sample_list]
+        data_loader = make_loader(dataset, keys, self.batch_size, self.config, num_workers=2, shuffle=True,
+                                  shard=True)
+
+        # every rank needs the targets of every key, only the training passes are sharded
+        data_loader.sampler.shard = False
+
+        teacher = None
+        tqdm_batch = tqdm(data_loader, leave=False, total=len(data_loader))
+        for curr_it, data in enumerate(tqdm_batch):
+            inputs = data[0].to(self.device, non_blocking=self.config.async_loading)
+            key = data[2].to(self.device, non_blocking=self.config.async_loading)
+
+            ae_features = ae.get_feature(inputs).reshape([inputs.size(0), -1])
+            if teacher is None:
+                teacher = torch.zeros([self.config.teacher_views * len(dataset), ae_features.size(1)],
+                                      device=self.device)
+            teacher[key] = ae_features
+        tqdm_batch.close()
+
+        data_loader.sampler.shard = True
+
+        return data_loader, teacher
+
+    def epoch_keys(self, dataset, sample_list):
+        # the order is the sampler's business, it reshuffles on every pass
+        if not isinstance(dataset, ViewDataset):
+            return sample_list
+
+        # one cached view per sample and epoch
+        views = np.random.RandomState(random.getrandbits(32)).randint(self.config.teacher_views, size=len(sample_list))
+        return [dataset.key(index, view) for index, view in zip(sample_list, views.tolist())]
+
+    def train_by_epoch(self, data_loader, ae, teacher=None):
         tqdm_batch = tqdm(data_loader, leave=False, total=len(data_loader))
 
         eps = 1.0
@@ -154,8 +214,8 @@ class ClassificationWithFeature(object):
             self.task_opt.zero_grad()
             self.feature_opt.zero_grad()
 
-            inputs = data[0].cuda(async=self.config.async_loading)
-            targets = data[1].cuda(async=self.config.async_loading)
+            inputs = data[0].to(self.device, non_blocking=self.config.async_loading)
+            targets = data[1].to(self.device, non_blocking=self.config.async_loading)
 
             out, task_features = self.task(inputs)
             target_loss = self.loss(out, targets, 10)
@@ -168,7 +228,10 @@ class ClassificationWithFeature(object):
             features = self.feature_module(task_features)
             features = features.view([-1, self.config.vae_embedding_dim])
 
-            ae_features = ae.get_feature(inputs)
+            if teacher is None:
+                ae_features = ae.get_feature(inputs)
+            else:
+                ae_features = teacher[data[2].to(self.device, non_blocking=self.config.async_loading)]
 
             t_loss = self.mse_loss(features, ae_features.detach())
             loss = (eps * t_loss) + torch.mean(target_loss)
@@ -184,7 +247,7 @@ class ClassificationWithFeature(object):
         if self.epoch % 50 is 0:
             print(f'########## epoch{self.epoch} loss - total: {avg_loss.val} / trans: {trans_loss.val} ##########')
 
-    def additional_train(self, data_loader, ae):
+    def additional_train(self, data_loader, ae, teacher=None):
         tqdm_batch = tqdm(data_loader, leave=False, total=len(data_loader))
 
         trans_loss = AverageMeter()
@@ -194,7 +257,7 @@ class ClassificationWithFeature(object):
         for curr_it, data in enumerate(tqdm_batch):
             self.feature_opt.zero_grad()
 
-            inputs = data[0].cuda(async=self.config.async_loading)
+            inputs = data[0].to(self.device, non_blocking=self.config.async_loading)
 
             out, task_features = self.task(inputs)
 
@@ -204,7 +267,10 @@ class ClassificationWithFeature(object):
             features = self.feature_module(task_features)
             features = features.view([-1, self.config.vae_embedding_dim])
 
-            ae_features = ae.get_feature(inputs)
+            if teacher is None:
+                ae_features = ae.get_feature(inputs)
+            else:
+                ae_features = teacher[data[2].to(self.device, non_blocking=self.config.async_loading)]
 
             loss = self.mse_loss(features, ae_features.detach())
 
@@ -218,7 +284,7 @@ class ClassificationWithFeature(object):
             print(f'########## epoch{self.epoch} loss - trans: {trans_loss.val} ##########')
 
     def test(self):
-        with torch.no_grad():
+        with inference_mode():
             tqdm_batch = tqdm(self.test_loader, leave=False, total=len(self.test_loader))
 
             total = 0
@@ -227,8 +293,8 @@ class ClassificationWithFeature(object):
                 self.task.eval()
                 self.feature_module.eval()
 
-                inputs = data[0].cuda(async=self.config.async_loading)
-                targets = data[1].cuda(async=self.config.async_loading)
+                inputs = data[0].to(self.device, non_blocking=self.config.async_loading)
+                targets = data[1].to(self.device, non_blocking=self.config.async_loading)
                 total += inputs.size(0)
 
                 out, _ = self.task(inputs)
@@ -249,8 +315,8 @@ class ClassificationWithFeature(object):
             self.feature_module.eval()
             feature_set, loss_set = [], []
             for curr_it, data in enumerate(tqdm_batch):
-                inputs = data[0].cuda(async=self.config.async_loading)
-                targets = data[1].cuda(async=self.config.async_loading)
+                inputs = data[0].to(self.device, non_blocking=self.config.async_loading)
+                targets = data[1].to(self.device, non_blocking=self.config.async_loading)
 
                 out, task_features = self.task(inputs)
                 target_loss = self.loss(out, targets, 10)
@@ -268,8 +334,8 @@ class ClassificationWithFeature(object):
     def get_distance(self, inputs):
         self.task.eval()
         self.feature_module.eval()
-        with torch.no_grad():
-            inputs = inputs.cuda(async=self.config.async_loading)
+        with inference_mode():
+            inputs = inputs.to(self.device, non_blocking=self.config.async_loading)
 
             out, task_features = self.task(inputs)
             features = self.feature_module(task_features)
@@ -282,7 +348,7 @@ class ClassificationWithFeature(object):
         self.task.eval()
         self.feature_module.eval()
         with torch.no_grad():
-            inputs = inputs.cuda(async=self.config.async_loading)
+            inputs = inputs.to(self.device, non_blocking=self.config.async_loading)
 
             _, task_features = self.task(inputs)
             features = self.feature_module(task_features)
@@ -1,10 +1,10 @@
 import os
 from tqdm import tqdm
 
+import numpy as np
+
 import torch
-from torch import nn
 from torch.backends import cudnn
-from torch.utils.data import DataLoader
 from torchvision import transforms
 from torchvision.datasets import CIFAR10, CIFAR100
 
@@ -12,10 +12,17 @@ from .graph.resnet import ResNet18 as resnet
 from .graph.lossnet import LossNet as lossnet
 from .graph.loss import CELoss as loss
 from .graph.loss import LossPredLoss as r_loss
-from data.sampler import Sampler
+from data.augment import BatchAugment
+from data.dataset import Tensor_CIFAR, make_loader, CIFAR_MEAN, CIFAR_STD
+from data.registry import get_dataset
 
 from utils.metrics import AverageMeter
 from utils.train_utils import count_model_prameters
+from utils.artifacts import atomic_save, checkpoint_path
+from utils.export import freeze, unwrap, LossScorer
+from utils.quantize import quantize_static, rank_correlation
+from utils.distributed import is_main_process
+from utils.runtime import get_device, place, parallel, inference_mode
 
 
 cudnn.benchmark = False
@@ -24,11 +31,13 @@ cudnn.benchmark = False
 class ClassificationWithLoss(object):
     def __init__(self, config):
         self.config = config
+        self.device = get_device(self.config)
         self.best_acc = 0.0
 
         self.batch_size = self.config.batch_size
 
         # define dataloader
+        self.train_augment = None
         if 'cifar' in self.config.data_name:
             self.train_transform = transforms.Compose([
                 transforms.RandomHorizontalFlip(),
@@ -43,29 +52,42 @@ class ClassificationWithLoss(object):
             ])
 
             if self.config.data_name == 'cifar10':
-                self.train_dataset = CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                             train=True, download=True, transform=self.train_transform)
-                self.test_dataset = CIFAR10(os.path.join(self.config.root_path, self.config.data_directory),
-                                            train=False, download=True, transform=self.test_transform)
+                self.train_dataset = get_dataset(CIFAR10,
+                                                 os.path.join(self.config.root_path, self.config.data_directory),
+                                                 train=True, transform=self.train_transform)
+                self.test_dataset = get_dataset(CIFAR10,
+                                                os.path.join(self.config.root_path, self.config.data_directory),
+                                                train=False, transform=self.test_transform)
             elif self.config.data_name == 'cifar100':
-                self.train_dataset = CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                             train=True, download=True, transform=self.train_transform)
-                self.test_dataset = CIFAR100(os.path.join(self.config.root_path, self.config.data_directory),
-                                            train=False, download=True, transform=self.test_transform)
+                self.train_dataset = get_dataset(CIFAR100,
+                                                 os.path.join(self.config.root_path, self.config.data_directory),
+                                                 train=True, transform=self.train_transform)
+                self.test_dataset = get_dataset(CIFAR100,
+                                                os.path.join(self.config.root_path, self.config.data_directory),
+                                                train=False, transform=self.test_transform)
+
+            if self.config.batch_augment:
+                self.train_dataset = Tensor_CIFAR(self.train_dataset, pin_memory=self.config.pin_memory)
+                self.train_augment = BatchAugment(CIFAR_MEAN, CIFAR_STD)
+
+        if self.config.tensor_dataset:
+            self.test_dataset = Tensor_CIFAR(self.test_dataset, pin_memory=self.config.pin_memory)
 
-        self.test_loader = DataLoader(self.test_dataset, batch_size=self.batch_size, num_workers=1,
-                                      pin_memory=self.config.pin_memory)
+        self.test_loader = make_loader(self.test_dataset, np.arange(len(self.test_dataset)), self.batch_size,
+                                       self.config, num_workers=1)
 
         # define models
-        self.task = resnet(self.config.num_classes).cuda()
-        self.loss_module = lossnet().cuda()
+        self.task = place(resnet(self.config.num_classes), self.config)
+        self.loss_module = place(lossnet(), self.config)
 
         self.epochl = self.config.epochl
 
         # parallel setting
-        gpu_list = list(range(self.config.gpu_cnt))
-        self.task = nn.DataParallel(self.task, device_ids=gpu_list)
-        self.loss_module = nn.DataParallel(self.loss_module, device_ids=gpu_list)
+        self.task = parallel(self.task, self.config)
+        self.loss_module = parallel(self.loss_module, self.config)
+
+        # frozen scoring graph of the last training cycle
+        self.scorer = None
 
         self.print_train_info()
 
@@ -73,19 +95,25 @@ class ClassificationWithLoss(object):
         print('Number of generator parameters: {}'.format(count_model_prameters(self.task)))
 
     def save_checkpoint(self):
-        tmp_name = os.path.join(self.config.root_path, self.config.checkpoint_directory, 'task.pth.tar')
+        if not is_main_process():
+            return
+
+        tmp_name = checkpoint_path(self, 'task')
 
         state = {
-            'task_state_dict': self.task.state_dict(),
-            'loss_state_dict': self.loss_module.state_dict(),
+            'task_state_dict': unwrap(self.task).state_dict(),
+            'loss_state_dict': unwrap(self.loss_module).state_dict(),
         }
 
-        torch.save(state, tmp_name)
+        atomic_save(state, tmp_name)
 
     def set_train(self):
+        # the frozen graph is stale once training starts
+        self.scorer = None
+
         # define loss
-        self.loss = loss().cuda()
-        self.r_loss = r_loss().cuda()
+        self.loss = loss().to(self.device)
+        self.r_loss = r_loss().to(self.device)
 
         # define optimizer
         self.task_opt = torch.optim.SGD(self.task.parameters(), lr=self.config.learning_rate,
@@ -101,12 +129,15 @@ class ClassificationWithLoss(object):
         self.epoch = 0
 
     def run(self, sample_list):
-        data_loader = DataLoader(self.train_dataset, batch_size=self.batch_size, num_workers=2,
-                                 pin_memory=self.config.pin_memory, sampler=Sampler(sample_list))
+        data_loader = make_loader(self.train_dataset, sample_list, self.batch_size, self.config, num_workers=2,
+                                  augment=self.train_augment, shard=True)
         try:
             self.set_train()
             self.train(data_loader)
 
+            if self.config.quantize_inference and self.device.type == 'cpu':
+                self.quantize(sample_list)
+
         except KeyboardInterrupt:
             print("You have entered CTRL+C.. Wait to finalize")
 
@@ -119,6 +150,7 @@ class ClassificationWithLoss(object):
             self.loss_scheduler.step()
             
         self.test()
+        self.export()
 
     def train_by_epoch(self, data_loader):
         tqdm_batch = tqdm(data_loader, leave=False, total=len(data_loader))
@@ -130,8 +162,8 @@ class ClassificationWithLoss(object):
             self.task_opt.zero_grad()
             self.loss_opt.zero_grad()
 
-            inputs = data[0].cuda(async=self.config.async_loading)
-            targets = data[1].cuda(async=self.config.async_loading)
+            inputs = data[0].to(self.device, non_blocking=self.config.async_loading)
+            targets = data[1].to(self.device, non_blocking=self.config.async_loading)
 
             out, features = self.task(inputs)
             target_loss = self.loss(out, targets, 10)
@@ -154,7 +186,7 @@ class ClassificationWithLoss(object):
         tqdm_batch.close()
 
     def test(self):
-        with torch.no_grad():
+        with inference_mode():
             tqdm_batch = tqdm(self.test_loader, leave=False, total=len(self.test_loader))
 
             total = 0
@@ -163,8 +195,8 @@ class ClassificationWithLoss(object):
                 self.task.eval()
                 self.loss_module.eval()
 
-                inputs = data[0].cuda(async=self.config.async_loading)
-                targets = data[1].cuda(async=self.config.async_loading)
+                inputs = data[0].to(self.device, non_blocking=self.config.async_loading)
+                targets = data[1].to(self.device, non_blocking=self.config.async_loading)
                 total += inputs.size(0)
 
                 out, _ = self.task(inputs)
@@ -177,14 +209,70 @@ class ClassificationWithLoss(object):
                 self.best_acc = correct / total
                 self.save_checkpoint()
 
+    def export(self):
+        """
+        backbone + loss head traced, bn-folded and frozen for pool scoring, redone after every training cycle
+        """
+        self.scorer = None
+        if self.config.export_inference:
+            example = torch.zeros([2, 3, 32, 32], device=self.device)
+            loader = make_loader(self.test_dataset, np.arange(self.batch_size), self.batch_size, self.config)
+            check = next(iter(loader))[0].to(self.device)
+
+            self.scorer = freeze(LossScorer(self.task, self.loss_module), example, check)
+
+    def quantize(self, sample_list):
+        """
+        int8 static quantization of the scoring graph, calibrated on the labeled set
+        kept only if its loss ranking on held-out test images agrees with fp32 (spearman >= quantize_min_correlation)
+        """
+        scorer = LossScorer(self.task, self.loss_module).eval()
+
+        # the labeled images as the pool scoring sees them (test transform, never augmented), whatever batch_augment is
+        dataset = get_dataset(CIFAR10 if self.config.data_name == 'cifar10' else CIFAR100,
+                              os.path.join(self.config.root_path, self.config.data_directory),
+                              train=True, transform=self.test_transform)
+        if self.config.tensor_dataset:
+            dataset = Tensor_CIFAR(dataset, pin_memory=self.config.pin_memory)
+
+        calibration = make_loader(dataset, sample_list[:self.config.quantize_calibration], self.batch_size,
+                                  self.config)
+        quantized = quantize_static(scorer, (data[0] for data in calibration), self.config.quantize_backend)
+
+        fp32_loss, int8_loss, total = [], [], 0
+        with inference_mode():
+            for data in self.test_loader:
+                inputs = data[0].cpu().contiguous()
+
+                fp32_loss.append(scorer(inputs)[-1].numpy())
+                int8_loss.append(quantized(inputs)[-1].numpy())
+
+                total += inputs.size(0)
+                if total >= self.config.quantize_check_size:
+                    break
+
+        correlation = rank_correlation(np.concatenate(fp32_loss), np.concatenate(int8_loss))
+        print(f'int8 scoring - rank correlation with fp32: {correlation:.4f}')
+
+        if correlation >= self.config.quantize_min_correlation:
+            self.scorer = quantized
+
     def get_result(self, inputs):
+        if self.scorer is not None:
+            with inference_mode():
+                inputs = inputs.to(self.device, non_blocking=self.config.async_loading)
+
+                out, *features, pred_loss = self.scorer(inputs)
+
+            return out, list(features), pred_loss
+
         self.task.eval()
         self.loss_module.eval()
         with torch.no_grad():
-            inputs = inputs.cuda(async=self.config.async_loading)
+            inputs = inputs.to(self.device, non_blocking=self.config.async_loading)
 
-            out, features = self.task(inputs)
-            pred_loss = self.loss_module(features)
+            out, features = unwrap(self.task)(inputs)
+            pred_loss = unwrap(self.loss_module)(features)
 
             pred_loss = pred_loss.view([-1, ])
 
@@ -194,9 +282,9 @@ class ClassificationWithLoss(object):
         self.task.eval()
         self.loss_module.eval()
         with torch.no_grad():
-            inputs = inputs.cuda(async=self.config.async_loading)
+            inputs = inputs.to(self.device, non_blocking=self.config.async_loading)
 
-            out, features = self.task(inputs)
+            out, features = unwrap(self.task)(inputs)
 
             loss = self.loss(out, targets, 10)
             loss = loss.view([-1, ])
@@ -204,11 +292,14 @@ class ClassificationWithLoss(object):
         return out, features, loss
 
     def get_feature(self, inputs):
+        if self.scorer is not None:
+            return self.get_result(inputs)[1]
+
         self.task.eval()
         self.loss_module.eval()
         with torch.no_grad():
-            inputs = inputs.cuda(async=self.config.async_loading)
+            inputs = inputs.to(self.device, non_blocking=self.config.async_loading)
 
-            out, features = self.task(inputs)
+            out, features = unwrap(self.task)(inputs)
 
         return features
\ No newline at end of file
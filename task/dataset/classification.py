@@ -1,9 +1,12 @@
+import hashlib
 import os
 import numpy as np
 
 import torch
 from torch.utils.data import Dataset
 
+from task.dataset.shard import INDEX_FILE, ShardReader, convert_npz
+
 
 class ClassificationDataset(Dataset):
     def __init__(self, config, transform, data_list):
@@ -26,3 +29,48 @@ class ClassificationDataset(Dataset):
         img = self.transform(data['img'])
 
         return {'X': img, 'target': torch.from_numpy(data['label'])}
+
+
+class PackedClassificationDataset(Dataset):
+    """
+    ClassificationDataset served from packed shards (task.dataset.shard), same data_list and items
+    the shards are built from the per-sample .npz directory on first use, one shard directory per data_list
+    (keyed by a hash of the names), so every split of a data_name gets its own
+    """
+    def __init__(self, config, transform, data_list):
+        self.root_path = config.root_path
+        self.data_directory = config.data_directory
+        self.config = config
+        self.transform = transform
+        self.data_list = [name.strip() for name in data_list]
+
+        list_key = hashlib.sha1('\n'.join(self.data_list).encode()).hexdigest()[:16]
+        directory = os.path.join(self.root_path, self.config.shard_directory, self.config.data_name, list_key)
+        if not os.path.exists(os.path.join(directory, INDEX_FILE)):
+            convert_npz(os.path.join(self.root_path, self.data_directory, self.config.data_name),
+                        self.data_list, directory, self.config.shard_size)
+
+        self.reader = ShardReader(directory, self.config.shard_read_ahead)
+        self.index = np.array([self.reader.position[name] for name in self.data_list], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.data_list)
+
+    def __getitem__(self, idx):
+        if torch.is_tensor(idx):
+            idx = idx.tolist()
+
+        img, label = self.reader.get(int(self.index[idx]))
+        img = self.transform(img)
+
+        return {'X': img, 'target': torch.from_numpy(np.array(label))}
+
+
+def classification_dataset(config, transform, data_list):
+    """
+    dataset of a per-sample .npz data_list, served from packed shards with config.packed_dataset
+    """
+    if config.packed_dataset:
+        return PackedClassificationDataset(config, transform, data_list)
+
+    return ClassificationDataset(config, transform, data_list)
@@ -0,0 +1,220 @@
+import json
+import mmap
+import os
+import shutil
+
+import numpy as np
+from tqdm import tqdm
+
+
+INDEX_FILE = 'index.json'
+
+
+def shard_name(shard):
+    return f'shard_{shard:05d}'
+
+
+class ShardWriter(object):
+    """
+    packed layout of a classification split, a few large shards instead of one .npz per sample
+    shard_XXXXX.img: raw uint8 images back to back, every sample the same stride
+    shard_XXXXX_label.npy: labels of the shard in the same order
+    index.json: image / label shape and dtype, shard sizes and the sample names in storage order
+    """
+    def __init__(self, directory, shard_size=10000):
+        self.directory = directory
+        self.shard_size = shard_size
+
+        self.names = []
+        self.shards = []
+
+        self.img_shape = None
+        self.label_shape = None
+        self.label_dtype = None
+
+        self.img_file = None
+        self.labels = []
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.img_file = open(os.path.join(self.directory, shard_name(len(self.shards)) + '.img'), 'wb')
+        self.labels = []
+
+    def close_shard(self):
+        shard = shard_name(len(self.shards))
+        self.img_file.close()
+        np.save(os.path.join(self.directory, shard + '_label.npy'), np.stack(self.labels))
+
+        self.shards.append({'name': shard, 'count': len(self.labels)})
+        self.img_file = None
+
+    def add(self, name, img, label):
+        img = np.ascontiguousarray(img)
+        label = np.asarray(label)
+
+        if img.dtype != np.uint8:
+            raise ValueError(f'{name}: packed images must be uint8, got {img.dtype}')
+
+        if self.img_shape is None:
+            self.img_shape, self.label_shape, self.label_dtype = img.shape, label.shape, label.dtype
+        elif img.shape != self.img_shape:
+            raise ValueError(f'{name}: image shape {img.shape} differs from {self.img_shape}')
+
+        if self.img_file is None:
+            self.open()
+
+        self.img_file.write(img.tobytes())
+        self.labels.append(label.astype(self.label_dtype))
+        self.names.append(name)
+
+        if len(self.labels) == self.shard_size:
+            self.close_shard()
+
+    def close(self):
+        if self.img_file is not None:
+            self.close_shard()
+
+        if self.img_shape is None:
+            # nothing was added, an empty but valid store
+            self.img_shape, self.label_shape, self.label_dtype = (), (), np.int64
+            os.makedirs(self.directory, exist_ok=True)
+
+        index = {'img_shape': list(self.img_shape), 'label_shape': list(self.label_shape),
+                 'label_dtype': np.dtype(self.label_dtype).str, 'shards': self.shards, 'names': self.names}
+
+        # the index goes last, a half written directory is never picked up by a reader
+        with open(os.path.join(self.directory, INDEX_FILE + '.tmp'), 'w') as f:
+            json.dump(index, f)
+        os.replace(os.path.join(self.directory, INDEX_FILE + '.tmp'), os.path.join(self.directory, INDEX_FILE))
+
+
+def convert_npz(source, names, directory, shard_size=10000):
+    """
+    per-sample layout (source/<name>.npz with 'img' and 'label') -> packed shards in directory
+    the shards are written to a private temporary directory renamed into place as a whole, so concurrent
+    conversions never mix their files: the first rename wins, the others drop their copy
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(directory)), exist_ok=True)
+
+    tmp_directory = f'{directory}.{os.getpid()}.tmp'
+    writer = ShardWriter(tmp_directory, shard_size)
+
+    for name in tqdm(names, leave=False):
+        name = name.strip()
+        with np.load(os.path.join(source, name + '.npz')) as data:
+            writer.add(name, data['img'], data['label'])
+
+    writer.close()
+
+    try:
+        os.replace(tmp_directory, directory)
+    except OSError:
+        if not os.path.exists(os.path.join(directory, INDEX_FILE)):
+            raise
+        shutil.rmtree(tmp_directory)
+
+    return directory
+
+
+class ShardReader(object):
+    """
+    memory-mapped reader of a ShardWriter directory
+    a sample is a zero-copy, copy-on-write view into the page cache (writable, writes never reach the file),
+    and while accesses stay sequential the next
+    `read_ahead` samples of the shard are announced to the kernel (MADV_WILLNEED) so reads overlap compute
+    maps are opened lazily, so every DataLoader worker gets its own after the fork
+    """
+    def __init__(self, directory, read_ahead=256):
+        self.directory = directory
+        self.read_ahead = read_ahead
+
+        with open(os.path.join(directory, INDEX_FILE)) as f:
+            index = json.load(f)
+
+        self.img_shape = tuple(index['img_shape'])
+        self.stride = int(np.prod(self.img_shape))
+        self.names = index['names']
+        self.position = {name: i for i, name in enumerate(self.names)}
+
+        self.shards = [shard['name'] for shard in index['shards']]
+        counts = [shard['count'] for shard in index['shards']]
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+        labels = [np.load(os.path.join(directory, shard + '_label.npy')) for shard in self.shards]
+        self.labels = np.concatenate(labels) if labels else np.empty((0,) + tuple(index['label_shape']),
+                                                                      dtype=index['label_dtype'])
+
+        self.maps = None
+        self.last = -2
+        self.advised = -1
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['maps'] = None
+
+        return state
+
+    def open(self):
+        self.maps = []
+        for shard in self.shards:
+            with open(os.path.join(self.directory, shard + '.img'), 'rb') as f:
+                # private mapping: transforms may modify the arrays in place
+                self.maps.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY))
+
+    def locate(self, i):
+        shard = int(np.searchsorted(self.offsets, i, side='right')) - 1
+
+        return shard, i - int(self.offsets[shard])
+
+    def advise(self, shard, start, count):
+        """
+        hint the kernel to fetch samples [start, start + count) of a shard
+        """
+        if not hasattr(mmap, 'MADV_WILLNEED'):
+            return
+
+        buffer = self.maps[shard]
+        begin = start * self.stride // mmap.PAGESIZE * mmap.PAGESIZE
+        end = min((start + count) * self.stride, len(buffer))
+        if end > begin:
+            buffer.madvise(mmap.MADV_WILLNEED, begin, end - begin)
+
+    def images(self, shard, start, count):
+        return np.frombuffer(self.maps[shard], dtype=np.uint8, count=count * self.stride,
+                             offset=start * self.stride).reshape((count,) + self.img_shape)
+
+    def get(self, i):
+        """
+        return: (uint8 image view, label) of the i-th stored sample
+        """
+        if self.maps is None:
+            self.open()
+
+        shard, offset = self.locate(i)
+
+        if self.read_ahead and i == self.last + 1 and i >= self.advised:
+            count = min(self.read_ahead, int(self.offsets[shard + 1]) - i)
+            self.advise(shard, offset, count)
+            self.advised = i + count
+        self.last = i
+
+        return self.images(shard, offset, 1)[0], self.labels[i]
+
+    def read(self, indices):
+        """
+        a contiguous run inside one shard is a single zero-copy slice, anything else one gather
+        return: ([B, ...] uint8 images, [B, ...] labels)
+        """
+        if self.maps is None:
+            self.open()
+
+        indices = np.asarray(indices, dtype=np.int64)
+        if len(indices) and indices[-1] - indices[0] + 1 == len(indices) and np.all(np.diff(indices) == 1):
+            shard, offset = self.locate(int(indices[0]))
+            if indices[-1] < self.offsets[shard + 1]:
+                return self.images(shard, offset, len(indices)), self.labels[indices[0]:indices[-1] + 1]
+
+        return np.stack([self.images(*self.locate(int(i)), 1)[0] for i in indices]), self.labels[indices]
@@ -7,6 +7,9 @@ from torch.backends import cudnn
 from config import Config
 from query.query_ll4al import Query
 from task.classification_loss import ClassificationWithLoss as Task
+from utils.distributed import launch, main_process_file
+from utils.runtime import setup_runtime
+from utils.trials import run_trials
 
 torch.backends.cudnn.deterministic = True
 torch.backends.cudnn.benchmark = False
@@ -20,7 +23,7 @@ def main(cycle_cnt, config, query):
 
     task = Task(config)
 
-    fp = open(f'record_{cycle_cnt}.txt', 'w')
+    fp = main_process_file(f'record_{cycle_cnt}.txt', 'w')
     for step_cnt in range(config.max_cycle):
         # take a new sample
         query.sampling(step_cnt)
@@ -28,7 +31,7 @@ def main(cycle_cnt, config, query):
         # train a task model
         task.run(query.labeled)
 
-        print(f'trial-{cycle_cnt} / step {step_cnt + 1}: train data count - {len(set(query.labeled))}')
+        print(f'trial-{cycle_cnt} / step {step_cnt + 1}: train data count - {len(query.labeled)}')
         print(f'test accuracy - {task.best_acc}')
 
         fp.write(f'{task.best_acc}\n')
@@ -36,9 +39,20 @@ def main(cycle_cnt, config, query):
     fp.close()
 
 
-if __name__ == '__main__':
-    for i in range(10):
-        config = Config()
-        query = Query(config)
+def trial(cycle_cnt):
+    config = Config()
+    config.seed = cycle_cnt * 1000
+    query = Query(config)
+
+    main(cycle_cnt, config, query)
+
+
+def run(config):
+    setup_runtime(config)
 
-        main(i + 1, config, query)
+    run_trials(trial, range(1, config.trials + 1), config)
+
+
+if __name__ == '__main__':
+    # config.world_size > 1: one DistributedDataParallel replica per process
+    launch(run, Config())
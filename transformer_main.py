@@ -9,6 +9,8 @@ from query.query_transformer import Query
 from query.strategy.strategy_vae import Strategy as autoencoder
 from query.strategy.strategy_transformer import Strategy as transformer
 from task.classification_loss import ClassificationWithLoss as Task
+from utils.distributed import launch, main_process_file
+from utils.runtime import setup_runtime
 
 torch.backends.cudnn.deterministic = True
 torch.backends.cudnn.benchmark = False
@@ -19,9 +21,12 @@ def train_autoencoder(cycle_cnt):
     torch.cuda.manual_seed_all(cycle_cnt * 1000)
 
     config = Config()
+    config.seed = cycle_cnt * 1000
     ae = autoencoder(config)
 
-    ae.run()
+    # opt-in: an artifact of the same (config, code, seed) replaces training
+    if not (config.reuse_artifacts and ae.load_checkpoint()):
+        ae.run()
 
     return ae
 
@@ -35,7 +40,7 @@ def main(cycle_cnt, config, query, ae):
     task = Task(config)
     trans = transformer(config)
 
-    fp = open(f'record_{cycle_cnt}.txt', 'w')
+    fp = main_process_file(f'record_{cycle_cnt}.txt', 'w')
     for step_cnt in range(config.max_cycle):
         # take a new sample
         query.sampling(step_cnt, task, trans, ae)
@@ -43,7 +48,7 @@ def main(cycle_cnt, config, query, ae):
         # train a task model
         task.run(query.labeled)
 
-        print(f'trial-{cycle_cnt} / step {step_cnt + 1}: train data count - {len(set(query.labeled))}')
+        print(f'trial-{cycle_cnt} / step {step_cnt + 1}: train data count - {len(query.labeled)}')
         print(f'test accuracy - {task.best_acc}')
 
         fp.write(f'{task.best_acc}\n')
@@ -53,10 +58,18 @@ def main(cycle_cnt, config, query, ae):
     fp.close()
 
 
-if __name__ == '__main__':
+def run(config):
+    setup_runtime(config)
+
     for i in range(5):
         ae = train_autoencoder(i + 1)
         config = Config()
+        config.seed = (i + 1) * 1000
         query = Query(config)
 
-        main(i + 1, config, query, ae)
\ No newline at end of file
+        main(i + 1, config, query, ae)
+
+
+if __name__ == '__main__':
+    # config.world_size > 1: one DistributedDataParallel replica per process
+    launch(run, Config())
\ No newline at end of file
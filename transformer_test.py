@@ -8,6 +8,7 @@ from config import Config
 from query.strategy.strategy_ae import Strategy as autoencoder
 from query.strategy.strategy_transformer import Strategy as transformer
 from task.classification_loss import ClassificationWithLoss as Task
+from utils.runtime import setup_runtime
 
 torch.backends.cudnn.deterministic = True
 torch.backends.cudnn.benchmark = False
@@ -41,6 +42,8 @@ def main(cycle_cnt, config, ae):
 
 
 if __name__ == '__main__':
+    setup_runtime(Config())
+
     for i in range(1):
         ae = train_strategy(i + 1)
         config = Config()
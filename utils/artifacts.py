@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+import sys
+
+import torch
+from torch import nn
+
+from utils.distributed import world_size
+from utils.export import unwrap
+
+
+# config fields that decide what a model learns, everything else (paths, devices, threads, loaders, inference,
+# scheduling) can change without invalidating a trained artifact
+LEARNING_FIELDS = ['data_name', 'data_size', 'num_classes', 'initial_size', 'budge_size', 'budge_max', 'max_cycle',
+                   'epoch', 'epochl', 'milestones', 'batch_size', 'learning_rate', 'momentum', 'wdecay',
+                   'tensor_dataset', 'batch_augment',
+                   'vae_batch_size', 'vae_epoch', 'vae_num_hiddens', 'vae_num_residual_hiddens',
+                   'vae_num_residual_layers', 'vae_embedding_dim', 'vae_num_embeddings', 'vae_commitment_cost',
+                   'vae_decay', 'vae_distance', 'vae_learning_rate',
+                   'transformer_cache_views', 'feature_store_views', 'deterministic_views', 'teacher_views']
+
+
+def config_fields(config):
+    return {name: getattr(config, name) for name in LEARNING_FIELDS if hasattr(config, name)}
+
+
+def code_fingerprint(obj):
+    """
+    hash of the source of the modules defining obj's class and every model it holds (query.graph.*, task.model.*),
+    a checkpoint of an older architecture or training loop never matches a newer revision
+    """
+    names = {type(obj).__module__}
+    for value in vars(obj).values():
+        if isinstance(value, nn.Module):
+            names.update(type(module).__module__ for module in value.modules())
+
+    sha = hashlib.sha1()
+    for name in sorted(names):
+        module = sys.modules.get(name)
+        if name.startswith('torch') or module is None or getattr(module, '__file__', None) is None:
+            continue
+        with open(module.__file__, 'rb') as f:
+            sha.update(f.read())
+
+    return sha.hexdigest()
+
+
+def artifact_key(obj, seed=None):
+    """
+    hash of the learning-relevant config fields, the model class and its code, the seed and the number of ranks
+    (the effective batch of distributed training, also under torchrun where config.world_size stays 1)
+    seed: defaults to config.seed, the trial seed the mains set explicitly
+    """
+    config, cls = obj.config, type(obj)
+    seed = config.seed if seed is None else seed
+
+    sha = hashlib.sha1()
+    sha.update(json.dumps(config_fields(config), sort_keys=True, default=str).encode())
+    sha.update(f'{cls.__module__}.{cls.__qualname__}'.encode())
+    sha.update(code_fingerprint(obj).encode())
+    sha.update(str(seed).encode())
+    sha.update(str(world_size()).encode())
+
+    return sha.hexdigest()[:16]
+
+
+def checkpoint_path(obj, name, seed=None):
+    """
+    content-addressed checkpoint file of a Strategy / Task object, runs with a different key never share a file
+    """
+    key = artifact_key(obj, seed)
+
+    return os.path.join(obj.config.root_path, obj.config.checkpoint_directory, f'{name}_{key}.pth.tar')
+
+
+def atomic_save(state, file_name):
+    """
+    write next to the target and rename, readers see the old file or the complete new one
+    """
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+
+    tmp_name = f'{file_name}.{os.getpid()}.tmp'
+    torch.save(state, tmp_name)
+    os.replace(tmp_name, file_name)
+
+
+def load_artifact(file_name, modules, device='cpu'):
+    """
+    modules: state key -> module, as written by save_checkpoint (state dicts of the unwrapped modules, so an
+    artifact loads whether or not either run wrapped the model in DataParallel / DistributedDataParallel)
+    return: False when there is no artifact for the key yet
+    """
+    if not os.path.exists(file_name):
+        return False
+
+    state = torch.load(file_name, map_location=device)
+    for key, module in modules.items():
+        unwrap(module).load_state_dict(state[key])
+
+    return True
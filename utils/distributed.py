@@ -0,0 +1,155 @@
+import os
+
+import numpy as np
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process():
+    """
+    checkpoints, summaries and result files are written by rank 0 only
+    """
+    return rank() == 0
+
+
+def init_distributed(config):
+    """
+    join the process group described by the torchrun-style environment (RANK / WORLD_SIZE / MASTER_ADDR / PORT)
+    a no-op for a single process
+    """
+    if is_distributed() or int(os.environ.get('WORLD_SIZE', 1)) <= 1:
+        return
+
+    dist.init_process_group(config.dist_backend)
+
+    if torch.cuda.is_available() and config.device != 'cpu':
+        torch.cuda.set_device(int(os.environ.get('LOCAL_RANK', rank())) % torch.cuda.device_count())
+
+
+def local_world_size():
+    """
+    processes of the group sharing this machine (and its cores)
+    """
+    return int(os.environ.get('LOCAL_WORLD_SIZE', world_size())) if is_distributed() else 1
+
+
+def broadcast(value):
+    """
+    rank 0's value of a picklable object on every rank
+    """
+    if not is_distributed():
+        return value
+
+    values = [value]
+    dist.broadcast_object_list(values, src=0)
+
+    return values[0]
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+
+def all_gather(value):
+    """
+    every rank's value of a picklable object, in rank order
+    """
+    if not is_distributed():
+        return [value]
+
+    values = [None] * world_size()
+    dist.all_gather_object(values, value)
+
+    return values
+
+
+def shard_indices(indices, num_replicas=None, rank_=None):
+    """
+    this rank's share of `indices`, padded by wrapping around so every rank gets the same count
+    (DistributedSampler semantics, ranks must run the same number of steps)
+    """
+    num_replicas = world_size() if num_replicas is None else num_replicas
+    rank_ = rank() if rank_ is None else rank_
+    if num_replicas == 1:
+        return indices
+
+    per_rank = (len(indices) + num_replicas - 1) // num_replicas
+    padded = np.resize(np.arange(len(indices)), per_rank * num_replicas)
+
+    return indices[padded[rank_::num_replicas]]
+
+
+def gather_shards(values, size):
+    """
+    inverse of shard_indices: the [size, ...] array of which every rank computed the rows of its share of range(size)
+    rows of the wrap-around padding come from two ranks and are simply written twice
+    """
+    shards = all_gather(np.asarray(values))
+    if len(shards) == 1:
+        return shards[0]
+
+    output = np.empty((size,) + shards[0].shape[1:], dtype=shards[0].dtype)
+    for rank_, shard in enumerate(shards):
+        output[shard_indices(np.arange(size), len(shards), rank_)] = shard
+
+    return output
+
+
+def _worker(local_rank, fn, config):
+    os.environ['RANK'] = os.environ['LOCAL_RANK'] = str(local_rank)
+    os.environ['WORLD_SIZE'] = os.environ['LOCAL_WORLD_SIZE'] = str(config.world_size)
+    os.environ.setdefault('MASTER_ADDR', config.dist_master_addr)
+    os.environ.setdefault('MASTER_PORT', str(config.dist_master_port))
+
+    init_distributed(config)
+    try:
+        fn(config)
+    finally:
+        dist.destroy_process_group()
+
+
+def launch(fn, config):
+    """
+    fn(config) on config.world_size local processes joined in one gloo group
+    under torchrun (WORLD_SIZE already set, possibly across nodes) the current process just joins its group
+    """
+    if 'WORLD_SIZE' in os.environ or config.world_size <= 1:
+        init_distributed(config)
+        fn(config)
+        return
+
+    mp.spawn(_worker, args=(fn, config), nprocs=config.world_size)
+
+
+def main_process_file(file_name, mode='w'):
+    """
+    open(file_name, mode) on rank 0, the null device elsewhere, for record files every rank writes in lockstep
+    """
+    return open(file_name if is_main_process() else os.devnull, mode)
+
+
+class NullWriter(object):
+    """
+    SummaryWriter stand-in of the non-zero ranks
+    """
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+def summary_writer(writer_class, **kwargs):
+    return writer_class(**kwargs) if is_main_process() else NullWriter()
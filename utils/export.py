@@ -0,0 +1,109 @@
+import copy
+
+import torch
+from torch import nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+
+def unwrap(module):
+    return module.module if isinstance(module, (nn.DataParallel, nn.parallel.DistributedDataParallel)) else module
+
+
+def fold_bn(module):
+    """
+    fold every eval-mode BatchNorm2d into the Conv2d feeding it, in place
+    pairs are found as convN / bnN attributes of one module (resnet blocks) and as adjacent entries of an
+    nn.Sequential (downsample shortcuts), the folded BatchNorm becomes an Identity
+    """
+    for child in list(module.modules()):
+        if isinstance(child, nn.Sequential):
+            names = list(child._modules.keys())
+            for first, second in zip(names, names[1:]):
+                conv, bn = child._modules[first], child._modules[second]
+                if isinstance(conv, nn.Conv2d) and isinstance(bn, nn.BatchNorm2d):
+                    child._modules[first] = fuse_conv_bn_eval(conv, bn)
+                    child._modules[second] = nn.Identity()
+            continue
+
+        for name, conv in list(child.named_children()):
+            bn_name = name.replace('conv', 'bn', 1)
+            bn = getattr(child, bn_name, None)
+            if name.startswith('conv') and isinstance(conv, nn.Conv2d) and isinstance(bn, nn.BatchNorm2d):
+                setattr(child, name, fuse_conv_bn_eval(conv, bn))
+                setattr(child, bn_name, nn.Identity())
+
+    return module
+
+
+def _outputs(outputs):
+    return list(outputs) if isinstance(outputs, (tuple, list)) else [outputs]
+
+
+def equivalent(module, frozen, inputs, rtol=1e-3, atol=1e-3, mismatch=0.):
+    """
+    eager and frozen outputs on a real batch agree: at most a `mismatch` fraction of the elements of every output
+    lies outside rtol / atol (sign codes may flip for values folded across zero)
+    """
+    with torch.no_grad():
+        expected, actual = _outputs(module(inputs)), _outputs(frozen(inputs))
+
+    if len(expected) != len(actual):
+        return False
+
+    for x, y in zip(expected, actual):
+        if x.shape != y.shape:
+            return False
+        if x.numel() and (~torch.isclose(y.float(), x.float(), rtol=rtol, atol=atol)).float().mean() > mismatch:
+            return False
+
+    return True
+
+
+def freeze(module, example, check=None, mismatch=0.):
+    """
+    trace an inference-only wrapper on `example`, then freeze it: weights become constants and eval-only
+    branches are pruned, so scoring runs without python module dispatch
+    check: a real input batch, the frozen graph is compared with the eager module on it and None is returned
+    when they disagree (e.g. a conv / bn pair fold_bn does not know), callers then stay on the eager path
+    """
+    module = copy.deepcopy(module).eval()
+    folded = fold_bn(copy.deepcopy(module))
+
+    with torch.no_grad():
+        traced = torch.jit.freeze(torch.jit.trace(folded, example))
+        if hasattr(torch.jit, 'optimize_for_inference'):
+            traced = torch.jit.optimize_for_inference(traced)
+
+    if check is not None and not equivalent(module, traced, check, mismatch=mismatch):
+        print('frozen export disagrees with the eager model, scoring stays eager')
+        return None
+
+    return traced
+
+
+class LossScorer(nn.Module):
+    """
+    backbone + loss prediction head of ClassificationWithLoss, outputs flattened to (out, f1, f2, f3, f4, pred_loss)
+    """
+    def __init__(self, task, loss_module):
+        super(LossScorer, self).__init__()
+        self.task = unwrap(task)
+        self.loss_module = unwrap(loss_module)
+
+    def forward(self, x):
+        out, features = self.task(x)
+        pred_loss = self.loss_module(features)
+
+        return (out,) + tuple(features) + (pred_loss.view([-1, ]),)
+
+
+class CodeEncoder(nn.Module):
+    """
+    encoder + hash head of a strategy model up to the sign, the decoder never runs
+    """
+    def __init__(self, model):
+        super(CodeEncoder, self).__init__()
+        self.model = unwrap(model)
+
+    def forward(self, x):
+        return torch.sign(self.model.encode(x))
@@ -0,0 +1,55 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+WORD_BITS = 64
+
+
+def pack_code(code, code_dim):
+    """
+    pack sign codes into int64 words on the device the code lives on
+    entries > 0 become bit 1, everything else bit 0
+    return: [N, ceil(code_dim / 64)] int64 tensor, one row per code_dim-bit code
+    """
+    bits = (code.reshape([-1, code_dim]) > 0).long()
+
+    n_words = (code_dim + WORD_BITS - 1) // WORD_BITS
+    if n_words * WORD_BITS != code_dim:
+        bits = F.pad(bits, [0, n_words * WORD_BITS - code_dim])
+    bits = bits.view([-1, n_words, WORD_BITS])
+
+    # bits never overlap, so the sum is an exact bitwise or (bit 63 wraps into the sign bit)
+    shifts = torch.arange(WORD_BITS, dtype=torch.long, device=bits.device)
+    return (bits << shifts).sum(dim=2)
+
+
+def code_keys(packed):
+    """
+    turn packed words into one hashable / sortable key per code
+    single-word codes stay int64, longer codes are viewed as fixed-size byte strings
+    """
+    packed = np.ascontiguousarray(packed, dtype=np.int64)
+    if packed.shape[1] == 1:
+        return packed[:, 0]
+
+    return packed.view(np.dtype((np.void, packed.dtype.itemsize * packed.shape[1])))[:, 0]
+
+
+def group_by_code(keys):
+    """
+    bucket every code of the pool in a single sort
+    return: unique keys, bucket id of each code, bucket sizes
+    """
+    return np.unique(keys, return_inverse=True, return_counts=True)
+
+
+def rank_in_bucket(inverse, scores, counts, descending=True):
+    """
+    order the pool by bucket, then by score inside each bucket
+    return: the ordering and the rank of each ordered element within its own bucket
+    """
+    order = np.lexsort((-scores if descending else scores, inverse))
+    starts = np.cumsum(counts) - counts
+    rank = np.arange(len(order)) - starts[inverse[order]]
+
+    return order, rank
@@ -35,7 +35,7 @@ def mAP(trn_binary, tst_binary, trn_label, tst_label, is_cuda=True):
     AP = []
     Ns = torch.arange(1, trn_binary.size(0) + 1)
     if is_cuda:
-        Ns = Ns.cuda()
+        Ns = Ns.to(trn_binary.device)
     for i in range(tst_binary.size(0)):
         query_label, query_binary = tst_label[i], tst_binary[i]
         _, query_result = torch.sum((query_binary != trn_binary).long(), dim=1).sort()
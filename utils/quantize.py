@@ -0,0 +1,45 @@
+import copy
+
+import numpy as np
+
+import torch
+
+try:
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+except ImportError:
+    get_default_qconfig_mapping = None
+    from torch.quantization import get_default_qconfig
+    from torch.quantization.quantize_fx import prepare_fx, convert_fx
+
+
+def quantize_static(module, calibration, backend='fbgemm'):
+    """
+    post-training static int8 quantization (fx graph mode) of a cpu inference module
+    conv + bn + relu are fused, activation ranges observed on `calibration` (iterable of input batches)
+    """
+    module = copy.deepcopy(module).cpu().eval()
+    torch.backends.quantized.engine = backend
+
+    batches = [inputs.cpu().contiguous() for inputs in calibration]
+
+    if get_default_qconfig_mapping is not None:
+        prepared = prepare_fx(module, get_default_qconfig_mapping(backend), example_inputs=(batches[0],))
+    else:
+        prepared = prepare_fx(module, {'': get_default_qconfig(backend)})
+
+    with torch.no_grad():
+        for inputs in batches:
+            prepared(inputs)
+
+    return convert_fx(prepared)
+
+
+def rank_correlation(x, y):
+    """
+    spearman correlation of two score vectors, the only thing a ranking query depends on
+    """
+    x_rank = np.argsort(np.argsort(x, kind='stable'), kind='stable').astype(np.float64)
+    y_rank = np.argsort(np.argsort(y, kind='stable'), kind='stable').astype(np.float64)
+
+    return float(np.corrcoef(x_rank, y_rank)[0, 1])
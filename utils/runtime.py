@@ -0,0 +1,78 @@
+import os
+
+import torch
+from torch import nn
+
+from utils.distributed import is_distributed, local_world_size
+
+
+def get_device(config):
+    """
+    config.device: 'auto' (cuda when available, cpu otherwise), 'cpu', 'cuda' or 'cuda:N'
+    """
+    if config.device == 'auto':
+        return torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    return torch.device(config.device)
+
+
+def setup_runtime(config):
+    """
+    process wide settings, call once at start-up before building any model
+    num_threads / num_interop_threads: 0 keeps the torch default (one intra-op thread per physical core)
+    under torch.distributed the ranks of one machine split the intra-op budget evenly
+    """
+    device = get_device(config)
+
+    if is_distributed():
+        torch.set_num_threads(max(1, (config.num_threads or os.cpu_count() or 1) // local_world_size()))
+    elif config.num_threads:
+        torch.set_num_threads(config.num_threads)
+    if config.num_interop_threads:
+        try:
+            torch.set_num_interop_threads(config.num_interop_threads)
+        except RuntimeError:
+            # inter-op pool can only be sized before the first parallel op
+            pass
+
+    if device.type == 'cpu':
+        torch.set_flush_denormal(True)
+
+    return device
+
+
+def place(module, config):
+    """
+    move a model to the configured device, conv weights in channels_last when enabled
+    """
+    if config.channels_last:
+        return module.to(get_device(config), memory_format=torch.channels_last)
+
+    return module.to(get_device(config))
+
+
+def parallel(module, config):
+    """
+    DistributedDataParallel under torch.distributed (one replica per process, gradients all-reduced in backward),
+    else DataParallel when it pays off with more than one gpu, otherwise the bare module is returned
+    """
+    device = get_device(config)
+    if is_distributed():
+        device_ids = [torch.cuda.current_device()] if device.type == 'cuda' else None
+        return nn.parallel.DistributedDataParallel(module, device_ids=device_ids,
+                                                   find_unused_parameters=config.dist_find_unused_parameters)
+
+    if device.type == 'cuda' and config.gpu_cnt > 1:
+        return nn.DataParallel(module, device_ids=list(range(config.gpu_cnt)))
+
+    return module
+
+
+def inference_mode():
+    """
+    no autograd bookkeeping at all, for outputs that never flow back into training
+    """
+    if hasattr(torch, 'inference_mode'):
+        return torch.inference_mode()
+
+    return torch.no_grad()
@@ -1,3 +1,4 @@
+import hashlib
 import logging
 import numpy as np
 from torch import nn
@@ -43,6 +44,24 @@ def count_model_prameters(model):
     return count
 
 
+def state_fingerprint(obj):
+    """
+    sha1 over the state_dicts of a module, or of every module held as an attribute of obj (e.g. a Strategy)
+    """
+    if isinstance(obj, nn.Module):
+        modules = [('', obj)]
+    else:
+        modules = sorted([(k, v) for k, v in vars(obj).items() if isinstance(v, nn.Module)], key=lambda x: x[0])
+
+    sha = hashlib.sha1()
+    for name, module in modules:
+        for key, value in module.state_dict().items():
+            sha.update(f'{name}.{key}'.encode())
+            sha.update(value.detach().cpu().numpy().tobytes())
+
+    return sha.hexdigest()
+
+
 def record_image(writer, tag, epoch, image):
     writer.add_image(tag, image, epoch)
 
@@ -0,0 +1,105 @@
+import os
+import random
+import time
+import traceback
+import multiprocessing
+
+import numpy as np
+
+import torch
+
+from utils.distributed import is_distributed, main_process_file
+from utils.runtime import setup_runtime
+
+
+def thread_budget(config, workers):
+    """
+    intra-op threads of one trial process, the configured (or physical) budget split evenly
+    """
+    total = config.num_threads or os.cpu_count() or 1
+
+    return max(1, total // workers)
+
+
+def seed_trial(cycle_cnt):
+    random.seed(cycle_cnt * 1000)
+    np.random.seed(cycle_cnt * 1000)
+    torch.manual_seed(cycle_cnt * 1000)
+    torch.cuda.manual_seed_all(cycle_cnt * 1000)
+
+
+def run_trial(trial, cycle_cnt, config, threads):
+    """
+    entry point of a trial process: runtime settings, its own thread share and seeds, then the trial
+    """
+    setup_runtime(config)
+    torch.set_num_threads(threads)
+
+    seed_trial(cycle_cnt)
+    trial(cycle_cnt)
+
+
+def collect(fp, cycle_cnt, status):
+    """
+    append the record_{cycle}.txt of a finished trial to the aggregated results file
+    """
+    accuracy = []
+    if os.path.exists(f'record_{cycle_cnt}.txt'):
+        with open(f'record_{cycle_cnt}.txt') as f:
+            accuracy = [line.strip() for line in f if line.strip()]
+
+    fp.write(f'trial-{cycle_cnt}\t{status}\t' + ' '.join(accuracy) + '\n')
+    fp.flush()
+
+
+def run_trials(trial, cycles, config):
+    """
+    trial(cycle_cnt) for every cycle, config.trial_workers at a time, each in its own spawned process
+    a trial that raises or dies only marks its own line of config.trial_results as failed
+    with a single worker the trials run one after another in this process, as before
+    both ways every trial starts from the same seeds (seed_trial), so results do not depend on trial_workers
+    under torch.distributed every rank runs every trial in lockstep, so they are sequential and a failure is fatal
+    (a rank skipping to the next trial would deadlock the others)
+    """
+    workers = 1 if is_distributed() else max(1, config.trial_workers)
+    fp = main_process_file(config.trial_results, 'a')
+
+    if workers == 1:
+        for cycle_cnt in cycles:
+            try:
+                seed_trial(cycle_cnt)
+                trial(cycle_cnt)
+                collect(fp, cycle_cnt, 'done')
+            except Exception:
+                if is_distributed():
+                    raise
+                traceback.print_exc()
+                collect(fp, cycle_cnt, 'failed')
+
+        fp.close()
+        return
+
+    # spawn: no cuda context or rng state is inherited from this process
+    context = multiprocessing.get_context('spawn')
+    threads = thread_budget(config, workers)
+
+    pending, running = list(cycles), {}
+    while pending or running:
+        while pending and len(running) < workers:
+            cycle_cnt = pending.pop(0)
+            process = context.Process(target=run_trial, args=(trial, cycle_cnt, config, threads),
+                                      name=f'trial-{cycle_cnt}')
+            process.start()
+            running[cycle_cnt] = process
+
+        for cycle_cnt, process in list(running.items()):
+            if process.is_alive():
+                continue
+
+            process.join()
+            collect(fp, cycle_cnt, 'done' if process.exitcode == 0 else f'failed ({process.exitcode})')
+            del running[cycle_cnt]
+
+        time.sleep(1.)
+
+    fp.close()